@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Adaptive refinement of diameter/length sweeps
+=============================================
+
+A fixed grid spends as many FDTD runs far from the exciton as at the
+anti-crossing, where the map actually changes. `adaptive_sweep` starts from
+a coarse grid of sizes and, round by round, bisects the intervals whose
+end points differ most:
+
+    score = max(rms(S_i+1 - S_i) / spectral_tol, max|E_i+1 - E_i| / energy_tol)
+
+over every spectrum simulated per size (e.g. bare and coated) and, when
+`energies` is given, the tracked polariton energies (`tracked_branches`
+uses polariton_fit.branches). With `surrogate_terms` (lineshape terms per
+spectrum, e.g. (1, 2) for bare and coated), the score also counts the
+uncertainty of the lineshape surrogate (surrogate.py) at each interval's
+midpoint, mean std(T) / uncertainty_tol: the sizes where interpolation
+is least trustworthy are simulated next. Each round runs up to `batch` new sizes on the
+sweep pool (sweep.run_sweep). The sweep stops when every interval scores
+below 1, the point budget is spent, or the remaining intervals are
+narrower than `min_spacing` nm.
+
+    sizes, wl, spectra = adaptive_sweep(simulate_disk, [80, 140, 200],
+                                        points=lambda D: [(D, False), (D, True)],
+                                        budget=12, energies=tracked_branches,
+                                        surrogate_terms=(1, 2))
+
+Author: ReproAgent
+"""
+
+import numpy as np
+
+from polariton_fit import branches
+from surrogate import MapSurrogate
+from sweep import run_sweep, sweep_spectra, default_processes
+
+spectral_tol = 0.03     # rms change of T between neighbouring sizes
+energy_tol = 0.05       # eV change of a tracked branch between neighbouring sizes
+uncertainty_tol = 0.02  # mean surrogate std of T at an interval's midpoint
+min_spacing = 2       # nm
+
+
+def tracked_branches(wavelengths_nm, spectra):
+    """(sizes, 3) LSP/UP/LP energies from (sizes, [bare, coated], wavelengths) spectra."""
+    return np.stack(branches(wavelengths_nm, spectra[:, 0], spectra[:, 1]), -1)
+
+
+def interval_scores(wavelengths_nm, spectra, energies=None):
+    """Refinement score of each interval between consecutive sizes (see module docstring)."""
+    change = np.sqrt(np.nanmean((spectra[1:] - spectra[:-1])**2, axis=-1))
+    score = np.nanmax(change.reshape(len(change), -1), axis=1) / spectral_tol
+    if energies is not None:
+        E = energies(wavelengths_nm, spectra)
+        jump = np.abs(E[1:] - E[:-1]) / energy_tol
+        # a branch appearing or vanishing between two sizes also needs resolving
+        jump = np.where(np.isnan(E[1:]) != np.isnan(E[:-1]), np.inf, np.nan_to_num(jump))
+        score = np.maximum(score, np.max(jump, axis=1))
+    return score
+
+
+def surrogate_scores(sizes, wavelengths_nm, spectra, n_terms):
+    """Largest surrogate uncertainty at each interval's midpoint over the spectra, in uncertainty_tol."""
+    midpoints = (sizes[1:] + sizes[:-1]) / 2
+    std = [MapSurrogate(sizes, wavelengths_nm, spectra[:, j], n).uncertainty(midpoints)
+           for j, n in enumerate(n_terms)]
+    return np.max(std, axis=0) / uncertainty_tol
+
+
+def adaptive_sweep(simulate, sizes, points=lambda size: [(size,)], budget=20,
+                   energies=None, surrogate_terms=None, batch=None, processes=None):
+    """
+    Refine a sweep of simulate(*point) over sizes (nm).
+
+    points(size) lists the argument tuples simulated at each size (all must
+    return (wavelengths_nm, spectrum) on the same wavelength grid). Returns
+    (sizes, wavelengths_nm, spectra) with spectra shaped
+    (sizes, points per size, wavelengths), sorted by size.
+    """
+    batch = batch or default_processes()
+    done = {}
+
+    def run(new_sizes):
+        args = [p for size in new_sizes for p in points(size)]
+        wavelengths, values = sweep_spectra(run_sweep(simulate, args, processes))
+        values = values.reshape(len(new_sizes), -1, values.shape[-1])
+        done.update(zip(new_sizes, values))
+        return wavelengths
+
+    wavelengths = run(sorted(set(sizes)))
+    while len(done) < budget:
+        current = np.array(sorted(done))
+        spectra = np.array([done[s] for s in current])
+        score = interval_scores(wavelengths, spectra, energies)
+        if surrogate_terms is not None:
+            score = np.maximum(score, surrogate_scores(current, wavelengths, spectra, surrogate_terms))
+        score[np.diff(current) < 2 * min_spacing] = 0
+        worst = np.argsort(-score)[:min(batch, budget - len(done))]
+        worst = worst[score[worst] >= 1]
+        if len(worst) == 0:
+            break
+        new = sorted({int(round((current[i] + current[i + 1]) / 2)) for i in worst})
+        print(f"  Adaptive sweep: {len(done)} sizes, adding {new} "
+              f"(max score {score.max():.1f})", flush=True)
+        run(new)
+
+    sizes = np.array(sorted(done))
+    return sizes, wavelengths, np.array([done[s] for s in sizes])
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Checkpoints of long FDTD runs
+=============================
+
+A coated 200 nm disk at resolution 60 runs for minutes. A killed job used
+to start such a run again from t = 0. A RunCheckpoint dumps a run about every
+`interval` wall-clock seconds (RUN_CHECKPOINT_INTERVAL, default 600;
+0 turns it off) into RUN_CHECKPOINT_DIR/<key> (default ./.run_checkpoints).
+Every dump is collective, so all ranks of a run must take it at the same
+timestep: start() converts the interval once into a number of timesteps,
+from the planner's cost per voxel-step (planner.calibrate on the recorded
+telemetry) and the cell's voxel counts, and the run dumps whenever
+sim.timestep() is a multiple of it. The cost model is read when this
+module is imported, before any run of the job has appended telemetry, so
+every rank converts with the same coefficients. Each dump holds:
+
+- the chunk layout (sim.dump_chunk_layout), so the restart splits the cell
+  the same way, also under MPI;
+- the structure and fields (sim.dump);
+- the DFT accumulators of the flux monitors (sim.save_flux, one HDF5 file
+  per monitor with every rank's chunks), with the Meep time they belong
+  to.
+
+A run that finds a dump for its key loads all three and continues from the
+last dumped timestep. The key is the run's result_cache.simulation_key,
+so a changed run never resumes from a foreign dump. The dump is written
+next to the old one and swapped in, so a crash while dumping keeps the
+previous one. In the run functions:
+
+    checkpoint = RunCheckpoint(key)
+    sim = mp.Simulation(..., chunk_layout=checkpoint.chunk_layout)
+    trans = sim.add_flux(fcen, df, nfreq, flux_region)
+    checkpoint.start(sim, [trans])          # resumes if a dump exists
+    sim.run(checkpoint, until_after_sources=stop)
+    checkpoint.clear()
+
+It needs a Meep built with HDF5, with the fields' output directory left
+at the working directory (sim.use_output_directory is not supported).
+Completed sweep points are checkpointed separately by
+run_sweep(..., checkpoint=directory).
+
+Author: ReproAgent
+"""
+
+import os
+import shutil
+
+import meep as mp
+import numpy as np
+
+from planner import calibrate
+from telemetry import dispersive_voxels
+
+CHECKPOINT_DIR = os.environ.get('RUN_CHECKPOINT_DIR', '.run_checkpoints')
+INTERVAL = float(os.environ.get('RUN_CHECKPOINT_INTERVAL', 600))   # wall-clock s between dumps
+
+_model = calibrate()    # the same on every rank: no run of this job has finished yet
+
+
+def seconds_per_step(sim, model=None):
+    """Estimated wall seconds of one timestep of sim on each of its ranks (planner.calibrate model)."""
+    model = model or _model
+    voxels = np.prod([max(1, int(round(getattr(sim.cell_size, a) * sim.resolution))) for a in 'xyz'])
+    dispersive = dispersive_voxels(sim.cell_size, sim.geometry, sim.resolution)
+    return ((model['a'] * voxels + model['b'] * dispersive)
+            / 2 ** len(sim.symmetries) / mp.count_processors())
+
+
+class RunCheckpoint:
+    """Periodic dump of one run (structure, fields, flux DFTs) and resume from it."""
+
+    def __init__(self, key, interval=INTERVAL):
+        self.key = key
+        self.path = os.path.join(CHECKPOINT_DIR, key)
+        self.interval = interval
+        self.sim = None
+        self.fluxes = []
+        self.steps = 0
+        self._last = 0           # timestep of the last dump or load
+        # a crash between removing the old dump and renaming the new one
+        if not self._complete(self.path) and self._complete(self.path + '.new') and mp.am_master():
+            os.replace(self.path + '.new', self.path)
+        mp.all_wait()
+        self.saved = self._complete(self.path)
+
+    @staticmethod
+    def _complete(path):
+        return os.path.exists(os.path.join(path, 'meep_time.npy'))   # written last
+
+    @property
+    def chunk_layout(self):
+        """Chunk layout file of the saved dump, for mp.Simulation(chunk_layout=...); else None."""
+        return os.path.join(self.path, 'chunk_layout.h5') if self.saved else None
+
+    def start(self, sim, fluxes):
+        """Track sim and its flux monitors; load the saved dump if there is one (True then)."""
+        self.sim, self.fluxes = sim, list(fluxes)
+        if self.interval > 0:
+            self.steps = max(1, int(round(self.interval / seconds_per_step(sim))))
+        if not self.saved:
+            return False
+        sim.load(self.path, load_structure=True, load_fields=True)
+        sim.init_sim()
+        self._fluxes(self.path, sim.load_flux)
+        self._last = sim.timestep()
+        meep_time = float(np.load(os.path.join(self.path, 'meep_time.npy')))
+        print(f"  resuming run {self.key[:12]} from t = {meep_time:g}")
+        return True
+
+    def __call__(self, sim):
+        """Step function: dump every `steps` timesteps (the same step on every rank)."""
+        step = sim.timestep()
+        if self.steps and step % self.steps == 0 and step != self._last:
+            self.dump()
+            self._last = step
+
+    def _fluxes(self, directory, save_or_load):
+        """sim.save_flux or sim.load_flux of every monitor to/from directory/flux<i>.h5."""
+        sim = self.sim
+        prefix, sim.filename_prefix = sim.filename_prefix, ''
+        try:
+            for i, flux in enumerate(self.fluxes):
+                save_or_load(os.path.relpath(os.path.join(directory, f'flux{i}')), flux)
+        finally:
+            sim.filename_prefix = prefix
+
+    def dump(self):
+        sim, new = self.sim, self.path + '.new'
+        if mp.am_master():
+            shutil.rmtree(new, ignore_errors=True)
+            os.makedirs(new)
+        mp.all_wait()
+        sim.dump_chunk_layout(os.path.join(new, 'chunk_layout.h5'))
+        sim.dump(new, dump_structure=True, dump_fields=True)
+        self._fluxes(new, sim.save_flux)
+        mp.all_wait()
+        if mp.am_master():
+            np.save(os.path.join(new, 'meep_time.npy'), sim.meep_time())
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.replace(new, self.path)
+        mp.all_wait()
+        self.saved = True
+
+    def clear(self):
+        """Remove the dump once the run has finished."""
+        if mp.am_master():
+            shutil.rmtree(self.path, ignore_errors=True)
+            shutil.rmtree(self.path + '.new', ignore_errors=True)
+        self.saved = False
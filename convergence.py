@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Stop runs when the accumulated flux spectra have converged
+==========================================================
+
+mp.stop_when_fields_decayed(50, mp.Ex, pt, 1e-3) samples the field at one
+point and only checks every 50 time units, so a run always continues in
+50-unit blocks until a single point has decayed by 1e-3 -- the flat
+reference in fig4_log.txt ran 12002 timesteps although its spectrum had
+settled long before.
+
+FluxConvergence instead watches what the scripts actually keep: the DFT
+flux spectra inside a wavelength band. It is used in place of the old
+condition,
+
+    stop = FluxConvergence([trans], sim, tol=1e-3, decay=(mp.Ex, pt, 50, 1e-3))
+    sim.run(until_after_sources=stop)
+    stop.report()
+
+and halts once the in-band spectra change by less than `tol` (relative to
+their peak) over `patience` consecutive checks. With `decay` it also
+follows the old criterion alongside, extrapolates the exponential decay of
+its window maxima to estimate when that criterion would have stopped, and
+reports the timesteps saved. report() also appends the run's size and
+cost to the run telemetry (telemetry.py) that planner.py calibrates on.
+
+Author: ReproAgent
+"""
+
+import time
+
+import numpy as np
+import meep as mp
+
+from telemetry import log_run
+
+
+class FluxConvergence:
+    """until_after_sources condition on band-limited flux-spectrum convergence."""
+
+    def __init__(self, monitors, sim, wl_min=0.4, wl_max=0.8, tol=1e-3,
+                 check_dt=5, patience=2, decay=None):
+        self.monitors = monitors
+        self.sim = sim
+        self.tol = tol
+        self.check_dt = check_dt
+        self.patience = patience
+        self.wl_band = (wl_min, wl_max)
+        self.decay = decay
+
+        self._band = None
+        self._previous = None
+        self._settled = 0
+        self._next_check = None
+        self._decay_state = None
+
+        self.t_start = None
+        self.t_stop = None
+        self.change = np.inf
+        self._wall_start = time.time()
+        self._first_step = sim.timestep() if sim.fields is not None else 0   # > 0 when resumed
+
+    # -- spectrum convergence -------------------------------------------------
+
+    def _spectra(self):
+        if self._band is None:
+            self._band = []
+            for monitor in self.monitors:
+                wl = 1 / np.array(mp.get_flux_freqs(monitor))
+                self._band.append((wl >= self.wl_band[0]) & (wl <= self.wl_band[1]))
+        return np.concatenate([np.array(mp.get_fluxes(m))[band]
+                               for m, band in zip(self.monitors, self._band)])
+
+    def __call__(self, sim):
+        t = sim.round_time()
+        if self.t_start is None:
+            self.t_start = t
+            self._next_check = t + self.check_dt
+        if self.decay is not None:
+            self._track_decay(sim, t)
+        if t < self._next_check:
+            return False
+        self._next_check = t + self.check_dt
+
+        current = self._spectra()
+        scale = np.max(np.abs(current))
+        if self._previous is not None and scale > 0:
+            self.change = np.max(np.abs(current - self._previous)) / scale
+            self._settled = self._settled + 1 if self.change < self.tol else 0
+        self._previous = current
+
+        if self._settled >= self.patience:
+            self.t_stop = t
+            return True
+        return False
+
+    # -- legacy field-decay criterion, followed for the savings estimate -------
+
+    def _track_decay(self, sim, t):
+        component, point, dt, decay_by = self.decay
+        state = self._decay_state
+        if state is None:
+            state = self._decay_state = {'t0': t, 'max_abs': 0.0, 'cur_max': 0.0,
+                                         'windows': [], 'stopped_at': None}
+        value = abs(sim.get_field_point(component, point)) ** 2
+        state['cur_max'] = max(state['cur_max'], value)
+        if t > state['t0'] + dt:
+            state['t0'] = t
+            state['max_abs'] = max(state['max_abs'], state['cur_max'])
+            state['windows'].append((t, state['cur_max']))
+            if state['stopped_at'] is None and state['cur_max'] <= state['max_abs'] * decay_by:
+                state['stopped_at'] = t
+            state['cur_max'] = 0.0
+
+    def _legacy_stop_time(self):
+        """Time at which stop_when_fields_decayed would have stopped (estimated)."""
+        state = self._decay_state
+        if state is None:
+            return None
+        if state['stopped_at'] is not None:
+            return state['stopped_at']
+        _, dt, decay_by = self.decay[1:]
+        windows = [w for w in state['windows'] if w[1] > 0]
+        if len(windows) < 2:
+            # no decay observed yet: the old criterion needs at least two windows
+            return self.t_start + 2 * dt
+        (_, m_prev), (t_last, m_last) = windows[-2], windows[-1]
+        ratio = m_last / m_prev
+        if ratio >= 1:
+            return None
+        target = state['max_abs'] * decay_by
+        n_windows = max(1, int(np.ceil(np.log(target / m_last) / np.log(ratio))))
+        return t_last + n_windows * dt
+
+    # -- reporting -------------------------------------------------------------
+
+    def _steps(self, duration):
+        return int(round(duration * self.sim.resolution / self.sim.Courant))
+
+    @property
+    def steps(self):
+        """Timesteps run after the sources were turned off."""
+        return self._steps(self.t_stop - self.t_start) if self.t_stop is not None else None
+
+    @property
+    def saved_steps(self):
+        """Estimated timesteps saved against the field-decay criterion (None if unknown)."""
+        t_legacy = self._legacy_stop_time()
+        if t_legacy is None or self.t_stop is None:
+            return None
+        return self._steps(t_legacy - self.t_stop)
+
+    def report(self, label=''):
+        log_run(self.sim, time.time() - self._wall_start, label, self._first_step)
+        if self.t_stop is None:
+            print(f"  {label}flux spectra not converged (last change {self.change:.1e})")
+            return
+        line = f"  {label}flux converged to {self.tol:.0e} after {self.steps} steps"
+        saved = self.saved_steps
+        if saved is not None:
+            line += f", ~{saved} steps saved vs field decay"
+        print(line)
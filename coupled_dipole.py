@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Coupled-dipole prediction of the nanodisk LSP position
+======================================================
+
+A millisecond-scale estimate of where the localized surface plasmon of the
+fig3 disk arrays sits, before committing to FDTD. Each 40 nm-tall Al disk
+is an oblate spheroid (semi-axes D/2, D/2, h/2) with the quasi-static
+polarizability and the modified long-wavelength (MLWA) correction
+
+    alpha = alpha_s / (1 - k^2 alpha_s / a - 2i k^3 alpha_s / 3),
+    alpha_s = abc (eps - eps_m) / (3 [eps_m + L (eps - eps_m)]),
+
+embedded in the average of the glass and air permittivities. The array
+couples through the lattice sum S = sum_{R != 0} G_xx(R), evaluated with
+Ewald's splitting so that a few lattice and reciprocal vectors suffice,
+and the zeroth-order transmission of the dipole sheet is
+
+    T = |1 + 2 pi i k alpha_eff / A|^2,    1/alpha_eff = 1/alpha - S.
+
+Everything is vectorized over diameters and wavelengths. `lsp_energy`
+feeds fig3ef_exact.py (lsp_source = 'dipole'), and `straddling` picks the
+diameters whose LSP brackets the 590 nm exciton, i.e. the ones worth a
+full FDTD run. Running this file prints the predicted LSP positions and
+checks the Ewald sums against direct summation.
+
+Author: ReproAgent
+"""
+
+import time
+
+import numpy as np
+from scipy.special import elliprd, erf, erfc
+
+from transfer_matrix import medium_epsilon
+from unit_cells import Al, diameters_nm, gap, h_disk   # the fig3 disk cells
+
+eps_medium = (1.51**2 + 1) / 2   # disk on glass, air above
+wl_exciton = 0.590
+
+
+def depolarization_factors(a, b, c):
+    """Depolarization factors (L_a, L_b, L_c) of an ellipsoid with semi-axes a, b, c."""
+    a, b, c = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (a, b, c)))
+    L_a = a * b * c / 3 * elliprd(b**2, c**2, a**2)
+    L_b = a * b * c / 3 * elliprd(c**2, a**2, b**2)
+    return L_a, L_b, 1 - L_a - L_b
+
+
+def ellipsoid_polarizability(eps, eps_m, a, b, c, wavelengths, axis=0):
+    """
+    MLWA polarizability (volume units, p = eps_m alpha E) of an ellipsoid
+    with semi-axes a, b, c, for a field along `axis` (0, 1, 2 for a, b, c).
+    """
+    L = depolarization_factors(a, b, c)[axis]
+    a_field = (a, b, c)[axis]
+    k = 2 * np.pi * np.sqrt(eps_m) / np.asarray(wavelengths)
+    alpha_s = a * b * c * (eps - eps_m) / (3 * (eps_m + L * (eps - eps_m)))
+    return alpha_s / (1 - k**2 * alpha_s / a_field - 2j / 3 * k**3 * alpha_s)
+
+
+def lattice_sum(k, period_x, period_y, axis='x', n_max=3):
+    """
+    Ewald-summed S = sum_{R != 0} G(R) for in-plane dipoles along `axis` on a
+    rectangular lattice, G = (k^2 + d^2/dx^2) e^{ikR}/R. k, period_x and
+    period_y broadcast against each other.
+    """
+    k, ax, ay = np.broadcast_arrays(np.asarray(k, dtype=complex),
+                                    np.asarray(period_x, dtype=float),
+                                    np.asarray(period_y, dtype=float))
+    k, ax, ay = k[..., None], ax[..., None], ay[..., None]
+    area = ax * ay
+    E = np.sqrt(np.pi / area)
+    q = k / (2 * E)
+    m, n = (v.ravel() for v in np.meshgrid(np.arange(-n_max, n_max + 1),
+                                           np.arange(-n_max, n_max + 1), indexing='ij'))
+
+    # real-space part, R != 0
+    x, y = m * ax, n * ay
+    origin = (m == 0) & (n == 0)
+    d = np.where(origin, 1.0, np.hypot(x, y))
+    h = 2 * E / np.sqrt(np.pi) * np.exp(q**2 - (d * E)**2)
+    g_plus = np.exp(1j * k * d) * erfc(d * E + 1j * q)
+    g_minus = np.exp(-1j * k * d) * erfc(d * E - 1j * q)
+    s, delta = g_plus + g_minus, g_plus - g_minus
+    s1 = 1j * k * delta - 2 * h
+    s2 = -k**2 * s + 4 * d * E**2 * h
+    f = s / (2 * d)
+    f1 = s1 / (2 * d) - s / (2 * d**2)
+    f2 = s2 / (2 * d) - s1 / d**2 + s / d**3
+    cos2 = ((x if axis == 'x' else y) / d)**2
+    spatial = np.sum(np.where(origin, 0, k**2 * f + f2 * cos2 + f1 * (1 - cos2) / d), axis=-1)
+
+    # reciprocal-space part
+    Gx, Gy = 2 * np.pi * m / ax, 2 * np.pi * n / ay
+    gamma = -1j * np.sqrt(k**2 - Gx**2 - Gy**2)
+    G_along = Gx if axis == 'x' else Gy
+    spectral = 2 * np.pi / area[..., 0] * np.sum((k**2 - G_along**2) * erfc(gamma / (2 * E)) / gamma, axis=-1)
+
+    # R = 0 term of the real-space part minus the dipole's own field
+    k, E, q = k[..., 0], E[..., 0], q[..., 0]
+    h0 = 2 * E / np.sqrt(np.pi) * np.exp(q**2)
+    self_term = -2j / 3 * k**3 * (1 + erf(1j * q)) + 2 / 3 * h0 * (E**2 - k**2)
+
+    return spatial + spectral + self_term
+
+
+def direct_lattice_sum(k, period_x, period_y, axis='x', n_max=200):
+    """Brute-force sum of G(R) over |m|, |n| <= n_max (for checking; needs Im k > 0)."""
+    m, n = np.meshgrid(np.arange(-n_max, n_max + 1), np.arange(-n_max, n_max + 1), indexing='ij')
+    x, y = m * period_x, n * period_y
+    R = np.hypot(x, y)
+    R[n_max, n_max] = np.inf
+    cos2 = ((x if axis == 'x' else y) / R)**2
+    G = np.exp(1j * k * R) * (k**2 / R * (1 - cos2) + (1 / R**3 - 1j * k / R**2) * (3 * cos2 - 1))
+    return np.sum(G)
+
+
+def disk_transmission(diameters_nm, wavelengths, gap=gap, h=h_disk, material=Al, eps_m=eps_medium):
+    """Zeroth-order T of square disk arrays (period D + gap), shape (diameters, wavelengths)."""
+    D = np.asarray(diameters_nm, dtype=float)[:, None] / 1000
+    wl = np.asarray(wavelengths, dtype=float)[None, :]
+    eps = medium_epsilon(material, 1 / wl)
+    alpha = ellipsoid_polarizability(eps, eps_m, D / 2, D / 2, h / 2, wl)
+    k = 2 * np.pi * np.sqrt(eps_m) / wl
+    period = D + gap
+    S = lattice_sum(k, period, period)
+    alpha_eff = 1 / (1 / alpha - S)
+    return np.abs(1 + 2j * np.pi * k * alpha_eff / period**2)**2
+
+
+def lsp_wavelength(diameters_nm, wavelengths=np.linspace(0.35, 1.0, 326), **kwargs):
+    """Wavelength (µm) of the transmission dip of each disk array."""
+    T = disk_transmission(diameters_nm, wavelengths, **kwargs)
+    i = np.clip(np.argmin(T, axis=1), 1, len(wavelengths) - 2)
+    rows = np.arange(len(i))
+    # parabolic refinement around the sampled minimum
+    t0, t1, t2 = T[rows, i - 1], T[rows, i], T[rows, i + 1]
+    step = wavelengths[1] - wavelengths[0]
+    denom = t0 - 2 * t1 + t2
+    shift = np.where(denom > 0, 0.5 * (t0 - t2) / np.where(denom > 0, denom, 1), 0)
+    return wavelengths[i] + shift * step
+
+
+def lsp_energy(diameters_nm, **kwargs):
+    """LSP energy (eV) of each disk array."""
+    return 1.23984 / lsp_wavelength(diameters_nm, **kwargs)
+
+
+def straddling(diameters_nm, wl_target=wl_exciton, **kwargs):
+    """
+    Boolean mask of the diameters next to the crossing of the LSP with
+    wl_target: each adjacent pair whose LSPs lie on opposite sides of it.
+    """
+    wl = lsp_wavelength(diameters_nm, **kwargs)
+    side = np.sign(wl - wl_target)
+    crossing = side[:-1] != side[1:]
+    mask = np.zeros(len(wl), dtype=bool)
+    mask[:-1] |= crossing
+    mask[1:] |= crossing
+    return mask
+
+
+if __name__ == "__main__":
+    k = 2 * np.pi * np.sqrt(eps_medium) / 0.6 * (1 + 0.05j)
+    for px, py, axis in [(0.32, 0.32, 'x'), (0.32, 0.19, 'x'), (0.32, 0.19, 'y')]:
+        ewald, direct = lattice_sum(k, px, py, axis), direct_lattice_sum(k, px, py, axis)
+        print(f"lattice sum {px}x{py} {axis}: Ewald {ewald:.4f}, direct {direct:.4f}")
+
+    t0 = time.time()
+    wl = lsp_wavelength(diameters_nm)
+    elapsed = time.time() - t0
+    print(f"\nPredicted LSP ({elapsed * 1000:.1f} ms):")
+    for D, w, s in zip(diameters_nm, wl, straddling(diameters_nm)):
+        print(f"  D = {D:3d} nm: {w * 1000:.0f} nm, {1.23984 / w:.2f} eV{'  <- straddles 590 nm' if s else ''}")
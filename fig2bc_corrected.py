@@ -18,7 +18,9 @@ import numpy as np
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-from meep.materials import Al
+from symmetry import mirror_symmetries
+from resolution_study import convergence_study
+from unit_cells import Al, ITO, glass, h_ITO, h_disk
 
 print("=" * 60)
 print("CORRECTED Figure 2b,c: Field Enhancement")
@@ -29,22 +31,12 @@ print("=" * 60)
 wavelength = 0.530  # 530 nm
 frequency = 1 / wavelength
 
-h_disk = 0.040   # 40 nm height
-h_ITO = 0.030    # 30 nm ITO
 z_monitor = 0.010  # 10 nm above ITO
 
 resolution = 100  # 10 nm
+convergence_ladder = None  # e.g. (40, 60, 80, 100): extrapolate peak |E/E0| (resolution_study.py)
 
-# Materials
-glass = mp.Medium(epsilon=1.51**2)
-
-omega_p_ITO = 1.78e15 / (2 * np.pi * 3e14)
-gamma_ITO = 1.5e14 / (2 * np.pi * 3e14)
-ITO = mp.Medium(epsilon=3.9, E_susceptibilities=[
-    mp.DrudeSusceptibility(frequency=omega_p_ITO, gamma=gamma_ITO, sigma=1.0)
-])
-
-def get_field_enhancement(geometry_type='disk', D_nm=140, L_nm=65, W_nm=25):
+def get_field_enhancement(geometry_type='disk', D_nm=140, L_nm=65, W_nm=25, resolution=resolution):
     """
     CORRECTED: Uses Ellipsoid for nanorod instead of Block.
     """
@@ -111,7 +103,8 @@ def get_field_enhancement(geometry_type='disk', D_nm=140, L_nm=65, W_nm=25):
         boundary_layers=pml_layers,
         sources=sources,
         resolution=resolution,
-        k_point=mp.Vector3(0, 0, 0)
+        k_point=mp.Vector3(0, 0, 0),
+        symmetries=mirror_symmetries(geometry, sources, pml_layers, mp.Vector3(0, 0, 0))
     )
     
     # Run to steady state
@@ -142,6 +135,11 @@ print("\n" + "=" * 60)
 print("Running simulations...")
 print("=" * 60)
 
+if convergence_ladder:
+    for args in (('disk', 140), ('rod', 140, 65, 25)):
+        convergence_study(get_field_enhancement, args, convergence_ladder,
+                          observe=lambda value: {'peak |E/E0|': value[2].max()}, target=0.1)
+
 x_disk, y_disk, E_disk = get_field_enhancement('disk', D_nm=140)
 x_rod, y_rod, E_rod = get_field_enhancement('rod', L_nm=65, W_nm=25)
 
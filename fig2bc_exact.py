@@ -17,31 +17,13 @@ import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from scipy.ndimage import gaussian_filter
+from unit_cells import Al_Palik, ITO, glass, h_ITO, h_disk
 
 print("=" * 60)
 print("FIGURE 2b,c - Electric Field Enhancement (Paper Format)")
 print("=" * 60)
 
-# Use Palik Al for better accuracy
-Al_Palik = mp.Medium(
-    epsilon=1.0,
-    E_susceptibilities=[
-        mp.DrudeSusceptibility(frequency=12.10, gamma=0.081, sigma=1.0),
-        mp.LorentzianSusceptibility(frequency=1.21, gamma=0.40, sigma=2.0)
-    ]
-)
-
-# Materials
-glass = mp.Medium(epsilon=1.51**2)
-omega_p_ITO = 1.78e15 / (2 * np.pi * 3e14)
-gamma_ITO = 1.5e14 / (2 * np.pi * 3e14)
-ITO = mp.Medium(epsilon=3.9, E_susceptibilities=[
-    mp.DrudeSusceptibility(frequency=omega_p_ITO, gamma=gamma_ITO, sigma=1.0)
-])
-
-# Geometry parameters (µm)
-h_disk = 0.040
-h_ITO = 0.030
+# Geometry and materials (Palik Al for better accuracy): unit_cells.py
 resolution = 100  # High resolution for near-field
 
 def simulate_field(structure_type):
@@ -6,6 +6,10 @@ FAST version: Reproduce Figure 3c,d (fewer diameters, lower resolution)
 Reduced from 9 to 5 diameters, resolution 60 instead of 80.
 Expected time: ~10-15 minutes instead of 30-40.
 
+With isolated_companion = True each disk is also simulated alone in
+cylindrical coordinates at 2 nm resolution (simulate_isolated_disk):
+extinction cross section and edge near-field enhancement spectra.
+
 Author: ReproAgent
 """
 
@@ -14,9 +18,20 @@ import numpy as np
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-from meep.materials import Al
 from scipy.ndimage import gaussian_filter1d
 import time
+from reference_flux import reference_flux
+from convergence import FluxConvergence
+from sweep import is_master, run_sweep, sweep_spectra
+from symmetry import mirror_symmetries
+from result_cache import simulation_key, cached_run
+from checkpoint import RunCheckpoint
+from adaptive_sweep import adaptive_sweep, tracked_branches
+from surrogate import dense_maps
+from multifidelity import multifidelity_sweep
+from resolution_study import convergence_study, dip_wavelengths
+from planner import figure_settings, unit_cell_cost
+from unit_cells import Al, ITO, TDBC, disk_unit_cell, dpml, glass, h_disk, h_ITO, h_TDBC, sz
 
 print("=" * 70)
 print("FAST Figure 3c,d: Reduced diameters and resolution")
@@ -26,93 +41,63 @@ print("=" * 70)
 diameters_nm = np.array([80, 110, 140, 170, 200])
 print(f"\nDiameters: {diameters_nm} nm ({len(diameters_nm)} values)")
 
-# Geometry
-h_disk = 0.040
-h_ITO = 0.030
-h_TDBC = 0.020
-gap = 0.180
-
-# Lower resolution for speed
+# Lower resolution for speed (geometry and materials: unit_cells.py)
 resolution = 60  # 16.7 nm (was 80)
-sz = 2.0
-dpml = 0.4
 
 wl_min, wl_max = 0.4, 0.8
 freq_min, freq_max = 1/wl_max, 1/wl_min
 fcen = (freq_min + freq_max) / 2
 df = freq_max - freq_min
 nfreq = 150
+flux_tol = 1e-3  # stop once the in-band flux spectra change less than this
+reference_method = 'fdtd'  # or 'tmm': flat-stack reference by transfer matrices (transfer_matrix.py)
+isolated_companion = False  # also run each disk alone in cylindrical coordinates (simulate_isolated_disk)
+resolution_cyl = 500        # 2 nm, for the cylindrical runs
+adaptive_budget = None      # e.g. 12: refine diameters near the anti-crossing up to this many (adaptive_sweep.py)
+surrogate_maps = False      # plot 1 nm-step surrogate maps instead of gouraud shading (surrogate.py)
+multifidelity = None        # e.g. (40, 100): all points coarse, near-exciton points fine (multifidelity.py)
+convergence_ladder = None   # e.g. (30, 40, 60, 80): extrapolate the middle diameter's dips (resolution_study.py)
+time_budget = None          # e.g. '30m' or '2ch': resolution and diameters chosen by planner.py
+
+if time_budget:
+    resolution, diameters_nm = figure_settings('fig3', time_budget)
+    print(f"Planned for {time_budget}: diameters {diameters_nm} nm")
 
 print(f"Resolution: {resolution} pts/µm ({1000/resolution:.1f} nm)")
 
-# Materials
-glass = mp.Medium(epsilon=1.51**2)
-
-omega_p_ITO = 1.78e15 / (2 * np.pi * 3e14)
-gamma_ITO = 1.5e14 / (2 * np.pi * 3e14)
-ITO = mp.Medium(epsilon=3.9, E_susceptibilities=[
-    mp.DrudeSusceptibility(frequency=omega_p_ITO, gamma=gamma_ITO, sigma=1.0)
-])
-
-# TDBC - CORRECTED
-omega_X = 3.22e15 / (2 * np.pi * 3e14)
-gamma_X = 1.0e14 / (2 * np.pi * 3e14)
-f_TDBC = 0.45
-TDBC = mp.Medium(epsilon=2.56, E_susceptibilities=[
-    mp.LorentzianSusceptibility(frequency=omega_X, gamma=gamma_X, sigma=f_TDBC)
-])
-
-def simulate_disk(D_nm, with_tdbc=False):
-    D = D_nm / 1000
-    period = D + gap
-    sx = sy = period
-    cell_size = mp.Vector3(sx, sy, sz)
-    
-    z_bottom = -sz/2 + dpml
-    z_glass_top = z_bottom + 0.5
-    z_ITO_top = z_glass_top + h_ITO
-    z_disk_top = z_ITO_top + h_disk
-    z_source = z_glass_top - 0.15
-    z_trans = z_disk_top + (h_TDBC if with_tdbc else 0) + 0.15
+def simulate_disk(D_nm, with_tdbc=False, resolution=resolution):
+    cell_size, z_source, z_trans, geometry_ref, geometry = disk_unit_cell(D_nm, with_tdbc, resolution=resolution)
+    sx, sy = cell_size.x, cell_size.y
     
     pml_layers = [mp.PML(thickness=dpml, direction=mp.Z)]
     sources = [mp.Source(src=mp.GaussianSource(fcen, fwidth=df), component=mp.Ex,
                          center=mp.Vector3(0, 0, z_source), size=mp.Vector3(sx, sy, 0))]
     
-    geometry_ref = [
-        mp.Block(size=mp.Vector3(mp.inf, mp.inf, z_glass_top - z_bottom),
-                 center=mp.Vector3(0, 0, (z_glass_top + z_bottom)/2), material=glass),
-        mp.Block(size=mp.Vector3(mp.inf, mp.inf, h_ITO),
-                 center=mp.Vector3(0, 0, z_glass_top + h_ITO/2), material=ITO)
-    ]
-    
-    geometry = geometry_ref.copy()
-    
-    if with_tdbc:
-        geometry.append(mp.Block(size=mp.Vector3(mp.inf, mp.inf, h_TDBC),
-                                 center=mp.Vector3(0, 0, z_ITO_top + h_TDBC/2), material=TDBC))
-        geometry.append(mp.Cylinder(radius=D/2 + h_TDBC, height=h_disk + h_TDBC,
-                                    center=mp.Vector3(0, 0, z_ITO_top + (h_disk + h_TDBC)/2), material=TDBC))
+    # Reference (flat stack, shared across diameters)
+    freqs, flux_ref = reference_flux(geometry_ref, sx, sy, z_source, z_trans, sz, dpml,
+                                     resolution, fcen, df, nfreq, flux_tol, reference_method)
     
-    geometry.append(mp.Cylinder(radius=D/2, height=h_disk,
-                                center=mp.Vector3(0, 0, z_ITO_top + h_disk/2), material=Al))
+    # Full (stored on disk, keyed by everything that determines the run)
+    flux_region = mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0))
     
-    # Reference
-    sim_ref = mp.Simulation(cell_size=cell_size, geometry=geometry_ref, boundary_layers=pml_layers,
-                            sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0))
-    trans_ref = sim_ref.add_flux(fcen, df, nfreq,
-                                  mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0)))
-    sim_ref.run(until_after_sources=mp.stop_when_fields_decayed(50, mp.Ex, mp.Vector3(0, 0, z_trans), 1e-3))
-    flux_ref = np.array(mp.get_fluxes(trans_ref))
-    freqs = np.array(mp.get_flux_freqs(trans_ref))
+    def run_full():
+        checkpoint = RunCheckpoint(key)
+        sim = mp.Simulation(cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
+                            sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0),
+                            symmetries=mirror_symmetries(geometry, sources, pml_layers, mp.Vector3(0, 0, 0)),
+                            chunk_layout=checkpoint.chunk_layout)
+        trans = sim.add_flux(fcen, df, nfreq, flux_region)
+        checkpoint.start(sim, [trans])
+        stop = FluxConvergence([trans], sim, wl_min, wl_max, flux_tol,
+                               decay=(mp.Ex, mp.Vector3(0, 0, z_trans), 50, 1e-3))
+        sim.run(checkpoint, until_after_sources=stop)
+        stop.report()
+        checkpoint.clear()
+        return {'flux': np.array(mp.get_fluxes(trans))}
     
-    # Full
-    sim = mp.Simulation(cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
-                        sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0))
-    trans = sim.add_flux(fcen, df, nfreq,
-                         mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0)))
-    sim.run(until_after_sources=mp.stop_when_fields_decayed(50, mp.Ex, mp.Vector3(0, 0, z_trans), 1e-3))
-    flux = np.array(mp.get_fluxes(trans))
+    key = simulation_key(cell_size, resolution, geometry, sources, [(fcen, df, nfreq, flux_region)],
+                         boundary_layers=pml_layers, flux_tol=flux_tol)
+    flux = cached_run(key, run_full)['flux']
     
     T = np.where(flux_ref > 0, flux / flux_ref, 0)
     T = np.clip(T, 0, 1.5)
@@ -121,43 +106,128 @@ def simulate_disk(D_nm, with_tdbc=False):
     
     return 1 / freqs * 1000, T
 
-# Run simulations
-print("\n" + "=" * 70)
-print("Part 1: Bare Nanodisks")
-print("=" * 70)
-
-bare_T = []
-wavelengths = None
-t_start = time.time()
+def simulate_isolated_disk(D_nm, with_tdbc=False):
+    """
+    Single disk on the glass/ITO substrate in cylindrical coordinates.
+
+    The (coated) disk is rotationally symmetric, so an x-polarized plane
+    wave only excites the m = ±1 azimuthal orders, which give identical
+    cross sections; the m = -1 run (Er - i Ep source, is_integrated since it
+    extends into the PML) is a 2D (r, z) problem that runs in seconds at
+    resolution_cyl. Returns (wavelengths_nm, [sigma_ext, enhancement]):
+
+    - sigma_ext (nm^2): scattered flux out of a box around the particle
+      (incident fields of an empty-substrate run subtracted) plus the extra
+      power absorbed inside it, over the incident intensity just above the
+      ITO.
+    - enhancement: |E|^2 / |E_0|^2 5 nm outside the Al edge at mid-height
+      (phi = 0, where the m = ±1 fields of a linear polarization add).
+    """
+    D = D_nm / 1000
+    h_shell = h_TDBC if with_tdbc else 0
+    r_box = D/2 + h_shell + 0.05
+    sr = r_box + 0.3 + dpml
+    sz_cyl = 2*dpml + 0.25 + h_ITO + h_disk + h_shell + 0.05 + 0.3
+    cell_size = mp.Vector3(sr, 0, sz_cyl)
 
-for i, D in enumerate(diameters_nm):
-    print(f"\n[{i+1}/{len(diameters_nm)}] D = {D} nm (bare)...")
-    t0 = time.time()
-    wl, T = simulate_disk(D, with_tdbc=False)
-    if wavelengths is None:
-        wavelengths = wl
-    bare_T.append(T)
-    print(f"  Done in {time.time()-t0:.1f}s")
+    z_glass_top = -sz_cyl/2 + dpml + 0.25
+    z_ITO_top = z_glass_top + h_ITO
+    z_source = z_glass_top - 0.15
+    z_box = (z_glass_top - 0.03, z_ITO_top + h_disk + h_shell + 0.05)
+    edge = mp.Vector3(D/2 + 0.005, 0, z_ITO_top + h_disk/2)
+
+    pml_layers = [mp.PML(dpml)]
+    sources = [mp.Source(src=mp.GaussianSource(fcen, fwidth=df, is_integrated=True), component=mp.Er,
+                         center=mp.Vector3(sr/2, 0, z_source), size=mp.Vector3(sr)),
+               mp.Source(src=mp.GaussianSource(fcen, fwidth=df, is_integrated=True), component=mp.Ep,
+                         center=mp.Vector3(sr/2, 0, z_source), size=mp.Vector3(sr), amplitude=-1j)]
+
+    substrate = [
+        mp.Block(size=mp.Vector3(mp.inf, mp.inf, z_glass_top + sz_cyl/2),
+                 center=mp.Vector3(0, 0, (z_glass_top - sz_cyl/2)/2), material=glass),
+        mp.Block(size=mp.Vector3(mp.inf, mp.inf, h_ITO),
+                 center=mp.Vector3(0, 0, z_glass_top + h_ITO/2), material=ITO)
+    ]
+    geometry = substrate.copy()
+    if with_tdbc:
+        geometry.append(mp.Cylinder(radius=D/2 + h_TDBC, height=h_disk + h_TDBC,
+                                    center=mp.Vector3(0, 0, z_ITO_top + (h_disk + h_TDBC)/2), material=TDBC))
+    geometry.append(mp.Cylinder(radius=D/2, height=h_disk,
+                                center=mp.Vector3(0, 0, z_ITO_top + h_disk/2), material=Al))
 
-bare_T = np.array(bare_T)
-print(f"\nBare disks total: {time.time()-t_start:.1f}s")
+    # closed box: bottom (outward = -z), top, side wall
+    box = [mp.FluxRegion(center=mp.Vector3(r_box/2, 0, z_box[0]), size=mp.Vector3(r_box), weight=-1),
+           mp.FluxRegion(center=mp.Vector3(r_box/2, 0, z_box[1]), size=mp.Vector3(r_box)),
+           mp.FluxRegion(center=mp.Vector3(r_box, 0, sum(z_box)/2), size=mp.Vector3(z=z_box[1] - z_box[0]))]
+
+    def run(geometry, incident=None):
+        sim = mp.Simulation(cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
+                            sources=sources, resolution=resolution_cyl,
+                            dimensions=mp.CYLINDRICAL, m=-1)
+        faces = [sim.add_flux(fcen, df, nfreq, region) for region in box]
+        net = sim.add_flux(fcen, df, nfreq, *box)
+        near = sim.add_dft_fields([mp.Er, mp.Ez], fcen, df, nfreq, center=edge, size=mp.Vector3())
+        if incident is not None:
+            for face, data in zip(faces, incident['flux_data']):
+                sim.load_minus_flux_data(face, data)
+        stop = FluxConvergence(faces, sim, wl_min, wl_max, flux_tol,
+                               decay=(mp.Er, mp.Vector3(r_box, 0, z_box[1]), 50, 1e-3))
+        sim.run(until_after_sources=stop)
+        stop.report()
+        field2 = sum(np.abs(np.array([sim.get_dft_array(near, c, i) for i in range(nfreq)]).ravel())**2
+                     for c in (mp.Er, mp.Ez))
+        return {'freqs': np.array(mp.get_flux_freqs(net)),
+                'faces': np.array([mp.get_fluxes(face) for face in faces]),
+                'net': np.array(mp.get_fluxes(net)),
+                'field2': field2,
+                'flux_data': [sim.get_flux_data(face) for face in faces]}
+
+    def run_isolated():
+        empty = run(substrate)
+        full = run(geometry, incident=empty)
+        intensity = empty['faces'][1] / (np.pi * r_box**2)
+        sigma_scat = full['faces'].sum(axis=0)
+        sigma_abs = empty['net'] - full['net']
+        return {'freqs': full['freqs'],
+                'sigma_ext': (sigma_scat + sigma_abs) / intensity * 1e6,
+                'enhancement': full['field2'] / empty['field2']}
+
+    key = simulation_key(cell_size, resolution_cyl, geometry, sources, [(fcen, df, nfreq, box, edge)],
+                         boundary_layers=pml_layers, flux_tol=flux_tol, m=-1, kind='isolated disk')
+    result = cached_run(key, run_isolated)
+    return 1 / result['freqs'] * 1000, np.stack([result['sigma_ext'], result['enhancement']])
+
+# Run simulations (bare and coated disks share one worker pool)
+if convergence_ladder:
+    D_mid = diameters_nm[len(diameters_nm) // 2]
+    for with_tdbc, n_dips in ((False, 1), (True, 2)):
+        convergence_study(simulate_disk, (D_mid, with_tdbc), convergence_ladder,
+                          observe=lambda value: dip_wavelengths(*value, n=n_dips), target=2)
 
 print("\n" + "=" * 70)
-print("Part 2: TDBC-Coated Nanodisks")
+print("Bare and TDBC-Coated Nanodisks")
 print("=" * 70)
 
-coated_T = []
 t_start = time.time()
-
-for i, D in enumerate(diameters_nm):
-    print(f"\n[{i+1}/{len(diameters_nm)}] D = {D} nm (TDBC)...")
-    t0 = time.time()
-    wl, T = simulate_disk(D, with_tdbc=True)
-    coated_T.append(T)
-    print(f"  Done in {time.time()-t0:.1f}s")
-
-coated_T = np.array(coated_T)
-print(f"\nCoated disks total: {time.time()-t_start:.1f}s")
+if adaptive_budget:
+    # start from diameters_nm, bisect where the spectra/polariton branches change most
+    # or where the lineshape surrogate is least certain
+    diameters_nm, wavelengths, T_all = adaptive_sweep(simulate_disk, diameters_nm,
+                                                      points=lambda D: [(D, False), (D, True)],
+                                                      budget=adaptive_budget, energies=tracked_branches,
+                                                      surrogate_terms=(1, 2))
+    bare_T, coated_T = T_all[:, 0], T_all[:, 1]
+elif multifidelity:
+    coarse, fine = multifidelity
+    wavelengths, T_all, refined = multifidelity_sweep(
+        simulate_disk, [(D, with_tdbc) for with_tdbc in (False, True) for D in diameters_nm], coarse, fine)
+    bare_T, coated_T = T_all[:len(diameters_nm)], T_all[len(diameters_nm):]
+else:
+    runs = run_sweep(simulate_disk, [(D, with_tdbc) for with_tdbc in (False, True) for D in diameters_nm],
+                     cost=unit_cell_cost(disk_unit_cell, resolution, nfreq))
+    wavelengths, T_all = sweep_spectra(runs)
+    bare_T, coated_T = T_all[:len(diameters_nm)], T_all[len(diameters_nm):]
+print(f"\nSweep total: {time.time()-t_start:.1f}s")
 
 # Plotting - paper format
 print("\n" + "=" * 70)
@@ -166,11 +236,19 @@ print("=" * 70)
 
 fig, axes = plt.subplots(1, 2, figsize=(12, 6))
 
-D_mesh, wl_mesh = np.meshgrid(diameters_nm, wavelengths)
+if surrogate_maps:
+    # 1 nm diameter steps from the lineshape-tracking surrogate (surrogate.py)
+    diameters_plot, (bare_plot, coated_plot), next_D = dense_maps(diameters_nm, wavelengths,
+                                                                  [bare_T, coated_T], (1, 2))
+    print(f"  Surrogate maps least certain at D = {next_D} nm (simulate there next)")
+else:
+    diameters_plot, bare_plot, coated_plot = diameters_nm, bare_T, coated_T
+
+D_mesh, wl_mesh = np.meshgrid(diameters_plot, wavelengths)
 
 # Figure 3c: Bare
 ax = axes[0]
-im = ax.pcolormesh(D_mesh, wl_mesh, bare_T.T, shading='gouraud', cmap='hot', vmin=0, vmax=1)
+im = ax.pcolormesh(D_mesh, wl_mesh, bare_plot.T, shading='gouraud', cmap='hot', vmin=0, vmax=1)
 ax.set_xlabel('Diameter (nm)', fontsize=12)
 ax.set_ylabel('Wavelength (nm)', fontsize=12)
 ax.set_title('(c) FDTD: Bare Nanodisks', fontsize=12)
@@ -181,7 +259,7 @@ plt.colorbar(im, ax=ax, label='Transmission')
 
 # Figure 3d: Coated
 ax = axes[1]
-im = ax.pcolormesh(D_mesh, wl_mesh, coated_T.T, shading='gouraud', cmap='hot', vmin=0, vmax=1)
+im = ax.pcolormesh(D_mesh, wl_mesh, coated_plot.T, shading='gouraud', cmap='hot', vmin=0, vmax=1)
 ax.axhline(590, color='cyan', linestyle='--', linewidth=2, alpha=0.8, label='Exciton')
 ax.set_xlabel('Diameter (nm)', fontsize=12)
 ax.set_ylabel('Wavelength (nm)', fontsize=12)
@@ -193,12 +271,28 @@ ax.legend(loc='upper right')
 plt.colorbar(im, ax=ax, label='Transmission')
 
 plt.tight_layout()
-plt.savefig('fig3cd_fast.png', dpi=200, bbox_inches='tight')
-print("\nSaved: fig3cd_fast.png")
-
-np.savez('fig3cd_fast_data.npz', diameters_nm=diameters_nm, wavelengths_nm=wavelengths,
-         bare_transmission=bare_T, coated_transmission=coated_T)
-print("Saved: fig3cd_fast_data.npz")
+if is_master():
+    plt.savefig('fig3cd_fast.png', dpi=200, bbox_inches='tight')
+    print("\nSaved: fig3cd_fast.png")
+
+    np.savez('fig3cd_fast_data.npz', diameters_nm=diameters_nm, wavelengths_nm=wavelengths,
+             bare_transmission=bare_T, coated_transmission=coated_T)
+    print("Saved: fig3cd_fast_data.npz")
+
+if isolated_companion:
+    # Same disks alone at 2 nm pixels (cylindrical coordinates)
+    runs_cyl = run_sweep(simulate_isolated_disk, [(D, with_tdbc) for with_tdbc in (False, True) for D in diameters_nm])
+    wl_cyl, isolated = sweep_spectra(runs_cyl)
+    sigma_ext, enhancement = isolated[:, 0], isolated[:, 1]
+    for i, D in enumerate(diameters_nm):
+        print(f"D={D}nm isolated: extinction peak {wl_cyl[np.argmax(sigma_ext[i])]:.0f} nm, "
+              f"array dip {wavelengths[np.argmin(bare_T[i])]:.0f} nm, "
+              f"max |E|^2 enhancement {enhancement[i].max():.0f}")
+    if is_master():
+        np.savez('fig3_isolated_data.npz', diameters_nm=diameters_nm, wavelengths_nm=wl_cyl,
+                 bare_extinction_nm2=sigma_ext[:len(diameters_nm)], coated_extinction_nm2=sigma_ext[len(diameters_nm):],
+                 bare_enhancement=enhancement[:len(diameters_nm)], coated_enhancement=enhancement[len(diameters_nm):])
+        print("Saved: fig3_isolated_data.npz")
 
 # Summary
 print("\n" + "=" * 70)
@@ -15,57 +15,34 @@ import numpy as np
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-from meep.materials import Al
 from scipy.ndimage import gaussian_filter1d
+from reference_flux import reference_flux
+from convergence import FluxConvergence
+from sweep import is_master, run_sweep, sweep_spectra
+from result_cache import simulation_key, cached_run
+from checkpoint import RunCheckpoint
+from surrogate import dense_maps
+from unit_cells import diameters_nm, disk_unit_cell, dpml, sz
 
 print("=" * 60)
 print("FIGURE 3c,d - Transmission Maps (Paper Format)")
 print("=" * 60)
 
-# Parameters
-diameters_nm = np.array([80, 100, 120, 140, 160, 180, 200])
-h_disk = 0.040
-h_ITO = 0.030
-h_TDBC = 0.020
-gap = 0.180
-
+# Parameters (geometry and materials: unit_cells.py)
 resolution = 60
-sz = 2.0
-dpml = 0.4
 
 wl_min, wl_max = 0.4, 0.8
 freq_min, freq_max = 1/wl_max, 1/wl_min
 fcen = (freq_min + freq_max) / 2
 df = freq_max - freq_min
 nfreq = 150
-
-# Materials
-glass = mp.Medium(epsilon=1.51**2)
-omega_p_ITO = 1.78e15 / (2 * np.pi * 3e14)
-gamma_ITO = 1.5e14 / (2 * np.pi * 3e14)
-ITO = mp.Medium(epsilon=3.9, E_susceptibilities=[
-    mp.DrudeSusceptibility(frequency=omega_p_ITO, gamma=gamma_ITO, sigma=1.0)
-])
-
-omega_X = 3.22e15 / (2 * np.pi * 3e14)
-gamma_X = 1.0e14 / (2 * np.pi * 3e14)
-f_TDBC = 0.45
-TDBC = mp.Medium(epsilon=2.56, E_susceptibilities=[
-    mp.LorentzianSusceptibility(frequency=omega_X, gamma=gamma_X, sigma=f_TDBC)
-])
+flux_tol = 1e-3  # stop once the in-band flux spectra change less than this
+surrogate_maps = False  # plot 1 nm-step surrogate maps instead of gouraud shading (surrogate.py)
 
 def simulate_transmission(D_nm, with_tdbc=False):
     """Simulate normalized transmission."""
-    D = D_nm / 1000
-    period = D + gap
-    sx = sy = period
-    cell_size = mp.Vector3(sx, sy, sz)
-    
-    z_bottom = -sz/2 + dpml
-    z_glass_top = z_bottom + 0.5
-    z_ITO_top = z_glass_top + h_ITO
-    z_source = z_glass_top - 0.15
-    z_trans = z_ITO_top + h_disk + h_TDBC + 0.15
+    cell_size, z_source, z_trans, geometry_ref, geometry = disk_unit_cell(D_nm, with_tdbc, resolution=resolution)
+    sx, sy = cell_size.x, cell_size.y
     
     pml_layers = [mp.PML(thickness=dpml, direction=mp.Z)]
     
@@ -76,60 +53,32 @@ def simulate_transmission(D_nm, with_tdbc=False):
         size=mp.Vector3(sx, sy, 0)
     )]
     
-    # Reference geometry (glass + ITO)
-    geometry_ref = [
-        mp.Block(size=mp.Vector3(mp.inf, mp.inf, z_glass_top - z_bottom),
-                 center=mp.Vector3(0, 0, (z_glass_top + z_bottom)/2), material=glass),
-        mp.Block(size=mp.Vector3(mp.inf, mp.inf, h_ITO),
-                 center=mp.Vector3(0, 0, z_glass_top + h_ITO/2), material=ITO)
-    ]
+    # Reference (flat stack, shared across diameters)
+    freqs, flux_ref = reference_flux(geometry_ref, sx, sy, z_source, z_trans, sz, dpml,
+                                     resolution, fcen, df, nfreq, flux_tol)
     
-    # Full geometry
-    geometry = geometry_ref.copy()
+    # Full simulation (stored on disk, keyed by everything that determines the run)
+    flux_region = mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0))
     
-    if with_tdbc:
-        # TDBC base layer
-        geometry.append(mp.Block(
-            size=mp.Vector3(mp.inf, mp.inf, h_TDBC),
-            center=mp.Vector3(0, 0, z_ITO_top + h_TDBC/2),
-            material=TDBC
-        ))
-        # TDBC shell (conformal)
-        geometry.append(mp.Cylinder(
-            radius=D/2 + h_TDBC,
-            height=h_disk + h_TDBC,
-            center=mp.Vector3(0, 0, z_ITO_top + (h_disk + h_TDBC)/2),
-            material=TDBC
-        ))
+    def run_full():
+        checkpoint = RunCheckpoint(key)
+        sim = mp.Simulation(
+            cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
+            sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0),
+            chunk_layout=checkpoint.chunk_layout
+        )
+        trans = sim.add_flux(fcen, df, nfreq, flux_region)
+        checkpoint.start(sim, [trans])
+        stop = FluxConvergence([trans], sim, wl_min, wl_max, flux_tol,
+                               decay=(mp.Ex, mp.Vector3(0, 0, z_trans), 50, 1e-3))
+        sim.run(checkpoint, until_after_sources=stop)
+        stop.report()
+        checkpoint.clear()
+        return {'flux': np.array(mp.get_fluxes(trans))}
     
-    # Al disk
-    geometry.append(mp.Cylinder(
-        radius=D/2,
-        height=h_disk,
-        center=mp.Vector3(0, 0, z_ITO_top + h_disk/2),
-        material=Al
-    ))
-    
-    # Reference simulation
-    sim_ref = mp.Simulation(
-        cell_size=cell_size, geometry=geometry_ref, boundary_layers=pml_layers,
-        sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0)
-    )
-    trans_ref = sim_ref.add_flux(fcen, df, nfreq,
-        mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0)))
-    sim_ref.run(until_after_sources=mp.stop_when_fields_decayed(50, mp.Ex, mp.Vector3(0, 0, z_trans), 1e-3))
-    flux_ref = np.array(mp.get_fluxes(trans_ref))
-    freqs = np.array(mp.get_flux_freqs(trans_ref))
-    
-    # Full simulation
-    sim = mp.Simulation(
-        cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
-        sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0)
-    )
-    trans = sim.add_flux(fcen, df, nfreq,
-        mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0)))
-    sim.run(until_after_sources=mp.stop_when_fields_decayed(50, mp.Ex, mp.Vector3(0, 0, z_trans), 1e-3))
-    flux = np.array(mp.get_fluxes(trans))
+    key = simulation_key(cell_size, resolution, geometry, sources, [(fcen, df, nfreq, flux_region)],
+                         boundary_layers=pml_layers, flux_tol=flux_tol)
+    flux = cached_run(key, run_full)['flux']
     
     T = np.where(flux_ref > 0, flux / flux_ref, 1)
     T = gaussian_filter1d(T, sigma=2)
@@ -138,24 +87,14 @@ def simulate_transmission(D_nm, with_tdbc=False):
     wavelengths_nm = 1 / freqs * 1000
     return wavelengths_nm, T
 
-# Run simulations
-print("\nSimulating bare nanodisks...")
-T_bare = {}
-for D in diameters_nm:
-    print(f"  D = {D} nm...", end=" ", flush=True)
-    wl, T = simulate_transmission(D, with_tdbc=False)
-    T_bare[D] = T
-    print("done")
-
-print("\nSimulating TDBC-coated nanodisks...")
-T_coated = {}
-for D in diameters_nm:
-    print(f"  D = {D} nm...", end=" ", flush=True)
-    wl, T = simulate_transmission(D, with_tdbc=True)
-    T_coated[D] = T
-    print("done")
-
-wavelengths = wl
+# Run simulations (bare and coated disks share one worker pool)
+print("\nSimulating bare and TDBC-coated nanodisks...")
+# finished points are in the result cache, so a rerun after a crash only runs the rest
+runs = run_sweep(simulate_transmission,
+                 [(D, with_tdbc) for with_tdbc in (False, True) for D in diameters_nm])
+wavelengths, T_all = sweep_spectra(runs)
+T_bare = dict(zip(diameters_nm, T_all[:len(diameters_nm)]))
+T_coated = dict(zip(diameters_nm, T_all[len(diameters_nm):]))
 
 # ============================================================
 # PLOTTING - Exact paper format
@@ -167,10 +106,19 @@ fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 5))
 T_bare_2d = np.array([T_bare[D] for D in diameters_nm]).T
 T_coated_2d = np.array([T_coated[D] for D in diameters_nm]).T
 
-D_mesh, wl_mesh = np.meshgrid(diameters_nm, wavelengths)
+diameters_plot = diameters_nm
+if surrogate_maps:
+    # 1 nm diameter steps from the lineshape-tracking surrogate (surrogate.py)
+    diameters_plot, maps, next_D = dense_maps(diameters_nm, wavelengths, [T_bare_2d.T, T_coated_2d.T], (1, 2))
+    T_bare_plot, T_coated_plot = (T.T for T in maps)
+    print(f"  Surrogate maps least certain at D = {next_D} nm (simulate there next)")
+else:
+    T_bare_plot, T_coated_plot = T_bare_2d, T_coated_2d
+
+D_mesh, wl_mesh = np.meshgrid(diameters_plot, wavelengths)
 
 # Figure 3c - Bare nanodisks
-im1 = ax1.pcolormesh(D_mesh, wl_mesh, T_bare_2d, shading='gouraud',
+im1 = ax1.pcolormesh(D_mesh, wl_mesh, T_bare_plot, shading='gouraud',
                       cmap='gray_r', vmin=0, vmax=1)
 ax1.set_xlabel('Diameter (nm)', fontsize=12)
 ax1.set_ylabel('Wavelength (nm)', fontsize=12)
@@ -181,7 +129,7 @@ cbar1 = plt.colorbar(im1, ax=ax1)
 cbar1.set_ticks([0, 0.2, 0.4, 0.6, 0.8, 1.0])
 
 # Figure 3d - Coated nanodisks
-im2 = ax2.pcolormesh(D_mesh, wl_mesh, T_coated_2d, shading='gouraud',
+im2 = ax2.pcolormesh(D_mesh, wl_mesh, T_coated_plot, shading='gouraud',
                       cmap='gray_r', vmin=0, vmax=1)
 ax2.set_xlabel('Diameter (nm)', fontsize=12)
 ax2.set_ylabel('Wavelength (nm)', fontsize=12)
@@ -196,14 +144,15 @@ cbar2 = plt.colorbar(im2, ax=ax2)
 cbar2.set_ticks([0, 0.2, 0.4, 0.6, 0.8, 1.0])
 
 plt.tight_layout()
-plt.savefig('fig3cd_exact.png', dpi=200, bbox_inches='tight', facecolor='white')
-print("\nSaved: fig3cd_exact.png")
-
-# Save data
-np.savez('fig3cd_exact_data.npz',
-         wavelengths=wavelengths,
-         diameters_nm=diameters_nm,
-         T_bare=T_bare_2d,
-         T_coated=T_coated_2d)
-print("Saved: fig3cd_exact_data.npz")
+if is_master():
+    plt.savefig('fig3cd_exact.png', dpi=200, bbox_inches='tight', facecolor='white')
+    print("\nSaved: fig3cd_exact.png")
+
+    # Save data
+    np.savez('fig3cd_exact_data.npz',
+             wavelengths=wavelengths,
+             diameters_nm=diameters_nm,
+             T_bare=T_bare_2d,
+             T_coated=T_coated_2d)
+    print("Saved: fig3cd_exact_data.npz")
 
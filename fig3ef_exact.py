@@ -42,37 +42,51 @@ diameters = np.array([80, 100, 120, 140, 160, 180, 200])
 # Smaller disk = higher energy
 E_LSP_bare = np.array([2.8, 2.5, 2.25, 2.1, 1.95, 1.85, 1.75])
 
+# 'dipole': predict them instead from the coupled-dipole model (coupled_dipole.py)
+# 'harminv': extract them, and the coated UP/LP, from FDTD ring-downs (resonances.py)
+lsp_source = 'paper'
+if lsp_source == 'dipole':
+    from coupled_dipole import lsp_energy
+    E_LSP_bare = lsp_energy(diameters)
+elif lsp_source == 'harminv':
+    from resonances import polariton_energies
+    from unit_cells import disk_unit_cell
+    E_LSP_bare, E_UP_fdtd, E_LP_fdtd = polariton_energies(disk_unit_cell, diameters)
+
+# Fit E_X, g and f to a saved FDTD map instead (polariton_fit.py), e.g. 'fig3cd_fast_data.npz'
+fdtd_map = None
+if fdtd_map is not None:
+    from polariton_fit import fit_map
+    map_diameters, (map_LSP, map_UP, map_LP), (E_X, g, f), _ = fit_map(fdtd_map)
+    tracked = np.isfinite(map_LSP)
+    diameters, E_LSP_bare = map_diameters[tracked], map_LSP[tracked]
+
 # Coated LSP is redshifted by factor f
 E_LSP_coated = f * E_LSP_bare
 
-# Coupled oscillator model
+# Coupled oscillator model (coupled_modes.py; lossless, two modes)
 # E_UP,LP = 0.5 * (E_X + E_LSP ± sqrt(4g² + (E_X - E_LSP)²))
+from coupled_modes import two_modes
 
 def coupled_oscillator(E_LSP, E_X, g):
     """Calculate upper and lower polariton energies."""
-    delta = E_X - E_LSP
-    Omega = np.sqrt(4*g**2 + delta**2)
-    E_UP = 0.5 * (E_X + E_LSP + Omega)
-    E_LP = 0.5 * (E_X + E_LSP - Omega)
+    E_UP, E_LP, _ = two_modes(E_LSP, E_X, g)
     return E_UP, E_LP
 
 def hopfield_coefficients(E_LSP, E_X, g):
     """Calculate exciton and LSP fractions (Hopfield coefficients)."""
-    delta = E_X - E_LSP
-    Omega = np.sqrt(4*g**2 + delta**2)
-    
-    # Upper polariton
-    alpha_UP = 0.5 * (1 + delta / Omega)  # Exciton fraction
-    beta_UP = 0.5 * (1 - delta / Omega)   # LSP fraction
-    
-    # Lower polariton
-    alpha_LP = 0.5 * (1 - delta / Omega)  # Exciton fraction
-    beta_LP = 0.5 * (1 + delta / Omega)   # LSP fraction
-    
+    _, _, fractions = two_modes(E_LSP, E_X, g)
+    # fractions[..., polariton (0 = LP, 1 = UP), bare mode (0 = LSP, 1 = exciton)]
+    beta_LP, alpha_LP = fractions[..., 0, 0], fractions[..., 0, 1]
+    beta_UP, alpha_UP = fractions[..., 1, 0], fractions[..., 1, 1]
     return alpha_UP, beta_UP, alpha_LP, beta_LP
 
 # Calculate polariton energies
 E_UP, E_LP = coupled_oscillator(E_LSP_coated, E_X, g)
+if lsp_source == 'harminv':
+    E_UP, E_LP = E_UP_fdtd, E_LP_fdtd
+if fdtd_map is not None:
+    E_UP, E_LP = map_UP[tracked], map_LP[tracked]
 
 # Calculate fractions
 alpha_UP, beta_UP, alpha_LP, beta_LP = hopfield_coefficients(E_LSP_coated, E_X, g)
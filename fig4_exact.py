@@ -20,60 +20,33 @@ import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from scipy.ndimage import gaussian_filter1d
+from reference_flux import reference_flux
+from convergence import FluxConvergence
+from surrogate import dense_maps
+from unit_cells import (Al_Palik, Gamma_x, Gamma_y, ITO, TDBC, W, dpml, glass, grid_length, h_ITO, h_TDBC,
+                        h_rod, lengths_nm, sz)
 
 print("=" * 60)
 print("FIGURE 4 - Nanorod Arrays (Paper Format)")
 print("=" * 60)
 
-# Palik Al
-Al_Palik = mp.Medium(
-    epsilon=1.0,
-    E_susceptibilities=[
-        mp.DrudeSusceptibility(frequency=12.10, gamma=0.081, sigma=1.0),
-        mp.LorentzianSusceptibility(frequency=1.21, gamma=0.40, sigma=2.0)
-    ]
-)
-
-# Materials
-glass = mp.Medium(epsilon=1.51**2)
-omega_p_ITO = 1.78e15 / (2 * np.pi * 3e14)
-gamma_ITO = 1.5e14 / (2 * np.pi * 3e14)
-ITO = mp.Medium(epsilon=3.9, E_susceptibilities=[
-    mp.DrudeSusceptibility(frequency=omega_p_ITO, gamma=gamma_ITO, sigma=1.0)
-])
-
-omega_X = 3.22e15 / (2 * np.pi * 3e14)
-gamma_X = 1.0e14 / (2 * np.pi * 3e14)
-f_TDBC = 0.45
-TDBC = mp.Medium(epsilon=2.56, E_susceptibilities=[
-    mp.LorentzianSusceptibility(frequency=omega_X, gamma=gamma_X, sigma=f_TDBC)
-])
-
 # Parameters
-lengths_nm = np.array([75, 95, 120, 140, 160, 180, 205])
-W = 0.040  # Width 40nm
-h_rod = 0.040
-h_ITO = 0.030
-h_TDBC = 0.020
-Gamma_x = 0.200  # x spacing
-Gamma_y = 0.150  # y spacing
-
 resolution = 60
-sz = 2.0
-dpml = 0.4
 
 wl_min, wl_max = 0.4, 0.8
 freq_min, freq_max = 1/wl_max, 1/wl_min
 fcen = (freq_min + freq_max) / 2
 df = freq_max - freq_min
 nfreq = 150
+flux_tol = 1e-3  # stop once the in-band flux spectra change less than this
+surrogate_maps = False  # plot 1 nm-step surrogate maps instead of gouraud shading (surrogate.py)
 
 def simulate_rod_transmission(L_nm, polarization='x', with_tdbc=False):
     """Simulate transmission through nanorod array."""
     L = L_nm / 1000
     
-    sx = L + Gamma_x
-    sy = W + Gamma_y
+    sx = grid_length(L + Gamma_x, resolution)
+    sy = grid_length(W + Gamma_y, resolution)
     cell_size = mp.Vector3(sx, sy, sz)
     
     z_bottom = -sz/2 + dpml
@@ -126,16 +99,9 @@ def simulate_rod_transmission(L_nm, polarization='x', with_tdbc=False):
         material=Al_Palik
     ))
     
-    # Reference simulation
-    sim_ref = mp.Simulation(
-        cell_size=cell_size, geometry=geometry_ref, boundary_layers=pml_layers,
-        sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0)
-    )
-    trans_ref = sim_ref.add_flux(fcen, df, nfreq,
-        mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0)))
-    sim_ref.run(until_after_sources=mp.stop_when_fields_decayed(50, component, mp.Vector3(0, 0, z_trans), 1e-3))
-    flux_ref = np.array(mp.get_fluxes(trans_ref))
-    freqs = np.array(mp.get_flux_freqs(trans_ref))
+    # Reference (flat stack, shared across lengths)
+    freqs, flux_ref = reference_flux(geometry_ref, sx, sy, z_source, z_trans, sz, dpml,
+                                     resolution, fcen, df, nfreq, flux_tol)
     
     # Full simulation
     sim = mp.Simulation(
@@ -144,7 +110,10 @@ def simulate_rod_transmission(L_nm, polarization='x', with_tdbc=False):
     )
     trans = sim.add_flux(fcen, df, nfreq,
         mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0)))
-    sim.run(until_after_sources=mp.stop_when_fields_decayed(50, component, mp.Vector3(0, 0, z_trans), 1e-3))
+    stop = FluxConvergence([trans], sim, wl_min, wl_max, flux_tol,
+                           decay=(component, mp.Vector3(0, 0, z_trans), 50, 1e-3))
+    sim.run(until_after_sources=stop)
+    stop.report()
     flux = np.array(mp.get_fluxes(trans))
     
     T = np.where(flux_ref > 0, flux / flux_ref, 1)
@@ -192,11 +161,21 @@ T_bare_x_2d = np.array([T_bare_x[L] for L in lengths_nm]).T
 T_coated_x_2d = np.array([T_coated_x[L] for L in lengths_nm]).T
 T_coated_y_2d = np.array([T_coated_y[L] for L in lengths_nm]).T
 
-L_mesh, wl_mesh = np.meshgrid(lengths_nm, wavelengths)
+lengths_plot = lengths_nm
+if surrogate_maps:
+    # 1 nm length steps from the lineshape-tracking surrogate (surrogate.py)
+    lengths_plot, maps, next_L = dense_maps(lengths_nm, wavelengths,
+                                            [T_bare_x_2d.T, T_coated_x_2d.T, T_coated_y_2d.T], (1, 2, 2))
+    T_bare_x_plot, T_coated_x_plot, T_coated_y_plot = (T.T for T in maps)
+    print(f"  Surrogate maps least certain at L = {next_L} nm (simulate there next)")
+else:
+    T_bare_x_plot, T_coated_x_plot, T_coated_y_plot = T_bare_x_2d, T_coated_x_2d, T_coated_y_2d
+
+L_mesh, wl_mesh = np.meshgrid(lengths_plot, wavelengths)
 
 # (a) Bare, x-pol
 ax1 = fig.add_subplot(2, 3, 1)
-im1 = ax1.pcolormesh(L_mesh, wl_mesh, T_bare_x_2d, shading='gouraud',
+im1 = ax1.pcolormesh(L_mesh, wl_mesh, T_bare_x_plot, shading='gouraud',
                       cmap='gray_r', vmin=0, vmax=1)
 ax1.set_xlabel('Length (nm)', fontsize=11)
 ax1.set_ylabel('Wavelength (nm)', fontsize=11)
@@ -207,7 +186,7 @@ plt.colorbar(im1, ax=ax1)
 
 # (b) Coated, x-pol
 ax2 = fig.add_subplot(2, 3, 2)
-im2 = ax2.pcolormesh(L_mesh, wl_mesh, T_coated_x_2d, shading='gouraud',
+im2 = ax2.pcolormesh(L_mesh, wl_mesh, T_coated_x_plot, shading='gouraud',
                       cmap='gray_r', vmin=0, vmax=1)
 ax2.set_xlabel('Length (nm)', fontsize=11)
 ax2.set_ylabel('Wavelength (nm)', fontsize=11)
@@ -219,7 +198,7 @@ plt.colorbar(im2, ax=ax2)
 
 # (c) Coated, y-pol
 ax3 = fig.add_subplot(2, 3, 3)
-im3 = ax3.pcolormesh(L_mesh, wl_mesh, T_coated_y_2d, shading='gouraud',
+im3 = ax3.pcolormesh(L_mesh, wl_mesh, T_coated_y_plot, shading='gouraud',
                       cmap='gray_r', vmin=0, vmax=1)
 ax3.set_xlabel('Length (nm)', fontsize=11)
 ax3.set_ylabel('Wavelength (nm)', fontsize=11)
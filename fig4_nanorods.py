@@ -20,126 +20,70 @@ import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from scipy.ndimage import gaussian_filter1d
+from reference_flux import reference_flux
+from convergence import FluxConvergence
+from sweep import clear_checkpoint, is_master, run_sweep, sweep_spectra
+from planner import job_cost
+from symmetry import equivalent_polarization, mirror_symmetries
+from surrogate import dense_maps
+from unit_cells import dpml, lengths_nm, rod_unit_cell, sz
 
 print("=" * 60)
 print("FIGURE 4 - Nanorod Arrays (2D Heatmaps)")
 print("=" * 60)
 
-# Palik Al
-Al_Palik = mp.Medium(
-    epsilon=1.0,
-    E_susceptibilities=[
-        mp.DrudeSusceptibility(frequency=12.10, gamma=0.081, sigma=1.0),
-        mp.LorentzianSusceptibility(frequency=1.21, gamma=0.40, sigma=2.0)
-    ]
-)
-
-# Materials
-glass = mp.Medium(epsilon=1.51**2)
-omega_p_ITO = 1.78e15 / (2 * np.pi * 3e14)
-gamma_ITO = 1.5e14 / (2 * np.pi * 3e14)
-ITO = mp.Medium(epsilon=3.9, E_susceptibilities=[
-    mp.DrudeSusceptibility(frequency=omega_p_ITO, gamma=gamma_ITO, sigma=1.0)
-])
-
-omega_X = 3.22e15 / (2 * np.pi * 3e14)
-gamma_X = 1.0e14 / (2 * np.pi * 3e14)
-f_TDBC = 0.45
-TDBC = mp.Medium(epsilon=2.56, E_susceptibilities=[
-    mp.LorentzianSusceptibility(frequency=omega_X, gamma=gamma_X, sigma=f_TDBC)
-])
-
-# Parameters - match paper's x-axis labels
-lengths_nm = np.array([75, 95, 120, 140, 160, 180, 205])
-W = 0.040  # Width 40nm
-h_rod = 0.040
-h_ITO = 0.030
-h_TDBC = 0.020
-Gamma_x = 0.200  # x spacing
-Gamma_y = 0.150  # y spacing
-
+# Parameters (geometry and materials: unit_cells.py)
 resolution = 60
-sz = 2.0
-dpml = 0.4
 
 wl_min, wl_max = 0.4, 0.8
 freq_min, freq_max = 1/wl_max, 1/wl_min
 fcen = (freq_min + freq_max) / 2
 df = freq_max - freq_min
 nfreq = 150
+flux_tol = 1e-3  # stop once the in-band flux spectra change less than this
+surrogate_maps = False  # plot 1 nm-step surrogate maps instead of gouraud shading (surrogate.py)
 
-def simulate_rod_transmission(L_nm, polarization='x', with_tdbc=False):
-    """Simulate transmission through nanorod array."""
-    L = L_nm / 1000
-    
-    sx = L + Gamma_x
-    sy = W + Gamma_y
-    cell_size = mp.Vector3(sx, sy, sz)
-    
-    z_bottom = -sz/2 + dpml
-    z_glass_top = z_bottom + 0.5
-    z_ITO_top = z_glass_top + h_ITO
-    z_source = z_glass_top - 0.15
-    z_trans = z_ITO_top + h_rod + h_TDBC + 0.15
-    
-    pml_layers = [mp.PML(thickness=dpml, direction=mp.Z)]
-    
-    component = mp.Ex if polarization == 'x' else mp.Ey
-    
-    sources = [mp.Source(
+pml_layers = [mp.PML(thickness=dpml, direction=mp.Z)]
+components = {'x': mp.Ex, 'y': mp.Ey}
+
+def plane_wave(cell_size, z_source, polarization):
+    """Normally incident plane-wave source of one polarization."""
+    return [mp.Source(
         src=mp.GaussianSource(fcen, fwidth=df),
-        component=component,
+        component=components[polarization],
         center=mp.Vector3(0, 0, z_source),
-        size=mp.Vector3(sx, sy, 0)
+        size=mp.Vector3(cell_size.x, cell_size.y, 0)
     )]
+
+def simulate_rod_transmission(L_nm, polarization='x', with_tdbc=False):
+    """
+    Simulate transmission through nanorod array for one polarization.
     
-    # Reference geometry
-    geometry_ref = [
-        mp.Block(size=mp.Vector3(mp.inf, mp.inf, z_glass_top - z_bottom),
-                 center=mp.Vector3(0, 0, (z_glass_top + z_bottom)/2), material=glass),
-        mp.Block(size=mp.Vector3(mp.inf, mp.inf, h_ITO),
-                 center=mp.Vector3(0, 0, z_glass_top + h_ITO/2), material=ITO)
-    ]
-    
-    geometry = geometry_ref.copy()
-    
-    if with_tdbc:
-        geometry.append(mp.Block(
-            size=mp.Vector3(mp.inf, mp.inf, h_TDBC),
-            center=mp.Vector3(0, 0, z_ITO_top + h_TDBC/2),
-            material=TDBC
-        ))
-        geometry.append(mp.Ellipsoid(
-            size=mp.Vector3(L + 2*h_TDBC, W + 2*h_TDBC, h_rod + h_TDBC),
-            center=mp.Vector3(0, 0, z_ITO_top + (h_rod + h_TDBC)/2),
-            material=TDBC
-        ))
-    
-    geometry.append(mp.Ellipsoid(
-        size=mp.Vector3(L, W, h_rod),
-        center=mp.Vector3(0, 0, z_ITO_top + h_rod/2),
-        material=Al_Palik
-    ))
+    Every run builds its own structure: a structure shared by the x and y
+    runs could only keep the symmetries common to Ex and Ey (a 180°
+    rotation instead of both mirror planes), doubling the voxels of each run
+    to save one voxelization. Returns (wavelengths_nm, T).
+    """
+    cell_size, z_source, z_trans, geometry_ref, geometry = rod_unit_cell(L_nm, with_tdbc, resolution=resolution)
+    sx, sy = cell_size.x, cell_size.y
+    sources = plane_wave(cell_size, z_source, polarization)
     
-    # Reference simulation
-    sim_ref = mp.Simulation(
-        cell_size=cell_size, geometry=geometry_ref, boundary_layers=pml_layers,
-        sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0)
-    )
-    trans_ref = sim_ref.add_flux(fcen, df, nfreq,
-        mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0)))
-    sim_ref.run(until_after_sources=mp.stop_when_fields_decayed(50, component, mp.Vector3(0, 0, z_trans), 1e-3))
-    flux_ref = np.array(mp.get_fluxes(trans_ref))
-    freqs = np.array(mp.get_flux_freqs(trans_ref))
+    # Reference (flat stack, shared across lengths)
+    freqs, flux_ref = reference_flux(geometry_ref, sx, sy, z_source, z_trans, sz, dpml,
+                                     resolution, fcen, df, nfreq, flux_tol)
     
     # Full simulation
     sim = mp.Simulation(
         cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
-        sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0)
+        sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0),
+        symmetries=mirror_symmetries(geometry, sources, pml_layers, mp.Vector3(0, 0, 0))
     )
     trans = sim.add_flux(fcen, df, nfreq,
         mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0)))
-    sim.run(until_after_sources=mp.stop_when_fields_decayed(50, component, mp.Vector3(0, 0, z_trans), 1e-3))
+    stop = FluxConvergence([trans], sim, wl_min, wl_max, flux_tol,
+                           decay=(components[polarization], mp.Vector3(0, 0, z_trans), 50, 1e-3))
+    sim.run(until_after_sources=stop)
+    stop.report()
     flux = np.array(mp.get_fluxes(trans))
     
     T = np.where(flux_ref > 0, flux / flux_ref, 1)
@@ -149,32 +93,32 @@ def simulate_rod_transmission(L_nm, polarization='x', with_tdbc=False):
     wavelengths_nm = 1 / freqs * 1000
     return wavelengths_nm, T
 
-# Run simulations
-print("\n(a) Bare nanorods, x-polarization...")
-T_bare_x = {}
-for L in lengths_nm:
-    print(f"  L = {L} nm...", end=" ", flush=True)
-    wl, T = simulate_rod_transmission(L, 'x', False)
-    T_bare_x[L] = T
-    print("done")
-
-print("\n(b) Coated nanorods, x-polarization...")
-T_coated_x = {}
-for L in lengths_nm:
-    print(f"  L = {L} nm...", end=" ", flush=True)
-    wl, T = simulate_rod_transmission(L, 'x', True)
-    T_coated_x[L] = T
-    print("done")
-
-print("\n(c) Coated nanorods, y-polarization...")
-T_coated_y = {}
-for L in lengths_nm:
-    print(f"  L = {L} nm...", end=" ", flush=True)
-    wl, T = simulate_rod_transmission(L, 'y', True)
-    T_coated_y[L] = T
-    print("done")
-
-wavelengths = wl
+def equivalent_run(L_nm, polarization='x', with_tdbc=False):
+    """The run that gives the same spectrum: a C4-symmetric cell runs x for y."""
+    cell_size, _, _, _, geometry = rod_unit_cell(L_nm, with_tdbc, resolution=resolution)
+    return L_nm, equivalent_polarization(cell_size, geometry, polarization), with_tdbc
+
+def rod_cost(L_nm, polarization='x', with_tdbc=False):
+    """Scheduling cost of simulate_rod_transmission, with the run's own mirror reduction."""
+    cell_size, z_source, _, _, geometry = rod_unit_cell(L_nm, with_tdbc, resolution=resolution)
+    symmetries = mirror_symmetries(geometry, plane_wave(cell_size, z_source, polarization), pml_layers)
+    return job_cost(cell_size, geometry, resolution, cell_size.x * cell_size.y, nfreq,
+                    symmetry=2 ** len(symmetries))
+
+# Run simulations: (a) bare x-pol, (b) coated x-pol, (c) coated y-pol, one point each
+print("\nSimulating nanorods: (a) bare x-pol, (b) coated x-pol, (c) coated y-pol...")
+bare_runs = [(L, 'x', False) for L in lengths_nm]
+coated_runs = [(L, pol, True) for pol in ('x', 'y') for L in lengths_nm]
+sweep_checkpoint = '.sweep_checkpoints/fig4_nanorods'   # rerun after a crash skips finished points
+runs = run_sweep(simulate_rod_transmission, bare_runs + coated_runs, equivalent=equivalent_run,
+                 cost=rod_cost, checkpoint=sweep_checkpoint,
+                 settings=dict(resolution=resolution, wl_min=wl_min, wl_max=wl_max, nfreq=nfreq,
+                               flux_tol=flux_tol))
+wavelengths, T_all = sweep_spectra(runs)
+n = len(lengths_nm)
+T_bare_x = dict(zip(lengths_nm, T_all[:n]))
+T_coated_x = dict(zip(lengths_nm, T_all[n:2 * n]))
+T_coated_y = dict(zip(lengths_nm, T_all[2 * n:]))
 
 # ============================================================
 # PLOTTING - Paper format with 2D heatmaps
@@ -189,11 +133,21 @@ T_bare_x_2d = np.array([T_bare_x[L] for L in lengths_nm]).T
 T_coated_x_2d = np.array([T_coated_x[L] for L in lengths_nm]).T
 T_coated_y_2d = np.array([T_coated_y[L] for L in lengths_nm]).T
 
-L_mesh, wl_mesh = np.meshgrid(lengths_nm, wavelengths)
+lengths_plot = lengths_nm
+if surrogate_maps:
+    # 1 nm length steps from the lineshape-tracking surrogate (surrogate.py)
+    lengths_plot, maps, next_L = dense_maps(lengths_nm, wavelengths,
+                                            [T_bare_x_2d.T, T_coated_x_2d.T, T_coated_y_2d.T], (1, 2, 2))
+    T_bare_x_plot, T_coated_x_plot, T_coated_y_plot = (T.T for T in maps)
+    print(f"  Surrogate maps least certain at L = {next_L} nm (simulate there next)")
+else:
+    T_bare_x_plot, T_coated_x_plot, T_coated_y_plot = T_bare_x_2d, T_coated_x_2d, T_coated_y_2d
+
+L_mesh, wl_mesh = np.meshgrid(lengths_plot, wavelengths)
 
 # (a) Bare nanorods, x-pol - 2D HEATMAP
 ax1 = fig.add_subplot(2, 3, 1)
-im1 = ax1.pcolormesh(L_mesh, wl_mesh, T_bare_x_2d, shading='gouraud',
+im1 = ax1.pcolormesh(L_mesh, wl_mesh, T_bare_x_plot, shading='gouraud',
                       cmap='gray_r', vmin=0, vmax=1)
 ax1.set_xlabel('Length (nm)', fontsize=11)
 ax1.set_ylabel('Wavelength (nm)', fontsize=11)
@@ -204,7 +158,7 @@ plt.colorbar(im1, ax=ax1, label='Transmission')
 
 # (b) Coated nanorods, x-pol - 2D HEATMAP
 ax2 = fig.add_subplot(2, 3, 2)
-im2 = ax2.pcolormesh(L_mesh, wl_mesh, T_coated_x_2d, shading='gouraud',
+im2 = ax2.pcolormesh(L_mesh, wl_mesh, T_coated_x_plot, shading='gouraud',
                       cmap='gray_r', vmin=0, vmax=1)
 ax2.axhline(590, color='yellow', linestyle='--', linewidth=1.5, alpha=0.8)
 ax2.set_xlabel('Length (nm)', fontsize=11)
@@ -216,7 +170,7 @@ plt.colorbar(im2, ax=ax2, label='Transmission')
 
 # (c) Coated nanorods, y-pol - 2D HEATMAP
 ax3 = fig.add_subplot(2, 3, 3)
-im3 = ax3.pcolormesh(L_mesh, wl_mesh, T_coated_y_2d, shading='gouraud',
+im3 = ax3.pcolormesh(L_mesh, wl_mesh, T_coated_y_plot, shading='gouraud',
                       cmap='gray_r', vmin=0, vmax=1)
 ax3.axhline(590, color='yellow', linestyle='--', linewidth=1.5, alpha=0.8)
 ax3.set_xlabel('Length (nm)', fontsize=11)
@@ -257,20 +211,25 @@ ax5.set_ylim(0.5, 1.1)
 ax5.grid(True, alpha=0.3)
 
 # (f) Energy dispersion - analytical
+from coupled_modes import two_modes
+
 ax6 = fig.add_subplot(2, 3, 6)
 
 E_X = 2.1
 g = 0.2
 E_LSP = np.array([2.9, 2.6, 2.3, 2.1, 1.95, 1.85, 1.75])
+lsp_source = 'paper'  # 'harminv': bare LSP and coated UP/LP from FDTD ring-downs (resonances.py)
+if lsp_source == 'harminv':
+    from resonances import polariton_energies
+    E_LSP, E_UP_fdtd, E_LP_fdtd = polariton_energies(rod_unit_cell, lengths_nm, resolution=resolution)
 
 def coupled_oscillator(E_LSP, E_X, g):
-    delta = E_X - E_LSP
-    Omega = np.sqrt(4*g**2 + delta**2)
-    E_UP = 0.5 * (E_X + E_LSP + Omega)
-    E_LP = 0.5 * (E_X + E_LSP - Omega)
+    E_UP, E_LP, _ = two_modes(E_LSP, E_X, g)
     return E_UP, E_LP
 
 E_UP, E_LP = coupled_oscillator(0.95*E_LSP, E_X, g)
+if lsp_source == 'harminv':
+    E_UP, E_LP = E_UP_fdtd, E_LP_fdtd
 
 lengths_fine = np.linspace(75, 205, 100)
 E_LSP_fine = np.interp(lengths_fine, lengths_nm, E_LSP)
@@ -297,8 +256,10 @@ ax6.legend(loc='upper right', fontsize=9)
 ax6.grid(True, alpha=0.3)
 
 plt.tight_layout()
-plt.savefig('fig4_reproduction.png', dpi=200, bbox_inches='tight', facecolor='white')
-print("\nSaved: fig4_reproduction.png")
+if is_master():
+    plt.savefig('fig4_reproduction.png', dpi=200, bbox_inches='tight', facecolor='white')
+    print("\nSaved: fig4_reproduction.png")
+clear_checkpoint(sweep_checkpoint)
 
 print("\n" + "=" * 60)
 print("Figure 4 reproduction complete!")
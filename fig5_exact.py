@@ -24,60 +24,35 @@ import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from scipy.ndimage import gaussian_filter1d
+from reference_flux import reference_flux
+from convergence import FluxConvergence
+from unit_cells import Al_Palik, ITO, dpml, gap, glass, grid_length, h_disk, h_ITO, h_TDBC, sz
+from unit_cells import TDBC_emission as TDBC   # reduced oscillator strength (Rabi = 0.25 eV)
+from result_cache import simulation_key, cached_run
 
 print("=" * 60)
 print("FIGURE 5 - Emission Enhancement (Paper Format)")
 print("=" * 60)
 
-# Palik Al
-Al_Palik = mp.Medium(
-    epsilon=1.0,
-    E_susceptibilities=[
-        mp.DrudeSusceptibility(frequency=12.10, gamma=0.081, sigma=1.0),
-        mp.LorentzianSusceptibility(frequency=1.21, gamma=0.40, sigma=2.0)
-    ]
-)
-
-# Materials
-glass = mp.Medium(epsilon=1.51**2)
-omega_p_ITO = 1.78e15 / (2 * np.pi * 3e14)
-gamma_ITO = 1.5e14 / (2 * np.pi * 3e14)
-ITO = mp.Medium(epsilon=3.9, E_susceptibilities=[
-    mp.DrudeSusceptibility(frequency=omega_p_ITO, gamma=gamma_ITO, sigma=1.0)
-])
-
-# TDBC with REDUCED oscillator strength (Rabi = 0.25 eV for emission sample)
-omega_X = 3.22e15 / (2 * np.pi * 3e14)
-gamma_X = 1.0e14 / (2 * np.pi * 3e14)
-f_TDBC = 0.15  # Reduced for 0.25 eV splitting
-TDBC = mp.Medium(epsilon=2.56, E_susceptibilities=[
-    mp.LorentzianSusceptibility(frequency=omega_X, gamma=gamma_X, sigma=f_TDBC)
-])
-
 # Parameters
 diameters_map = np.array([75, 95, 115, 140, 155, 185, 205])  # For 2D map
 diameters_specific = np.array([105, 125, 140, 155, 205])      # For panels b-f
 
-h_disk = 0.040
-h_ITO = 0.030
-h_TDBC = 0.020
-gap = 0.180
-
 resolution = 60
-sz = 2.0
-dpml = 0.4
 
 wl_min, wl_max = 0.45, 0.70
 freq_min, freq_max = 1/wl_max, 1/wl_min
 fcen = (freq_min + freq_max) / 2
 df = freq_max - freq_min
 nfreq = 100
+flux_tol = 1e-3  # stop once the in-band flux spectra change less than this
+reference_method = 'fdtd'  # or 'tmm': flat-stack reference by transfer matrices (transfer_matrix.py)
 
 def simulate_T_norm(D_nm):
     """Simulate T_disk / T_tdbc (normalized transmission)."""
     D = D_nm / 1000
     period = D + gap
-    sx = sy = period
+    sx = sy = grid_length(period, resolution)
     cell_size = mp.Vector3(sx, sy, sz)
     
     z_bottom = -sz/2 + dpml
@@ -120,26 +95,28 @@ def simulate_T_norm(D_nm):
         material=Al_Palik
     ))
     
-    # Reference (TDBC only)
-    sim_ref = mp.Simulation(
-        cell_size=cell_size, geometry=geometry_tdbc, boundary_layers=pml_layers,
-        sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0)
-    )
-    trans_ref = sim_ref.add_flux(fcen, df, nfreq,
-        mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0)))
-    sim_ref.run(until_after_sources=mp.stop_when_fields_decayed(50, mp.Ex, mp.Vector3(0, 0, z_trans), 1e-3))
-    flux_ref = np.array(mp.get_fluxes(trans_ref))
-    freqs = np.array(mp.get_flux_freqs(trans_ref))
-    
-    # Full simulation
-    sim = mp.Simulation(
-        cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
-        sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0)
-    )
-    trans = sim.add_flux(fcen, df, nfreq,
-        mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0)))
-    sim.run(until_after_sources=mp.stop_when_fields_decayed(50, mp.Ex, mp.Vector3(0, 0, z_trans), 1e-3))
-    flux = np.array(mp.get_fluxes(trans))
+    # Reference (TDBC only, shared across diameters)
+    freqs, flux_ref = reference_flux(geometry_tdbc, sx, sy, z_source, z_trans, sz, dpml,
+                                     resolution, fcen, df, nfreq, flux_tol, reference_method)
+    
+    # Full simulation (stored on disk, keyed by everything that determines the run)
+    flux_region = mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0))
+    
+    def run_full():
+        sim = mp.Simulation(
+            cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
+            sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0)
+        )
+        trans = sim.add_flux(fcen, df, nfreq, flux_region)
+        stop = FluxConvergence([trans], sim, wl_min, wl_max, flux_tol,
+                               decay=(mp.Ex, mp.Vector3(0, 0, z_trans), 50, 1e-3))
+        sim.run(until_after_sources=stop)
+        stop.report()
+        return {'flux': np.array(mp.get_fluxes(trans))}
+    
+    key = simulation_key(cell_size, resolution, geometry, sources, [(fcen, df, nfreq, flux_region)],
+                         boundary_layers=pml_layers, flux_tol=flux_tol)
+    flux = cached_run(key, run_full)['flux']
     
     T_norm = np.where(flux_ref > 0, flux / flux_ref, 1.0)
     T_norm = gaussian_filter1d(T_norm, sigma=2)
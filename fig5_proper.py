@@ -24,6 +24,12 @@ import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from scipy.ndimage import gaussian_filter1d
+from reference_flux import reference_flux
+from convergence import FluxConvergence
+from result_cache import simulation_key, cached_run
+from sweep import is_master, run_sweep, sweep_spectra
+from planner import job_cost
+from unit_cells import TDBC_emission, disk_unit_cell, dpml, h_TDBC, sz, z_ITO_top
 
 print("=" * 70)
 print("REPRODUCE FIGURE 5: Proper Emission Enhancement")
@@ -41,16 +47,8 @@ print("=" * 70)
 diameters_nm = np.array([75, 95, 115, 140, 155, 185, 205])  # From Figure 5a
 diameters_specific = np.array([105, 125, 140, 155, 205])  # For panels b-f
 
-# Geometry
-h_disk = 0.040
-h_ITO = 0.030
-h_TDBC = 0.020
-gap = 0.180
-
-# Simulation
+# Simulation (geometry and materials: unit_cells.py)
 resolution = 60
-sz = 2.0
-dpml = 0.4
 
 # Wavelengths
 wl_min, wl_max = 0.45, 0.72
@@ -58,50 +56,35 @@ freq_min, freq_max = 1/wl_max, 1/wl_min
 fcen = (freq_min + freq_max) / 2
 df = freq_max - freq_min
 nfreq = 100
+flux_tol = 1e-3  # stop once the in-band flux spectra change less than this
+reference_method = 'fdtd'  # or 'tmm': flat-stack reference by transfer matrices (transfer_matrix.py)
 
 # Exciton parameters
 lambda_X = 0.590  # µm - exciton absorption
 lambda_em = 0.600  # µm - emission peak (Stokes shifted)
 gamma_em = 0.035  # µm - emission linewidth
 
-# Materials
-glass = mp.Medium(epsilon=1.51**2)
-
-omega_p_ITO = 1.78e15 / (2 * np.pi * 3e14)
-gamma_ITO = 1.5e14 / (2 * np.pi * 3e14)
-ITO = mp.Medium(epsilon=3.9, E_susceptibilities=[
-    mp.DrudeSusceptibility(frequency=omega_p_ITO, gamma=gamma_ITO, sigma=1.0)
-])
-
-# TDBC with REDUCED oscillator strength for emission sample
-omega_X = 3.22e15 / (2 * np.pi * 3e14)
-gamma_X = 1.0e14 / (2 * np.pi * 3e14)
-f_TDBC_emission = 0.15  # Reduced for 0.25 eV splitting
-
-TDBC = mp.Medium(epsilon=2.56, E_susceptibilities=[
-    mp.LorentzianSusceptibility(frequency=omega_X, gamma=gamma_X, sigma=f_TDBC_emission)
-])
+def unit_cell(D_nm, resolution=None):
+    """Coated disk cell of the emission sample (TDBC_emission, f = 0.15 for 0.25 eV splitting)."""
+    return disk_unit_cell(D_nm, with_tdbc=True, tdbc=TDBC_emission, resolution=resolution)
 
-# Aluminum (Rakic)
-from meep.materials import Al
+def stack(geometry):
+    """Glass, ITO and TDBC film of a unit cell: the reference without the disk."""
+    return [obj for obj in geometry if not isinstance(obj, mp.Cylinder)]
 
 # ============================================================
 # PURCELL FACTOR CALCULATION
 # ============================================================
 
-def calculate_purcell_factor(D, period):
+def calculate_purcell_factor(D_nm):
     """
     Calculate Purcell factor by comparing dipole radiation
     with and without nanostructure.
     
     Purcell factor F = P_structure / P_homogeneous
     """
-    sx = sy = period
-    cell_size = mp.Vector3(sx, sy, sz)
-    
-    z_bottom = -sz/2 + dpml
-    z_glass_top = z_bottom + 0.5
-    z_ITO_top = z_glass_top + h_ITO
+    D = D_nm / 1000
+    cell_size, _, _, _, geometry = unit_cell(D_nm)
     
     pml_layers = [mp.PML(thickness=dpml, direction=mp.Z)]
     
@@ -110,31 +93,7 @@ def calculate_purcell_factor(D, period):
     x_dipole = D/2 * 0.8  # Near disk edge where field is strongest
     
     # Reference: dipole in homogeneous TDBC
-    geometry_ref = [
-        mp.Block(size=mp.Vector3(mp.inf, mp.inf, z_glass_top - z_bottom),
-                 center=mp.Vector3(0, 0, (z_glass_top + z_bottom)/2), material=glass),
-        mp.Block(size=mp.Vector3(mp.inf, mp.inf, h_ITO),
-                 center=mp.Vector3(0, 0, z_glass_top + h_ITO/2), material=ITO),
-        mp.Block(size=mp.Vector3(mp.inf, mp.inf, h_TDBC),
-                 center=mp.Vector3(0, 0, z_ITO_top + h_TDBC/2), material=TDBC)
-    ]
-    
-    # With structure
-    geometry = geometry_ref.copy()
-    # TDBC shell (conformal)
-    geometry.append(mp.Cylinder(
-        radius=D/2 + h_TDBC,
-        height=h_disk + h_TDBC,
-        center=mp.Vector3(0, 0, z_ITO_top + (h_disk + h_TDBC)/2),
-        material=TDBC
-    ))
-    # Al disk
-    geometry.append(mp.Cylinder(
-        radius=D/2,
-        height=h_disk,
-        center=mp.Vector3(0, 0, z_ITO_top + h_disk/2),
-        material=Al
-    ))
+    geometry_ref = stack(geometry)
     
     # Dipole source
     sources = [mp.Source(
@@ -143,44 +102,39 @@ def calculate_purcell_factor(D, period):
         center=mp.Vector3(x_dipole, 0, z_dipole)
     )]
     
-    # Run reference (TDBC layer only)
-    sim_ref = mp.Simulation(
-        cell_size=cell_size, geometry=geometry_ref, boundary_layers=pml_layers,
-        sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0)
-    )
-    
     # Flux box around dipole
     flux_size = 0.1
-    flux_ref = sim_ref.add_flux(fcen, df, nfreq,
+    flux_box = [
         mp.FluxRegion(center=mp.Vector3(x_dipole, 0, z_dipole + flux_size/2), size=mp.Vector3(flux_size, flux_size, 0), direction=mp.Z),
         mp.FluxRegion(center=mp.Vector3(x_dipole, 0, z_dipole - flux_size/2), size=mp.Vector3(flux_size, flux_size, 0), direction=mp.Z, weight=-1),
         mp.FluxRegion(center=mp.Vector3(x_dipole + flux_size/2, 0, z_dipole), size=mp.Vector3(0, flux_size, flux_size), direction=mp.X),
         mp.FluxRegion(center=mp.Vector3(x_dipole - flux_size/2, 0, z_dipole), size=mp.Vector3(0, flux_size, flux_size), direction=mp.X, weight=-1),
         mp.FluxRegion(center=mp.Vector3(x_dipole, flux_size/2, z_dipole), size=mp.Vector3(flux_size, 0, flux_size), direction=mp.Y),
         mp.FluxRegion(center=mp.Vector3(x_dipole, -flux_size/2, z_dipole), size=mp.Vector3(flux_size, 0, flux_size), direction=mp.Y, weight=-1)
-    )
-    
-    sim_ref.run(until_after_sources=mp.stop_when_fields_decayed(30, mp.Ex, mp.Vector3(x_dipole, 0, z_dipole), 1e-3))
-    power_ref = np.array(mp.get_fluxes(flux_ref))
-    freqs = np.array(mp.get_flux_freqs(flux_ref))
-    
-    # Run with structure
-    sim = mp.Simulation(
-        cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
-        sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0)
-    )
-    
-    flux = sim.add_flux(fcen, df, nfreq,
-        mp.FluxRegion(center=mp.Vector3(x_dipole, 0, z_dipole + flux_size/2), size=mp.Vector3(flux_size, flux_size, 0), direction=mp.Z),
-        mp.FluxRegion(center=mp.Vector3(x_dipole, 0, z_dipole - flux_size/2), size=mp.Vector3(flux_size, flux_size, 0), direction=mp.Z, weight=-1),
-        mp.FluxRegion(center=mp.Vector3(x_dipole + flux_size/2, 0, z_dipole), size=mp.Vector3(0, flux_size, flux_size), direction=mp.X),
-        mp.FluxRegion(center=mp.Vector3(x_dipole - flux_size/2, 0, z_dipole), size=mp.Vector3(0, flux_size, flux_size), direction=mp.X, weight=-1),
-        mp.FluxRegion(center=mp.Vector3(x_dipole, flux_size/2, z_dipole), size=mp.Vector3(flux_size, 0, flux_size), direction=mp.Y),
-        mp.FluxRegion(center=mp.Vector3(x_dipole, -flux_size/2, z_dipole), size=mp.Vector3(flux_size, 0, flux_size), direction=mp.Y, weight=-1)
-    )
+    ]
     
-    sim.run(until_after_sources=mp.stop_when_fields_decayed(30, mp.Ex, mp.Vector3(x_dipole, 0, z_dipole), 1e-3))
-    power = np.array(mp.get_fluxes(flux))
+    def dipole_power(geometry, label=''):
+        """Power radiated by the dipole through the flux box (stored on disk)."""
+        def run():
+            sim = mp.Simulation(
+                cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
+                sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0)
+            )
+            box = sim.add_flux(fcen, df, nfreq, *flux_box)
+            stop = FluxConvergence([box], sim, wl_min, wl_max, flux_tol,
+                                   decay=(mp.Ex, mp.Vector3(x_dipole, 0, z_dipole), 30, 1e-3))
+            sim.run(until_after_sources=stop)
+            stop.report(label)
+            return {'freqs': np.array(mp.get_flux_freqs(box)), 'power': np.array(mp.get_fluxes(box))}
+        
+        key = simulation_key(cell_size, resolution, geometry, sources, [(fcen, df, nfreq, flux_box)],
+                             boundary_layers=pml_layers, flux_tol=flux_tol)
+        result = cached_run(key, run)
+        return result['freqs'], result['power']
+    
+    # Reference (TDBC layer only), then with structure
+    freqs, power_ref = dipole_power(geometry_ref, "reference: ")
+    _, power = dipole_power(geometry)
     
     # Purcell factor
     purcell = np.where(np.abs(power_ref) > 1e-10, np.abs(power) / np.abs(power_ref), 1.0)
@@ -189,16 +143,10 @@ def calculate_purcell_factor(D, period):
     wavelengths = 1 / freqs * 1000  # nm
     return wavelengths, purcell
 
-def calculate_transmission(D, period):
+def calculate_transmission(D_nm):
     """Calculate transmission for 1-T_norm plot."""
-    sx = sy = period
-    cell_size = mp.Vector3(sx, sy, sz)
-    
-    z_bottom = -sz/2 + dpml
-    z_glass_top = z_bottom + 0.5
-    z_ITO_top = z_glass_top + h_ITO
-    z_source = z_glass_top - 0.15
-    z_trans = z_ITO_top + h_disk + h_TDBC + 0.15
+    cell_size, z_source, z_trans, _, geometry = unit_cell(D_nm, resolution)
+    sx, sy = cell_size.x, cell_size.y
     
     pml_layers = [mp.PML(thickness=dpml, direction=mp.Z)]
     
@@ -210,50 +158,30 @@ def calculate_transmission(D, period):
     )]
     
     # TDBC layer only (reference for T_norm)
-    geometry_tdbc = [
-        mp.Block(size=mp.Vector3(mp.inf, mp.inf, z_glass_top - z_bottom),
-                 center=mp.Vector3(0, 0, (z_glass_top + z_bottom)/2), material=glass),
-        mp.Block(size=mp.Vector3(mp.inf, mp.inf, h_ITO),
-                 center=mp.Vector3(0, 0, z_glass_top + h_ITO/2), material=ITO),
-        mp.Block(size=mp.Vector3(mp.inf, mp.inf, h_TDBC),
-                 center=mp.Vector3(0, 0, z_ITO_top + h_TDBC/2), material=TDBC)
-    ]
-    
-    # With disk
-    geometry = geometry_tdbc.copy()
-    geometry.append(mp.Cylinder(
-        radius=D/2 + h_TDBC,
-        height=h_disk + h_TDBC,
-        center=mp.Vector3(0, 0, z_ITO_top + (h_disk + h_TDBC)/2),
-        material=TDBC
-    ))
-    geometry.append(mp.Cylinder(
-        radius=D/2,
-        height=h_disk,
-        center=mp.Vector3(0, 0, z_ITO_top + h_disk/2),
-        material=Al
-    ))
-    
-    # Reference simulation (TDBC only)
-    sim_ref = mp.Simulation(
-        cell_size=cell_size, geometry=geometry_tdbc, boundary_layers=pml_layers,
-        sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0)
-    )
-    trans_ref = sim_ref.add_flux(fcen, df, nfreq,
-        mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0)))
-    sim_ref.run(until_after_sources=mp.stop_when_fields_decayed(50, mp.Ex, mp.Vector3(0, 0, z_trans), 1e-3))
-    flux_ref = np.array(mp.get_fluxes(trans_ref))
-    freqs = np.array(mp.get_flux_freqs(trans_ref))
-    
-    # Full simulation
-    sim = mp.Simulation(
-        cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
-        sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0)
-    )
-    trans = sim.add_flux(fcen, df, nfreq,
-        mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0)))
-    sim.run(until_after_sources=mp.stop_when_fields_decayed(50, mp.Ex, mp.Vector3(0, 0, z_trans), 1e-3))
-    flux = np.array(mp.get_fluxes(trans))
+    geometry_tdbc = stack(geometry)
+    
+    # Reference (TDBC only, shared across diameters)
+    freqs, flux_ref = reference_flux(geometry_tdbc, sx, sy, z_source, z_trans, sz, dpml,
+                                     resolution, fcen, df, nfreq, flux_tol, reference_method)
+    
+    # Full simulation (stored on disk, keyed by everything that determines the run)
+    flux_region = mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0))
+    
+    def run_full():
+        sim = mp.Simulation(
+            cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
+            sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0)
+        )
+        trans = sim.add_flux(fcen, df, nfreq, flux_region)
+        stop = FluxConvergence([trans], sim, wl_min, wl_max, flux_tol,
+                               decay=(mp.Ex, mp.Vector3(0, 0, z_trans), 50, 1e-3))
+        sim.run(until_after_sources=stop)
+        stop.report()
+        return {'flux': np.array(mp.get_fluxes(trans))}
+    
+    key = simulation_key(cell_size, resolution, geometry, sources, [(fcen, df, nfreq, flux_region)],
+                         boundary_layers=pml_layers, flux_tol=flux_tol)
+    flux = cached_run(key, run_full)['flux']
     
     T_norm = np.where(flux_ref > 0, flux / flux_ref, 1.0)
     T_norm = gaussian_filter1d(T_norm, sigma=2)
@@ -312,25 +240,31 @@ print("\n" + "=" * 70)
 print("Calculating Purcell factors and transmission...")
 print("=" * 70)
 
+def simulate_point(kind, D_nm):
+    """Sweep entry point: Purcell factor or transmission for one diameter."""
+    if kind == 'purcell':
+        return calculate_purcell_factor(D_nm)
+    return calculate_transmission(D_nm)
+
+def point_cost(kind, D_nm):
+    """Scheduling cost of simulate_point: Purcell points are two runs with a six-plane flux box."""
+    cell_size, _, _, _, geometry = unit_cell(D_nm, None if kind == 'purcell' else resolution)
+    if kind == 'purcell':
+        return 2 * job_cost(cell_size, geometry, resolution, 6 * 0.1**2, nfreq)
+    return job_cost(cell_size, geometry, resolution, cell_size.x * cell_size.y, nfreq)
+
 # Store results
 results = {}
 
-# Run for all diameters in Figure 5a
+# Run for all diameters in Figure 5a (Purcell and transmission runs share one worker pool)
 all_diameters = np.union1d(diameters_nm, diameters_specific)
 
-for D_nm in all_diameters:
-    D = D_nm / 1000
-    period = D + gap
-    print(f"\nD = {D_nm} nm:")
-    
-    print("  Calculating Purcell factor...", end=" ", flush=True)
-    wavelengths, purcell = calculate_purcell_factor(D, period)
-    print("done")
-    
-    print("  Calculating transmission...", end=" ", flush=True)
-    _, T_norm = calculate_transmission(D, period)
-    print("done")
-    
+runs = run_sweep(simulate_point, [(kind, D_nm) for kind in ('purcell', 'transmission')
+                                  for D_nm in all_diameters], cost=point_cost)
+wavelengths, spectra = sweep_spectra(runs)
+purcell_all, T_norm_all = spectra[:len(all_diameters)], spectra[len(all_diameters):]
+
+for D_nm, purcell, T_norm in zip(all_diameters, purcell_all, T_norm_all):
     # Calculate emission enhancement
     emission_enh = calculate_emission_enhancement(wavelengths, purcell, T_norm)
     
@@ -418,8 +352,9 @@ for i, D_nm in enumerate(diameters_specific):
     ax.legend(lines1 + lines2, labels1 + labels2, loc='upper right', fontsize=8)
 
 plt.tight_layout()
-plt.savefig('fig5_proper.png', dpi=200, bbox_inches='tight')
-print("\nSaved: fig5_proper.png")
+if is_master():
+    plt.savefig('fig5_proper.png', dpi=200, bbox_inches='tight')
+    print("\nSaved: fig5_proper.png")
 
 # ============================================================
 # SUMMARY
@@ -449,10 +384,11 @@ Remaining differences from paper:
 """)
 
 # Save data
-np.savez('fig5_proper_data.npz', 
-         diameters_nm=all_diameters,
-         results=results)
-print("Saved: fig5_proper_data.npz")
+if is_master():
+    np.savez('fig5_proper_data.npz',
+             diameters_nm=all_diameters,
+             results=results)
+    print("Saved: fig5_proper_data.npz")
 
 print("\n" + "=" * 70)
 print("Figure 5 proper reproduction complete!")
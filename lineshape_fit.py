@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Batched Fano/Lorentzian lineshape fits of whole transmission maps
+=================================================================
+
+Every row of a (n_params, n_freq) transmission map is fitted, on the
+photon-energy axis E, with a linear baseline and 1-3 Fano terms
+
+    T(E) = b0 + b1 (E - E_mid) + sum_k A_k (q_k^2 + 2 q_k e_k - 1) / (1 + e_k^2),
+    e_k = 2 (E - E_k) / Gamma_k,
+
+which is (q + e)^2 / (1 + e^2) - 1 scaled by A: q = 0 is a Lorentzian dip
+of depth A and FWHM Gamma, and |q| measures the asymmetry (fano=False
+keeps q = 0). All rows are solved together by Levenberg-Marquardt with the
+analytic Jacobian (one batched 3 + 4 n_terms normal-equation solve per
+iteration, one damping factor per row).
+
+Initial guesses come from the deepest dips of each row (polariton_fit.dips).
+Rows whose residual stays above `outlier` times the median are then
+refitted, for up to `sweeps` passes, from the converged parameters of the
+nearest well-fitted rows above and below, keeping the better fit: good fits
+spread along the map into rows whose own dips were ambiguous.
+
+`python lineshape_fit.py fig3cd_fast_data.npz` fits every 2D map in the file
+(bare_transmission, coated_transmission, T_bare, T_coated_x, ...), whichever
+of its axes is the wavelength axis.
+
+Author: ReproAgent
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from polariton_fit import dips
+
+n_terms = 2
+sweeps = 3
+outlier = 2.0         # rows with rms above this times the median are refitted
+width_guess = 0.1     # eV
+q_max = 20            # beyond this a Fano term is indistinguishable from a peak
+
+
+def _unpack(params):
+    """Baseline (rows, 2) and per-term A, E0, Gamma, q (rows, n_terms)."""
+    terms = params[:, 2:].reshape(len(params), -1, 4)
+    return params[:, :2], terms[..., 0], terms[..., 1], terms[..., 2], terms[..., 3]
+
+
+def model(params, E, jacobian=True):
+    """T (rows, n_freq) and, if asked, the Jacobian (rows, n_freq, n_par) for params (rows, n_par)."""
+    baseline, A, E0, Gamma, q = _unpack(params)
+    x = E - np.mean(E)
+    e = 2 * (E[None, None, :] - E0[..., None]) / Gamma[..., None]
+    D = 1 + e**2
+    N = q[..., None]**2 + 2 * q[..., None] * e - 1
+    T = baseline[:, :1] + baseline[:, 1:] * x + np.sum(A[..., None] * N / D, axis=1)
+    if not jacobian:
+        return T
+
+    J = np.empty(T.shape + (params.shape[1],))
+    J[..., 0] = 1
+    J[..., 1] = x
+    dT_de = A[..., None] * (2 * q[..., None] * D - 2 * e * N) / D**2
+    for k in range(A.shape[1]):
+        J[..., 2 + 4*k] = N[:, k] / D[:, k]
+        J[..., 3 + 4*k] = -2 * dT_de[:, k] / Gamma[:, k, None]
+        J[..., 4 + 4*k] = -e[:, k] * dT_de[:, k] / Gamma[:, k, None]
+        J[..., 5 + 4*k] = 2 * A[:, k, None] * (q[:, k, None] + e[:, k]) / D[:, k]
+    return T, J
+
+
+def levenberg_marquardt(params, E, T, free=None, iterations=100, tol=1e-7):
+    """
+    Fit every row of T from params; free masks the parameters allowed to
+    move. Rows leave the batch once their cost stops improving by more than
+    tol (relative) or their damping runs away.
+    """
+    params = params.copy()
+    free = np.ones(params.shape[1], dtype=bool) if free is None else free
+    fixed = np.diag(~free).astype(float)
+    lam = np.full(len(params), 1e-3)
+    cost = np.sum((model(params, E, jacobian=False) - T)**2, axis=1)
+    active = np.arange(len(params))
+    for _ in range(iterations):
+        if len(active) == 0:
+            break
+        p, y = params[active], T[active]
+        model_T, J = model(p, E)
+        J = J * free
+        A = J.swapaxes(1, 2) @ J + fixed
+        grad = (J.swapaxes(1, 2) @ (model_T - y)[..., None])[..., 0]
+        damped = A + lam[active, None, None] * (A * np.eye(len(free)) + 1e-12 * np.eye(len(free)))
+        trial = p + np.linalg.solve(damped, -grad[..., None])[..., 0]
+        trial[:, 4::4] = np.abs(trial[:, 4::4])   # Gamma > 0
+        trial[:, 5::4] = np.clip(trial[:, 5::4], -q_max, q_max)
+        new = np.sum((model(trial, E, jacobian=False) - y)**2, axis=1)
+        better = np.isfinite(new) & (new < cost[active])
+        done = (better & (cost[active] - new <= tol * cost[active])) | (lam[active] > 1e10)
+        params[active[better]] = trial[better]
+        cost[active[better]] = new[better]
+        lam[active] = np.where(better, lam[active] / 3, lam[active] * 4)
+        active = active[~done]
+    return params, cost
+
+
+def initial_guess(wavelengths_nm, T, n_terms=n_terms):
+    """Parameters from the n_terms deepest dips of each row (evenly spread if fewer)."""
+    T = np.asarray(T, dtype=float)
+    mask, E_dip = dips(wavelengths_nm, T)
+    E = 1239.84 / np.asarray(wavelengths_nm, dtype=float)
+    order = np.argsort(np.where(mask, T, np.inf), axis=1)[:, :n_terms]
+    found = np.take_along_axis(mask, order, 1)
+    spread = np.linspace(E.min(), E.max(), n_terms + 2)[1:-1]
+    E0 = np.where(found, np.take_along_axis(E_dip, order, 1), spread[None, :])
+    base = np.max(T, axis=1)
+    A = np.where(found, base[:, None] - np.take_along_axis(T, order, 1), 0.01)
+
+    params = np.zeros((len(T), 2 + 4 * n_terms))
+    params[:, 0] = base
+    terms = params[:, 2:].reshape(len(T), n_terms, 4)
+    terms[..., 0], terms[..., 1], terms[..., 2] = A, E0, width_guess
+    return params
+
+
+def _nearest(ok):
+    """Index of the closest row with ok set before and after each row (-1 if none)."""
+    index = np.where(ok, np.arange(len(ok)), -1)
+    before = np.maximum.accumulate(index)
+    after = np.where(ok, np.arange(len(ok)), len(ok))[::-1]
+    after = np.minimum.accumulate(after)[::-1]
+    return before, np.where(after < len(ok), after, -1)
+
+
+def fit_map(wavelengths_nm, T, n_terms=n_terms, fano=True, sweeps=sweeps):
+    """
+    Fit every row of T (rows, wavelengths). Returns a dict of arrays:
+    baseline (rows, 2), and amplitude, energy (eV), wavelength (nm), width
+    (eV FWHM) and q (rows, n_terms), terms sorted by energy, plus the rms
+    residual per row.
+    """
+    T = np.asarray(T, dtype=float)
+    E = 1239.84 / np.asarray(wavelengths_nm, dtype=float)
+    free = np.ones(2 + 4 * n_terms, dtype=bool)
+    if not fano:
+        free[5::4] = False
+
+    good = np.all(np.isfinite(T), axis=1)
+    T_fit = np.where(good[:, None], T, 1)
+    params, cost = levenberg_marquardt(initial_guess(wavelengths_nm, T_fit, n_terms), E, T_fit, free)
+    for _ in range(sweeps):
+        rms = np.sqrt(cost / T.shape[1])
+        poor = good & (rms > outlier * np.median(rms[good]))
+        if not poor.any():
+            break
+        for source in _nearest(~poor & good):
+            rows = np.flatnonzero(poor & (source >= 0))
+            trial, trial_cost = levenberg_marquardt(params[source[rows]], E, T_fit[rows], free)
+            better = trial_cost < cost[rows]
+            params[rows[better]] = trial[better]
+            cost[rows[better]] = trial_cost[better]
+
+    baseline, A, E0, Gamma, q = _unpack(params)
+    order = np.argsort(E0, axis=1)
+    A, E0, Gamma, q = (np.take_along_axis(v, order, 1) for v in (A, E0, Gamma, q))
+    bad = ~good[:, None]
+    return {'baseline': np.where(bad, np.nan, baseline),
+            'amplitude': np.where(bad, np.nan, A),
+            'energy': np.where(bad, np.nan, E0),
+            'wavelength': np.where(bad, np.nan, 1239.84 / E0),
+            'width': np.where(bad, np.nan, Gamma),
+            'q': np.where(bad, np.nan, q),
+            'rms': np.where(good, np.sqrt(cost / T.shape[1]), np.nan)}
+
+
+def fit_npz(path, n_terms=n_terms, fano=True):
+    """
+    fit_map for every 2D map in a saved npz, keyed by array name. Maps
+    saved as (wavelengths, sizes) (fig3cd_exact, fig4_exact) are transposed
+    to one spectrum per row.
+    """
+    with np.load(path) as data:
+        wl = np.asarray(data['wavelengths_nm'] if 'wavelengths_nm' in data.files else data['wavelengths'])
+        if wl.max() < 10:
+            wl = wl * 1000   # µm
+        maps = {}
+        for k in data.files:
+            try:
+                array = data[k]
+            except ValueError:   # pickled object array (e.g. fig5_proper's results)
+                continue
+            if array.dtype == object or array.ndim != 2:
+                continue
+            if array.shape[1] == len(wl):
+                maps[k] = array
+            elif array.shape[0] == len(wl):
+                maps[k] = array.T
+    return {k: fit_map(wl, T, n_terms, fano) for k, T in maps.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched Fano/Lorentzian fits of saved transmission maps")
+    parser.add_argument('path', nargs='?', default='fig3cd_fast_data.npz')
+    parser.add_argument('--terms', type=int, default=n_terms, choices=(1, 2, 3))
+    parser.add_argument('--lorentzian', action='store_true', help="symmetric lines (q = 0)")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    fits = fit_npz(args.path, args.terms, fano=not args.lorentzian)
+    print(f"Fitted {sum(len(f['rms']) for f in fits.values())} spectra in {time.time() - t0:.2f}s")
+    for name, result in fits.items():
+        print(f"\n{name} (median rms {np.nanmedian(result['rms']):.4f}):")
+        for i in range(len(result['rms'])):
+            lines = ", ".join(f"{w:.0f} nm (FWHM {G * 1000:.0f} meV, q {q:+.2f})"
+                              for w, G, q in zip(result['wavelength'][i], result['width'][i], result['q'][i]))
+            print(f"  row {i}: {lines}")
+    out = args.path.replace('.npz', '_lineshapes.npz')
+    np.savez(out, **{f"{name}_{k}": v for name, result in fits.items() for k, v in result.items()})
+    print(f"\nSaved: {out}")
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Multi-fidelity sweeps: coarse everywhere, fine near the exciton
+===============================================================
+
+At resolution 60 the 20 nm TDBC shell is barely more than one pixel, but
+running whole sweeps at 80-120 costs (res_fine / res_coarse)^4 as much.
+`multifidelity_sweep` runs every point at a coarse resolution, re-runs at
+the fine resolution only the points whose deepest dip is within
+`exciton_window` of the exciton (at least `min_overlap` per group, e.g.
+bare/coated), and learns the coarse -> fine correction from those
+overlapping points:
+
+    T_fine(E) ~ T_coarse(E - shift) + residual(E),
+
+a rigid energy shift (grid dispersion moves the resonances) found by a
+scan over `shifts`, plus what remains. Shift and residual are interpolated
+linearly over size between the overlap points of each group (constant
+beyond them) and applied to the coarse-only points. Leave-one-out
+predictions of the overlap points decide whether the residual carries
+over between sizes (otherwise only the shift is applied) and estimate the
+error of the corrected map.
+
+simulate must take the resolution as its last argument:
+
+    wl, T, fine = multifidelity_sweep(simulate_disk, [(D, coated) ...], coarse=40, fine=100)
+
+Author: ReproAgent
+"""
+
+import numpy as np
+
+from polariton_fit import dips
+from sweep import run_sweep, sweep_spectra
+
+E_X = 1.23984 / 0.590          # eV
+exciton_window = 0.2           # eV: points whose deepest dip is this close to E_X run fine
+min_overlap = 2                # fine runs per group, at least
+shifts = np.linspace(-0.2, 0.2, 401)   # eV, scanned for the rigid shift
+
+
+def _shifted(E, T, shift):
+    """T(E - shift) on the same energy grid, for each shift: (shifts, E)."""
+    order = np.argsort(E)
+    return np.array([np.interp(E - s, E[order], T[order]) for s in np.atleast_1d(shift)])
+
+
+def learn_correction(wavelengths_nm, T_coarse, T_fine):
+    """Rigid shift (eV) and residual of each overlap point: (n,), (n, wavelengths)."""
+    E = 1239.84 / np.asarray(wavelengths_nm, dtype=float)
+    best, residual = [], []
+    for tc, tf in zip(T_coarse, T_fine):
+        candidates = _shifted(E, tc, shifts)
+        i = np.argmin(np.mean((candidates - tf)**2, axis=1))
+        best.append(shifts[i])
+        residual.append(tf - candidates[i])
+    return np.array(best), np.array(residual)
+
+
+def apply_correction(wavelengths_nm, sizes, T_coarse, known_sizes, shift, residual):
+    """Coarse spectra at sizes corrected with the shift/residual learned at known_sizes."""
+    E = 1239.84 / np.asarray(wavelengths_nm, dtype=float)
+    order = np.argsort(known_sizes)
+    known, shift, residual = np.asarray(known_sizes)[order], shift[order], residual[order]
+    out = []
+    for size, tc in zip(sizes, T_coarse):
+        s = np.interp(size, known, shift)
+        r = np.array([np.interp(size, known, column) for column in residual.T])
+        out.append(_shifted(E, tc, s)[0] + r)
+    return np.array(out)
+
+
+def _leave_one_out(wavelengths_nm, known_sizes, T_coarse, T_fine, shift, residual):
+    """rms error of each overlap point corrected from the others (empty below two points)."""
+    errors = []
+    for k in range(len(known_sizes) if len(known_sizes) > 1 else 0):
+        others = np.arange(len(known_sizes)) != k
+        predicted = apply_correction(wavelengths_nm, known_sizes[[k]], T_coarse[[k]],
+                                     known_sizes[others], shift[others], residual[others])
+        errors.append(np.sqrt(np.mean((predicted[0] - T_fine[k])**2)))
+    return errors
+
+
+def multifidelity_sweep(simulate, points, coarse=40, fine=100, size=lambda p: p[0],
+                        group=lambda p: p[1:], processes=None):
+    """
+    Run points at `coarse`, refine near the exciton at `fine` and correct the rest.
+
+    Returns (wavelengths_nm, T, refined): T in point order, fine where
+    refined is True and corrected coarse elsewhere.
+    """
+    points = [p if isinstance(p, tuple) else (p,) for p in points]
+    coarse_runs = run_sweep(simulate, [p + (coarse,) for p in points], processes)
+    wavelengths, T_coarse = sweep_spectra(coarse_runs)
+
+    # distance of each point's deepest dip to the exciton (a coated spectrum
+    # always has some dip near E_X; the deepest is the plasmon-like one)
+    T_filled = np.nan_to_num(T_coarse, nan=1.0)
+    mask, E_dip = dips(wavelengths, T_filled)
+    deepest = np.argmin(np.where(mask, T_filled, np.inf), axis=1)
+    distance = np.where(mask.any(axis=1), np.abs(E_dip[np.arange(len(points)), deepest] - E_X), np.inf)
+    refined = distance < exciton_window
+    groups = {}
+    for i, p in enumerate(points):
+        groups.setdefault(group(p), []).append(i)
+    for members in groups.values():
+        members = np.array(members)
+        missing = min_overlap - np.sum(refined[members])
+        if missing > 0:
+            candidates = members[~refined[members]]
+            refined[candidates[np.argsort(distance[candidates])[:missing]]] = True
+
+    fine_index = np.flatnonzero(refined)
+    fine_runs = run_sweep(simulate, [points[i] + (fine,) for i in fine_index], processes)
+    _, T_fine = sweep_spectra(fine_runs)
+
+    T = T_coarse.copy()
+    T[fine_index] = T_fine
+    errors = []
+    for members in groups.values():
+        overlap = [i for i in members if refined[i] and np.all(np.isfinite(T[i]))]
+        rest = [i for i in members if not refined[i]]
+        if not overlap:
+            continue
+        known = np.array([size(points[i]) for i in overlap])
+        shift, residual = learn_correction(wavelengths, T_coarse[overlap], T[overlap])
+        # keep the residual only if it predicts the left-out overlap points better
+        loo = {use: _leave_one_out(wavelengths, known, T_coarse[overlap], T[overlap],
+                                   shift, residual if use else 0 * residual)
+               for use in (False, True)}
+        use_residual = len(overlap) > 1 and np.mean(loo[True]) < np.mean(loo[False])
+        errors += loo[bool(use_residual)]
+        if rest:
+            T[rest] = apply_correction(wavelengths, [size(points[i]) for i in rest], T_coarse[rest],
+                                       known, shift, residual if use_residual else 0 * residual)
+
+    hours = [sum(r.elapsed for r in runs) / 3600 for runs in (coarse_runs, fine_runs)]
+    per_fine = hours[1] / max(len(fine_runs), 1)
+    print(f"  Multi-fidelity: {len(fine_index)}/{len(points)} points refined at resolution {fine}; "
+          f"{sum(hours):.2f} core-h vs ~{per_fine * len(points):.2f} all-fine")
+    if errors:
+        print(f"  Corrected coarse points: leave-one-out rms error {np.mean(errors):.3f} "
+              f"(max {np.max(errors):.3f})")
+    return wavelengths, T, refined
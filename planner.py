@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Dry-run cost planner for the transmission figures
+=================================================
+
+fig3_fast.py, fig3cd_exact.py and fig5_exact.py are hand-tuned copies that
+trade diameters and resolution against wall time ("Expected time: ~10-15
+minutes instead of 30-40"). This estimates a figure's cost before anything
+runs, from the unit cells in unit_cells.py (the geometry the scripts run):
+
+- voxels of the grid-snapped cell and dispersive voxels (telemetry.py),
+  divided by the mirror-symmetry factor symmetry.py would use,
+- DFT memory of the flux plane: nx ny nfreq x 4 tangential components x
+  16 bytes (complex double),
+- timesteps = meep_time / dt with dt = Courant / resolution,
+- wall time = timesteps (a voxels + b dispersive voxels) / symmetry.
+
+a, b and meep_time are calibrated on past 3D plane-wave transmission runs
+(telemetry.transmission_records: run_telemetry.jsonl written by
+FluxConvergence.report, plus Meep console logs such as fig4_log.txt; the
+1D references, cylindrical and Purcell runs cost differently per voxel
+and run for different times, so they are left out): non-negative least
+squares on seconds per step once two or more runs with dispersive counts
+exist, otherwise the median cost per voxel-step with b = a. Runs that need not be simulated are
+deduplicated -- y-polarized runs of C4-symmetric cells (the x run serves),
+sizes shared between figures planned together -- and the flat-stack
+references are 1D runs (reference_flux.py), listed but negligible.
+
+Given a budget (`30m`, `2h` of wall time on `--cores`, or `4ch` core-hours)
+the planner picks the highest resolution up to `target_resolution` at which
+`min_sizes` sizes fit, then the densest sweep that still fits:
+
+    python planner.py fig3 --budget 30m
+    python planner.py fig3 fig5 --budget 4ch --cores 16
+    python planner.py fig4 --resolution 80 --sizes 9        # estimate only
+
+fig3_fast.py takes its resolution and diameters from `figure_settings` when
+its `time_budget` option is set.
+
+Author: ReproAgent
+"""
+
+import argparse
+import functools
+import heapq
+
+import numpy as np
+import meep as mp
+from scipy.optimize import nnls
+
+from symmetry import mirror_symmetries, equivalent_polarization
+from sweep import default_processes
+from telemetry import dispersive_voxels, transmission_records
+from unit_cells import TDBC_emission, disk_unit_cell, dpml, rod_unit_cell
+
+courant = 0.5
+resolutions = (40, 50, 60, 80, 100, 120)
+densities = (5, 7, 9, 13, 17, 25, 33)    # sizes per sweep
+target_resolution = 100                  # no point buying more than fig2bc uses
+min_sizes = 5
+size_step = 5                            # nm: sizes snap to this grid so sweeps share points
+dft_weight = 0.5                         # cost of one DFT point-frequency per step, in voxel updates
+
+# figure -> unit cell, size range (nm), (with_tdbc, polarization) runs per size, nfreq
+FIGURES = {
+    'fig3': (disk_unit_cell, (80, 200), [(False, 'x'), (True, 'x')], 150),
+    'fig4': (rod_unit_cell, (75, 205), [(False, 'x'), (True, 'x'), (True, 'y')], 150),
+    'fig5': (functools.partial(disk_unit_cell, tdbc=TDBC_emission), (75, 205), [(True, 'x')], 100),
+}
+
+
+def calibrate(found=None):
+    """Cost model {'a', 'b', 'meep_time', 'records'} from transmission-run telemetry records."""
+    found = transmission_records(found)
+    model = {'a': 2e-8, 'b': 2e-8, 'meep_time': 100.0, 'records': len(found)}
+    if not found:
+        return model
+    per_step = np.array([r['seconds'] / r['timesteps'] for r in found])
+    voxels = np.array([r['voxels'] / r['symmetry'] for r in found])
+    full = np.array([r['dispersive_voxels'] is not None for r in found])
+    if full.sum() >= 2:
+        dispersive = np.array([r['dispersive_voxels'] / r['symmetry'] for r, f in zip(found, full) if f])
+        (a, b), _ = nnls(np.stack([voxels[full], dispersive], -1), per_step[full])
+        model['a'], model['b'] = a, b
+    else:
+        model['a'] = model['b'] = float(np.median(per_step / voxels))
+    times = [r['meep_time'] for r, f in zip(found, full) if f] or [r['meep_time'] for r in found]
+    model['meep_time'] = float(np.median(times))
+    return model
+
+
+@functools.lru_cache(maxsize=None)
+def _geometry(unit_cell, size_nm, with_tdbc, polarization, resolution):
+    cell_size, z_source, _, _, geometry = unit_cell(size_nm, with_tdbc, resolution=resolution)
+    sx, sy, sz = cell_size.x, cell_size.y, cell_size.z
+    sources = [mp.Source(src=mp.GaussianSource(1.875, fwidth=1.25),
+                         component=mp.Ex if polarization == 'x' else mp.Ey,
+                         center=mp.Vector3(0, 0, z_source), size=mp.Vector3(sx, sy, 0))]
+    symmetry = 2 ** len(mirror_symmetries(geometry, sources, [mp.PML(thickness=dpml, direction=mp.Z)],
+                                          mp.Vector3()))
+    n = [int(round(sx * resolution)), int(round(sy * resolution)), int(round(sz * resolution))]
+    return (cell_size, geometry, symmetry, n,
+            dispersive_voxels(cell_size, geometry, resolution))
+
+
+def estimate_run(unit_cell, size_nm, with_tdbc, polarization, resolution, nfreq, model):
+    """Dry-run estimate of one FDTD run: dict of counts, bytes, timesteps and seconds."""
+    _, _, symmetry, n, dispersive = _geometry(unit_cell, size_nm, with_tdbc, polarization, resolution)
+    voxels = int(np.prod(n))
+    timesteps = int(np.ceil(model['meep_time'] * resolution / courant))
+    return {'voxels': voxels, 'dispersive_voxels': dispersive, 'symmetry': symmetry,
+            'dft_bytes': n[0] * n[1] * nfreq * 4 * 16 / symmetry,
+            'timesteps': timesteps,
+            'seconds': timesteps * (model['a'] * voxels + model['b'] * dispersive) / symmetry}
+
+
+def job_cost(cell_size, geometry, resolution, flux_area=0, nfreq=0, symmetry=1, meep_time=100):
+    """
+    Relative cost of one run for sweep scheduling, in voxel updates:
+    timesteps x (voxels + voxels x susceptibilities + dft_weight x DFT
+    points x nfreq) / symmetry, with flux_area the summed area (µm^2) of
+    the flux planes.
+    """
+    voxels = np.prod([max(1, int(round(getattr(cell_size, a) * resolution))) for a in 'xyz'])
+    poles = dispersive_voxels(cell_size, geometry, resolution, poles=True)
+    timesteps = meep_time * resolution / courant
+    return timesteps * (voxels + poles + dft_weight * flux_area * resolution**2 * nfreq) / symmetry
+
+
+def unit_cell_cost(unit_cell, resolution, nfreq, symmetry=4):
+    """cost(size_nm, with_tdbc=False, ...) of a plane-wave transmission run of a unit_cells.py cell."""
+    def cost(size_nm, with_tdbc=False, *rest):
+        cell_size, _, _, _, geometry = unit_cell(size_nm, with_tdbc, resolution=resolution)
+        return job_cost(cell_size, geometry, resolution, cell_size.x * cell_size.y, nfreq, symmetry)
+    return cost
+
+
+def sweep_sizes(size_range, n):
+    """n sizes over size_range, snapped to size_step."""
+    return sorted({int(size_step * round(s / size_step)) for s in np.linspace(*size_range, n)})
+
+
+def plan_runs(figures, resolution, n_sizes, model):
+    """Unique runs of the figures at (resolution, n_sizes): (runs, deduplicated count, references)."""
+    runs, requested, references = {}, 0, set()
+    for name in figures:
+        unit_cell, size_range, kinds, nfreq = FIGURES[name]
+        for size in sweep_sizes(size_range, n_sizes):
+            for with_tdbc, polarization in kinds:
+                requested += 1
+                cell_size, geometry, *_ = _geometry(unit_cell, size, with_tdbc, polarization, resolution)
+                simulated = equivalent_polarization(cell_size, geometry, polarization)
+                key = (unit_cell.__name__, size, with_tdbc, simulated, resolution, nfreq)
+                if key not in runs:
+                    runs[key] = estimate_run(unit_cell, size, with_tdbc, simulated, resolution, nfreq, model)
+                references.add((unit_cell.__name__, with_tdbc, resolution, nfreq))
+    return runs, requested - len(runs), len(references)
+
+
+def wall_time(seconds, cores):
+    """Makespan of runs of the given durations on a pool of cores (longest first)."""
+    loads = [0.0] * max(1, cores)
+    for s in sorted(seconds, reverse=True):
+        heapq.heappush(loads, heapq.heappop(loads) + s)
+    return max(loads)
+
+
+def parse_budget(text):
+    """'30m', '2h', '90s' -> ('wall', seconds); '4ch' -> ('core', seconds)."""
+    units = {'ch': ('core', 3600), 's': ('wall', 1), 'm': ('wall', 60), 'h': ('wall', 3600)}
+    for suffix, (kind, scale) in units.items():
+        if text.endswith(suffix):
+            return kind, float(text[:-len(suffix)]) * scale
+    raise ValueError(f"budget {text!r}: expected a number with s, m, h or ch")
+
+
+def plan(figures, budget, cores=None, model=None):
+    """(resolution, n_sizes, runs, cost in seconds) of the best plan within budget, or None."""
+    model = calibrate() if model is None else model
+    cores = cores or default_processes()
+    kind, limit = parse_budget(budget) if isinstance(budget, str) else budget
+    for resolution in sorted((r for r in resolutions if r <= target_resolution), reverse=True):
+        best = None
+        for n_sizes in (n for n in densities if n >= min_sizes):
+            runs, *_ = plan_runs(figures, resolution, n_sizes, model)
+            seconds = [r['seconds'] for r in runs.values()]
+            cost = sum(seconds) if kind == 'core' else wall_time(seconds, cores)
+            if cost > limit:
+                break
+            best = (resolution, n_sizes, runs, cost)
+        if best is not None:
+            return best
+    return None
+
+
+def figure_settings(name, budget, cores=None):
+    """(resolution, sizes_nm) of the best plan for one figure within budget."""
+    chosen = plan([name], budget, cores)
+    if chosen is None:
+        raise ValueError(f"{name} does not fit in {budget}")
+    return chosen[0], np.array(sweep_sizes(FIGURES[name][1], chosen[1]))
+
+
+def report(figures, resolution, n_sizes, model, cores):
+    runs, deduplicated, references = plan_runs(figures, resolution, n_sizes, model)
+    print(f"\n{' + '.join(figures)} at resolution {resolution}, {n_sizes} sizes per sweep:")
+    print(f"  {'run':28s}{'nfreq':>6}{'voxels':>10}{'dispersive':>12}{'sym':>5}{'DFT MB':>9}"
+          f"{'steps':>8}{'time':>9}")
+    for (cell, size, tdbc, pol, _, nfreq), r in sorted(runs.items()):
+        label = f"{cell.replace('_unit_cell', '')} {size} nm {'coated' if tdbc else 'bare'} {pol}"
+        print(f"  {label:28s}{nfreq:>6}{r['voxels']:>10}{r['dispersive_voxels']:>12}{r['symmetry']:>5}"
+              f"{r['dft_bytes'] / 2**20:>9.1f}{r['timesteps']:>8}{r['seconds'] / 60:>8.1f}m")
+    seconds = [r['seconds'] for r in runs.values()]
+    print(f"  {len(runs)} runs ({deduplicated} deduplicated), {references} 1D references (negligible)")
+    print(f"  peak DFT memory per run {max(r['dft_bytes'] for r in runs.values()) / 2**20:.1f} MB; "
+          f"{sum(seconds) / 3600:.2f} core-h, ~{wall_time(seconds, cores) / 60:.1f} min on {cores} cores")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dry-run cost estimate and budget plan for a figure")
+    parser.add_argument('figures', nargs='+', choices=sorted(FIGURES))
+    parser.add_argument('--budget', help="wall time (30m, 2h, 90s) or core-hours (4ch)")
+    parser.add_argument('--cores', type=int, default=None)
+    parser.add_argument('--resolution', type=int, default=60)
+    parser.add_argument('--sizes', type=int, default=7, help="sizes per sweep")
+    args = parser.parse_args()
+
+    model = calibrate()
+    cores = args.cores or default_processes()
+    print(f"Cost model from {model['records']} telemetry records: {model['a'] * 1e9:.1f} ns per voxel-step "
+          f"+ {model['b'] * 1e9:.1f} ns per dispersive voxel-step, {model['meep_time']:.0f} Meep time units per run")
+    if args.budget:
+        chosen = plan(args.figures, args.budget, cores, model)
+        if chosen is None:
+            print(f"\nNothing fits in {args.budget}: {min_sizes} sizes at resolution "
+                  f"{min(resolutions)} already exceed it")
+        else:
+            resolution, n_sizes, _, _ = chosen
+            report(args.figures, resolution, n_sizes, model, cores)
+            for name in args.figures:
+                print(f"  {name}: resolution = {resolution}, sizes = {sweep_sizes(FIGURES[name][1], n_sizes)}")
+    else:
+        report(args.figures, args.resolution, args.sizes, model, cores)
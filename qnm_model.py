@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Quasinormal-mode perturbation model of the TDBC coupling
+========================================================
+
+Changing the TDBC oscillator strength (f_TDBC = 0.45 for the dispersion,
+0.15 for emission) means re-running every diameter. But the exciton only
+enters through a Lorentzian added to the shell's background permittivity
+eps_b, and the LSP sees it through its mode volume. One Harminv run per
+size of the coated cell with the exciton switched off (the shell reduced to
+eps_b) gives the LSP quasinormal mode f_p - i decay_p, and DFT fields over
+the shell give its filling fraction
+
+    F = eps_b int_shell |E|^2 / W,    W = 2 int_dielectrics Re(eps) |E|^2
+
+(in the quasi-static limit half of a plasmon's energy is the electrons'
+kinetic energy, hence the factor 2). First-order perturbation by
+sigma f_n^2 / (f_n^2 - f^2 - i f gamma_n) then couples the LSP to each
+Lorentzian pole f_n - i gamma_n / 2 with
+
+    g_n = (f_n / 2) sqrt(F sigma_n / eps_b),
+
+and a different background eps_b' shifts the LSP by -F (eps_b' - eps_b) / (2 eps_b).
+`qnm_coupled_modes` diagonalizes the resulting non-Hermitian matrix
+(coupled_modes.diagonalize) and
+`coupled_spectrum` returns the plasmon-driven extinction, both batched over
+sizes and taking milliseconds for any TDBC medium. `spot_check` runs FDTD
+for one size with that medium and reports the error of the UP/LP energies.
+
+Author: ReproAgent
+"""
+
+import copy
+import time
+
+import meep as mp
+import numpy as np
+
+from coupled_modes import diagonalize, hamiltonian
+from unit_cells import grid_length, inside
+from resonances import edge_probes, select_modes, strongest, extract_modes, ringdown, dpml
+from result_cache import simulation_key, cached_run
+from transfer_matrix import medium_epsilon
+
+nfreq_dft = 21      # DFT frequencies across the band for the filling fraction
+
+
+def is_excitonic(medium):
+    """A medium whose poles are all Lorentzian (no Drude term): the TDBC layers."""
+    poles = medium.E_susceptibilities
+    return bool(poles) and all(isinstance(s, mp.LorentzianSusceptibility) and
+                               not isinstance(s, mp.DrudeSusceptibility) for s in poles)
+
+
+def with_exciton(unit_cell, medium):
+    """unit_cell with every excitonic medium replaced by `medium`."""
+    def replaced(size_nm, with_tdbc=False):
+        *rest, geometry_ref, geometry = unit_cell(size_nm, with_tdbc)
+        swapped = []
+        for obj in geometry:
+            if is_excitonic(obj.material):
+                obj = copy.copy(obj)
+                obj.material = medium
+            swapped.append(obj)
+        return (*rest, geometry_ref, swapped)
+    return replaced
+
+
+def _background(unit_cell, size_nm):
+    """eps_b of the cell's excitonic shell."""
+    for obj in unit_cell(size_nm, True)[-1]:
+        if is_excitonic(obj.material):
+            return obj.material.epsilon_diag.x
+    raise ValueError("the coated unit cell has no excitonic (Lorentzian-only) medium")
+
+
+def lsp_qnm(unit_cell, size_nm, polarization='x', resolution=60, wl_min=0.4, wl_max=0.8):
+    """
+    LSP quasinormal mode of the coated cell with the exciton switched off:
+    dict with freq, decay (1/µm), amp, fill (F at the LSP) and eps_b.
+    """
+    eps_b = _background(unit_cell, size_nm)
+    shell = mp.Medium(epsilon=eps_b)
+    cell_size, z_source, _, _, geometry = with_exciton(unit_cell, shell)(size_nm, True)
+    sx, sy = grid_length(cell_size.x, resolution), grid_length(cell_size.y, resolution)
+    cell_size = mp.Vector3(sx, sy, cell_size.z)
+    fcen = (1/wl_max + 1/wl_min) / 2
+    df = 1/wl_min - 1/wl_max
+
+    pml_layers = [mp.PML(thickness=dpml, direction=mp.Z)]
+    sources = [mp.Source(src=mp.GaussianSource(fcen, fwidth=df),
+                         component={'x': mp.Ex, 'y': mp.Ey}[polarization],
+                         center=mp.Vector3(0, 0, z_source), size=mp.Vector3(sx, sy, 0))]
+    probes = edge_probes(geometry, polarization)
+    particle = geometry[-1]
+    z_top = max(obj.center.z + (obj.height if isinstance(obj, mp.Cylinder) else obj.size.z) / 2
+                for obj in geometry if not isinstance(obj, mp.Block) or isinstance(obj, mp.Ellipsoid))
+    z_low = particle.center.z - 0.1
+    volume = mp.Volume(center=mp.Vector3(0, 0, (z_low + z_top + 0.1) / 2),
+                       size=mp.Vector3(sx, sy, z_top + 0.1 - z_low))
+
+    def run():
+        sim = mp.Simulation(cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
+                            sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0))
+        harminvs = [mp.Harminv(component, point, fcen, df) for component, point in probes]
+        dft = sim.add_dft_fields([mp.Ex, mp.Ey, mp.Ez], fcen, df, nfreq_dft, where=volume)
+        sim.run(mp.after_sources(*harminvs), until_after_sources=ringdown)
+        modes = [m for h in harminvs for m in h.modes]
+
+        # material of every DFT point: the last object containing it, as in Meep
+        x, y, z, w = sim.get_array_metadata(dft_cell=dft)
+        X, Y, Z = np.meshgrid(x, y, z, indexing='ij')
+        owner = np.full(X.shape, -1)
+        for i, obj in enumerate(geometry):
+            owner[inside(obj, X, Y, Z)] = i
+        freqs = fcen + df * (np.arange(nfreq_dft) / (nfreq_dft - 1) - 0.5)
+        eps = np.ones((nfreq_dft,) + X.shape)
+        for i, obj in enumerate(geometry):
+            eps[:, owner == i] = np.real(medium_epsilon(obj.material, freqs))[:, None]
+        in_shell = np.isin(owner, [i for i, obj in enumerate(geometry) if obj.material is shell])
+        dielectric = ~np.isin(owner, [i for i, obj in enumerate(geometry) if obj.material is particle.material])
+
+        fill = np.empty(nfreq_dft)
+        for n in range(nfreq_dft):
+            E2 = sum(np.abs(sim.get_dft_array(dft, c, n))**2 for c in (mp.Ex, mp.Ey, mp.Ez))
+            fill[n] = eps_b * np.sum((w * E2)[in_shell]) / (2 * np.sum((w * eps[n] * E2)[dielectric]))
+        return {'freq': np.array([m.freq for m in modes]),
+                'decay': np.array([m.decay for m in modes]),
+                'Q': np.array([m.Q for m in modes]),
+                'amp': np.array([m.amp for m in modes], dtype=complex),
+                'err': np.array([m.err for m in modes]),
+                'dft_freqs': freqs, 'fill': fill}
+
+    key = simulation_key(cell_size, resolution, geometry, sources, [probes, (fcen, df, nfreq_dft, volume)],
+                         boundary_layers=pml_layers, ringdown=ringdown, kind='qnm')
+    raw = cached_run(key, run)
+    modes = select_modes({k: raw[k] for k in ('freq', 'decay', 'Q', 'amp', 'err')}, wl_min, wl_max)
+    i = strongest(modes)
+    if i is None:
+        raise RuntimeError(f"no LSP mode found for size {size_nm} nm")
+    return {'freq': modes['freq'][i], 'decay': modes['decay'][i], 'amp': modes['amp'][i],
+            'fill': np.interp(modes['freq'][i], raw['dft_freqs'], raw['fill']), 'eps_b': eps_b}
+
+
+def lsp_qnms(unit_cell, sizes_nm, polarization='x', **kwargs):
+    """lsp_qnm for each size, as a dict of arrays over sizes_nm."""
+    qnms = [lsp_qnm(unit_cell, size, polarization, **kwargs) for size in sizes_nm]
+    return {k: np.array([q[k] for q in qnms]) for k in qnms[0]}
+
+
+def _couplings(qnm, exciton):
+    """Shifted complex LSP frequency (sizes,), pole frequencies and couplings (sizes, poles)."""
+    fill, eps_b = np.asarray(qnm['fill']), np.asarray(qnm['eps_b'])
+    f_p = (qnm['freq'] - 1j * qnm['decay']) * (1 - fill * (exciton.epsilon_diag.x - eps_b) / (2 * eps_b))
+    poles = [s for s in exciton.E_susceptibilities]
+    f_n = np.array([s.frequency - 0.5j * s.gamma for s in poles])
+    g = np.array([s.frequency / 2 * np.sqrt(fill * s.sigma_diag.x / eps_b) for s in poles]).T
+    return f_p, f_n, np.atleast_2d(g)
+
+
+def qnm_coupled_modes(qnm, exciton):
+    """
+    Complex frequencies (f - i decay, 1/µm) and LSP fractions of the coupled
+    modes for the TDBC medium `exciton`, shape (sizes, 1 + poles), ordered
+    by frequency (the last column is the upper polariton).
+    """
+    f_p, f_n, g = _couplings(qnm, exciton)
+    H = hamiltonian([f_p.real, *f_n.real], [-2 * f_p.imag, *(-2 * f_n.imag)],
+                    {(0, n + 1): g[:, n] for n in range(len(f_n))})
+    freqs, linewidths, fractions = diagonalize(H)
+    return freqs - 0.5j * linewidths, fractions[..., 0]
+
+
+def coupled_spectrum(qnm, exciton, wavelengths):
+    """
+    Plasmon-driven extinction, shape (sizes, wavelengths), normalized so that
+    the uncoupled LSP peaks at 1.
+    """
+    f_p, f_n, g = _couplings(qnm, exciton)
+    f = 1 / np.asarray(wavelengths, dtype=float)[None, :]
+    self_energy = np.sum(g[:, :, None]**2 / (f_n[None, :, None] - f[:, None, :]), axis=1)
+    chi = 1 / (f_p[:, None] - f - self_energy)
+    return -f_p.imag[:, None] * chi.imag
+
+
+def spot_check(unit_cell, size_nm, exciton, qnm=None, polarization='x', **kwargs):
+    """
+    Model vs FDTD (Harminv of the coated cell made with `exciton`) UP/LP
+    energies at one size: returns ((E_UP, E_LP) model, (E_UP, E_LP) FDTD) in eV.
+    """
+    if qnm is None:
+        qnm = lsp_qnms(unit_cell, [size_nm], polarization, **kwargs)
+    E_ex = 1.23984 * exciton.E_susceptibilities[0].frequency
+    model = 1.23984 * qnm_coupled_modes(qnm, exciton)[0][0].real
+    modes = extract_modes(with_exciton(unit_cell, exciton), size_nm, True, polarization, **kwargs)
+    fdtd = [strongest(modes, E_min=E_ex), strongest(modes, E_max=E_ex)]
+    fdtd = tuple(np.nan if i is None else 1.23984 * modes['freq'][i] for i in fdtd)
+    return (model[-1], model[0]), fdtd
+
+
+if __name__ == "__main__":
+    from unit_cells import disk_unit_cell, diameters_nm
+    from unit_cells import tdbc_medium as TDBC
+
+    qnm = lsp_qnms(disk_unit_cell, diameters_nm)
+    wavelengths = np.linspace(0.4, 0.8, 401)
+    for f_TDBC in (0.15, 0.45):
+        t0 = time.time()
+        values, _ = qnm_coupled_modes(qnm, TDBC(f_TDBC))
+        coupled_spectrum(qnm, TDBC(f_TDBC), wavelengths)
+        print(f"f_TDBC = {f_TDBC}: {len(diameters_nm)} diameters in {(time.time() - t0) * 1000:.1f} ms, "
+              f"min splitting {1.23984 * np.min(values[:, -1].real - values[:, 0].real):.2f} eV")
+
+    i = len(diameters_nm) // 2
+    for f_TDBC in (0.15, 0.45):
+        model, fdtd = spot_check(disk_unit_cell, diameters_nm[i], TDBC(f_TDBC),
+                                 {k: v[i:i + 1] for k, v in qnm.items()})
+        print(f"D = {diameters_nm[i]} nm, f_TDBC = {f_TDBC}: UP {model[0]:.3f} vs {fdtd[0]:.3f} eV, "
+              f"LP {model[1]:.3f} vs {fdtd[1]:.3f} eV (model vs FDTD)")
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Rigorous coupled-wave analysis of the periodic disk and rod arrays
+==================================================================
+
+The fig3 disk and fig4 ellipsoid arrays are thin, laterally periodic
+structures on a flat glass/ITO(/TDBC) stack. Expanding the fields of each
+z-slice in (2M+1)(2N+1) plane-wave orders turns Maxwell's equations into a
+matrix eigenproblem per slice; slices are joined with scattering matrices
+(Rumpf's formulation, PIER B 35, 241 (2011)) and every array carries a
+leading wavelength axis, so a whole spectrum is solved in one batch.
+
+Geometry comes straight from the Meep geometry lists the scripts build:
+laterally infinite blocks become homogeneous layers (solved analytically),
+cylinders and boxes are single slices, and ellipsoids are approximated by
+a staircase of `n_stair` slices. Each slice is rasterized on the unit cell
+(later objects win, as in Meep), and its permittivity Fourier matrix is
+assembled per wavelength from one convolution matrix per medium, with the
+media evaluated from their Meep susceptibilities (transfer_matrix.py).
+
+Light is incident from the medium at the source plane (glass) and T is the
+zeroth- plus higher-order power transmitted into the top medium, so
+
+    T_norm = transmission(cell, geometry) / transmission(cell, geometry_ref)
+
+matches the FDTD normalization. The glass/air interface inside the PML of
+the FDTD cell is not modelled; it enters both runs alike.
+
+Laurent's rule converges slowly for metal particles: raise `orders` until
+the spectra stop moving. `python rcwa.py` writes T(λ) maps for the fig3
+diameters and fig4 lengths to rcwa_maps.npz; `python rcwa.py --validate`
+compares a few of them with Meep runs of the same unit cells (through the
+result cache, so runs already done by the scripts are reused).
+
+Author: ReproAgent
+"""
+
+import argparse
+import time
+
+import meep as mp
+import numpy as np
+
+from transfer_matrix import medium_epsilon
+from unit_cells import diameters_nm, disk_unit_cell, dpml, grid_length, inside, lengths_nm, rod_unit_cell, sz
+
+orders = (5, 5)      # plane-wave orders kept along x and y: (2M+1)(2N+1) in total
+raster = 256         # real-space samples per period for the Fourier coefficients
+n_stair = 8          # slices per ellipsoid
+chunk = 16           # wavelengths solved per batch (bounds memory)
+
+
+# -- slicing the geometry ------------------------------------------------------
+
+def _z_extent(obj):
+    if isinstance(obj, mp.Block):   # includes mp.Ellipsoid
+        half = obj.size.z / 2
+    elif isinstance(obj, mp.Cylinder):
+        half = obj.height / 2
+    elif isinstance(obj, mp.Sphere):
+        half = obj.radius
+    else:
+        raise ValueError(f"unsupported object {type(obj).__name__}")
+    return obj.center.z - half, obj.center.z + half
+
+
+def slice_geometry(cell_size, geometry, z_start, default_material=mp.Medium()):
+    """
+    Split everything above z_start into z-slices.
+
+    Returns (incident medium, [(thickness, media, masks)], top medium), where
+    each slice lists its distinct media and their boolean rasters on the
+    unit cell; homogeneous slices have a single medium and mask None.
+    """
+    edges = set()
+    for obj in geometry:
+        z0, z1 = _z_extent(obj)
+        steps = n_stair if isinstance(obj, (mp.Ellipsoid, mp.Sphere)) else 1
+        edges.update(np.linspace(z0, z1, steps + 1))
+    edges = sorted(z for z in edges if z > z_start and abs(z) < cell_size.z / 2)
+
+    xs = (np.arange(raster) + 0.5) / raster * cell_size.x - cell_size.x / 2
+    ys = (np.arange(raster) + 0.5) / raster * cell_size.y - cell_size.y / 2
+    x, y = np.meshgrid(xs, ys, indexing='ij')
+
+    def cross_section(z):
+        index = np.full(x.shape, -1)
+        for i, obj in enumerate(geometry):
+            index[inside(obj, x, y, z)] = i
+        media = []
+        masks = []
+        for i in np.unique(index):
+            medium = geometry[i].material if i >= 0 else default_material
+            mask = index == i
+            for k, m in enumerate(media):
+                if m is medium:
+                    masks[k] |= mask
+                    break
+            else:
+                media.append(medium)
+                masks.append(mask)
+        return media, masks
+
+    incident = cross_section(z_start)[0]
+    top = cross_section(edges[-1] + 1e-9)[0] if edges else incident
+    if len(incident) != 1 or len(top) != 1:
+        raise ValueError("incident and top regions must be homogeneous")
+
+    slices = []
+    for z0, z1 in zip([z_start] + edges[:-1], edges):
+        media, masks = cross_section((z0 + z1) / 2)
+        if len(media) == 1:
+            masks = [None]
+        if slices and len(slices[-1][1]) == len(media) and all(
+                a is b for a, b in zip(slices[-1][1], media)) and all(
+                (m0 is None and m1 is None) or (m0 is not None and m1 is not None and np.array_equal(m0, m1))
+                for m0, m1 in zip(slices[-1][2], masks)):
+            slices[-1] = (slices[-1][0] + z1 - z0, media, masks)
+        else:
+            slices.append((z1 - z0, media, masks))
+    # the part of the incident medium below the first interface is not a layer
+    if slices and len(slices[0][1]) == 1 and slices[0][1][0] is incident[0]:
+        slices = slices[1:]
+    return incident[0], slices, top[0]
+
+
+# -- Fourier space -----------------------------------------------------------
+
+def _harmonics():
+    M, N = orders
+    m, n = np.meshgrid(np.arange(-M, M + 1), np.arange(-N, N + 1), indexing='ij')
+    return m.ravel(), n.ravel()
+
+
+def _convolution_matrix(mask):
+    """(P, P) Toeplitz matrix of the Fourier coefficients of a raster."""
+    m, n = _harmonics()
+    coeff = np.fft.fft2(mask.astype(float)) / mask.size
+    # samples sit at pixel centres, half a pixel off the cell corner
+    k = np.fft.fftfreq(raster, 1 / raster)
+    shift = np.exp(-1j * np.pi * k * (1 / raster - 1))
+    coeff = coeff * shift[:, None] * shift[None, :]
+    return coeff[(m[:, None] - m[None, :]) % raster, (n[:, None] - n[None, :]) % raster]
+
+
+def _epsilon(medium, wl):
+    """Permittivity in the e^{+j omega t} convention of the formulation (loss: Im < 0)."""
+    return np.conj(medium_epsilon(medium, 1 / wl))
+
+
+def _star(SA, SB):
+    """Redheffer star product of batched scattering matrices (S11, S12, S21, S22)."""
+    A11, A12, A21, A22 = SA
+    B11, B12, B21, B22 = SB
+    I = np.eye(A11.shape[-1])
+    D = A12 @ np.linalg.inv(I - B11 @ A22)
+    F = B21 @ np.linalg.inv(I - A22 @ B11)
+    return (A11 + D @ B11 @ A21, D @ B12, F @ A21, B22 + F @ A22 @ B12)
+
+
+def _block(a, b, c, d):
+    return np.concatenate([np.concatenate([a, b], -1), np.concatenate([c, d], -1)], -2)
+
+
+def _diag(v):
+    return v[..., :, None] * np.eye(v.shape[-1])
+
+
+def _homogeneous_modes(eps, Kx, Ky):
+    """Eigen-modes (W = I, LAM, V) of a uniform medium, batched over wavelength."""
+    Kz = np.sqrt(eps[:, None] - Kx**2 - Ky**2)
+    Kz = np.where(Kz.imag > 0, -Kz, Kz)   # outgoing or decaying, whatever the sign of zero
+    Q = _block(_diag(Kx * Ky), _diag(eps[:, None] - Kx**2),
+               _diag(Ky**2 - eps[:, None]), _diag(-Ky * Kx))
+    LAM = np.concatenate([1j * Kz, 1j * Kz], -1)
+    return LAM, Q / LAM[:, None, :], Kz
+
+
+def _layer_smatrix(W, LAM, V, V0, k0L):
+    """Symmetric S-matrix of a layer referenced to the vacuum gap (W0 = I)."""
+    Winv = np.linalg.inv(W) if W is not None else None
+    Vinv = np.linalg.inv(V)
+    WW0 = Winv if W is not None else np.eye(V.shape[-1])
+    A = WW0 + Vinv @ V0
+    B = WW0 - Vinv @ V0
+    X = _diag(np.exp(-LAM * k0L[:, None]))
+    Ainv = np.linalg.inv(A)
+    XBA = X @ B @ Ainv
+    lhs = np.linalg.inv(A - XBA @ X @ B)
+    S11 = lhs @ (XBA @ X @ A - B)
+    S12 = lhs @ X @ (A - B @ Ainv @ B)
+    return (S11, S12, S12, S11)
+
+
+def _transmission_batch(cell_size, incident, slices, top, wavelengths, polarization, convs):
+    wl = np.asarray(wavelengths, dtype=float)
+    m, n = _harmonics()
+    P = len(m)
+    Kx = m[None, :] * wl[:, None] / cell_size.x
+    Ky = n[None, :] * wl[:, None] / cell_size.y
+    k0 = 2 * np.pi / wl
+    I2 = np.eye(2 * P)
+
+    # vacuum gap medium
+    LAM0, V0, _ = _homogeneous_modes(np.ones(len(wl), dtype=complex), Kx, Ky)
+
+    # incident (reflection) region
+    eps_ref = _epsilon(incident, wl)
+    LAMr, Vr, Kz_ref = _homogeneous_modes(eps_ref, Kx, Ky)
+    V0inv = np.linalg.inv(V0)
+    A = I2 + V0inv @ Vr
+    B = I2 - V0inv @ Vr
+    Ainv = np.linalg.inv(A)
+    S = (-Ainv @ B, 2 * Ainv, 0.5 * (A - B @ Ainv @ B), B @ Ainv)
+
+    for (thickness, media, masks), conv in zip(slices, convs):
+        eps = [_epsilon(medium, wl) for medium in media]
+        k0L = k0 * thickness
+        if masks[0] is None:
+            LAM, V, _ = _homogeneous_modes(eps[0], Kx, Ky)
+            S = _star(S, _layer_smatrix(None, LAM, V, V0, k0L))
+            continue
+        E = sum(e[:, None, None] * c for e, c in zip(eps, conv))
+        Einv = np.linalg.inv(E)
+        KX, KY = _diag(Kx), _diag(Ky)
+        I = np.eye(P)
+        Pm = _block(KX @ Einv @ KY, I - KX @ Einv @ KX, KY @ Einv @ KY - I, -KY @ Einv @ KX)
+        Qm = _block(KX @ KY, E - KX @ KX, KY @ KY - E, -KY @ KX)
+        lam2, W = np.linalg.eig(Pm @ Qm)
+        LAM = np.sqrt(lam2)
+        V = Qm @ W / LAM[:, None, :]
+        S = _star(S, _layer_smatrix(W, LAM, V, V0, k0L))
+
+    # transmission region
+    eps_trn = _epsilon(top, wl)
+    LAMt, Vt, Kz_trn = _homogeneous_modes(eps_trn, Kx, Ky)
+    A = I2 + V0inv @ Vt
+    B = I2 - V0inv @ Vt
+    Ainv = np.linalg.inv(A)
+    S = _star(S, (B @ Ainv, 0.5 * (A - B @ Ainv @ B), 2 * Ainv, -Ainv @ B))
+
+    # zeroth-order plane wave polarized along x or y
+    e_src = np.zeros(2 * P, dtype=complex)
+    zero = np.flatnonzero((m == 0) & (n == 0))[0]
+    e_src[zero if polarization == 'x' else P + zero] = 1
+    t = S[2] @ e_src
+    tx, ty = t[:, :P], t[:, P:]
+    tz = -(Kx * tx + Ky * ty) / Kz_trn
+    power = np.abs(tx)**2 + np.abs(ty)**2 + np.abs(tz)**2
+    kz_inc = np.real(np.sqrt(eps_ref))
+    return np.sum(np.real(Kz_trn) * power, axis=-1) / kz_inc
+
+
+def transmission(cell_size, geometry, z_source, wavelengths, polarization='x'):
+    """
+    Power transmission T(λ) of the periodic cell for a normally incident
+    plane wave from the medium at z_source, wavelengths in µm.
+    """
+    incident, slices, top = slice_geometry(cell_size, geometry, z_source)
+    convs = [None if masks[0] is None else [_convolution_matrix(mask) for mask in masks]
+             for _, _, masks in slices]
+    wl = np.asarray(wavelengths, dtype=float)
+    return np.concatenate([
+        _transmission_batch(cell_size, incident, slices, top, wl[i:i + chunk], polarization, convs)
+        for i in range(0, len(wl), chunk)])
+
+
+def transmission_map(unit_cell, sizes_nm, wavelengths, with_tdbc=False, polarization='x'):
+    """Normalized T(λ) for each size, as an array (len(sizes_nm), len(wavelengths))."""
+    rows = []
+    for size in sizes_nm:
+        cell_size, z_source, _, geometry_ref, geometry = unit_cell(size, with_tdbc)
+        T = transmission(cell_size, geometry, z_source, wavelengths, polarization)
+        T_ref = transmission(cell_size, geometry_ref, z_source, wavelengths, polarization)
+        rows.append(T / T_ref)
+    return np.array(rows)
+
+
+# -- cross-validation against Meep ---------------------------------------------
+
+def meep_transmission(unit_cell, size_nm, with_tdbc=False, polarization='x',
+                      resolution=60, wl_min=0.4, wl_max=0.8, nfreq=150, flux_tol=1e-3):
+    """
+    Normalized FDTD transmission of the same unit cell, run the way
+    fig3cd_exact.py runs it (grid-snapped cell, result cache, flat-stack
+    reference), so runs already stored by the scripts are reused.
+    """
+    from checkpoint import RunCheckpoint
+    from convergence import FluxConvergence
+    from reference_flux import reference_flux
+    from result_cache import simulation_key, cached_run
+
+    cell_size, z_source, z_trans, geometry_ref, geometry = unit_cell(size_nm, with_tdbc)
+    sx, sy = grid_length(cell_size.x, resolution), grid_length(cell_size.y, resolution)
+    cell_size = mp.Vector3(sx, sy, sz)
+    fcen = (1/wl_max + 1/wl_min) / 2
+    df = 1/wl_min - 1/wl_max
+    component = {'x': mp.Ex, 'y': mp.Ey}[polarization]
+
+    pml_layers = [mp.PML(thickness=dpml, direction=mp.Z)]
+    sources = [mp.Source(
+        src=mp.GaussianSource(fcen, fwidth=df),
+        component=component,
+        center=mp.Vector3(0, 0, z_source),
+        size=mp.Vector3(sx, sy, 0)
+    )]
+    freqs, flux_ref = reference_flux(geometry_ref, sx, sy, z_source, z_trans, sz, dpml,
+                                     resolution, fcen, df, nfreq, flux_tol)
+    flux_region = mp.FluxRegion(center=mp.Vector3(0, 0, z_trans), size=mp.Vector3(sx, sy, 0))
+
+    def run_full():
+        checkpoint = RunCheckpoint(key)
+        sim = mp.Simulation(
+            cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
+            sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0),
+            chunk_layout=checkpoint.chunk_layout
+        )
+        trans = sim.add_flux(fcen, df, nfreq, flux_region)
+        checkpoint.start(sim, [trans])
+        stop = FluxConvergence([trans], sim, wl_min, wl_max, flux_tol,
+                               decay=(component, mp.Vector3(0, 0, z_trans), 50, 1e-3))
+        sim.run(checkpoint, until_after_sources=stop)
+        stop.report()
+        checkpoint.clear()
+        return {'flux': np.array(mp.get_fluxes(trans))}
+
+    key = simulation_key(cell_size, resolution, geometry, sources, [(fcen, df, nfreq, flux_region)],
+                         boundary_layers=pml_layers, flux_tol=flux_tol)
+    flux = cached_run(key, run_full)['flux']
+    return 1 / freqs, np.where(flux_ref > 0, flux / flux_ref, 1)
+
+
+def validate(cases):
+    """Print RCWA against FDTD for (label, unit_cell, size_nm, with_tdbc, polarization) cases."""
+    for label, unit_cell, size, with_tdbc, pol in cases:
+        wl, T_fdtd = meep_transmission(unit_cell, size, with_tdbc, pol)
+        t0 = time.time()
+        T_rcwa = transmission_map(unit_cell, [size], wl, with_tdbc, pol)[0]
+        band = (wl >= 0.4) & (wl <= 0.8)
+        print(f"{label}: RCWA {time.time() - t0:.1f}s, "
+              f"max |ΔT| {np.max(np.abs(T_rcwa - T_fdtd)[band]):.3f}, "
+              f"dip {wl[band][np.argmin(T_rcwa[band])]*1000:.0f} nm (RCWA) vs "
+              f"{wl[band][np.argmin(T_fdtd[band])]*1000:.0f} nm (FDTD)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RCWA transmission maps of the disk and rod arrays")
+    parser.add_argument('--validate', action='store_true', help="compare with Meep for a few unit cells")
+    args = parser.parse_args()
+
+    if args.validate:
+        validate([
+            ("disk D=140 bare", disk_unit_cell, 140, False, 'x'),
+            ("disk D=140 coated", disk_unit_cell, 140, True, 'x'),
+            ("rod L=120 coated, x", rod_unit_cell, 120, True, 'x'),
+            ("rod L=120 coated, y", rod_unit_cell, 120, True, 'y'),
+        ])
+    else:
+        wavelengths = np.linspace(0.4, 0.8, 150)
+        maps = {}
+        t0 = time.time()
+        for name, unit_cell, sizes, with_tdbc, pol in [
+                ('disk_bare', disk_unit_cell, diameters_nm, False, 'x'),
+                ('disk_coated', disk_unit_cell, diameters_nm, True, 'x'),
+                ('rod_bare_x', rod_unit_cell, lengths_nm, False, 'x'),
+                ('rod_coated_x', rod_unit_cell, lengths_nm, True, 'x'),
+                ('rod_coated_y', rod_unit_cell, lengths_nm, True, 'y')]:
+            maps[name] = transmission_map(unit_cell, sizes, wavelengths, with_tdbc, pol)
+            print(f"{name}: {time.time() - t0:.1f}s")
+        np.savez('rcwa_maps.npz', wavelengths_nm=wavelengths * 1000, diameters_nm=diameters_nm,
+                 lengths_nm=lengths_nm, **maps)
+        print("Saved: rcwa_maps.npz")
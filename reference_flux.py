@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Reference flux for the flat glass/ITO(/TDBC) stacks
+===================================================
+
+Every transmission script normalises by the flux through the bare layer
+stack. At normal incidence that stack is laterally uniform, so its
+transmitted flux per unit area does not depend on the array period.
+
+Each distinct stack is therefore simulated once per resolution and
+frequency grid, in a 1D cell along z (the 3D run reduces to exactly the
+same Yee updates), and stored as flux per unit area. `reference_flux`
+rescales it to the area of whatever unit cell is being normalised.
+
+The stack can also be solved in closed form by transfer matrices
+(method='tmm'); `reference_deviation` compares the two.
+
+Unit cells should be snapped to the grid with `unit_cells.grid_length`, so that the
+area of the flux plane is exactly the area Meep integrates over.
+
+Author: ReproAgent
+"""
+
+import meep as mp
+import numpy as np
+
+from convergence import FluxConvergence
+from result_cache import simulation_key, cached_run
+from transfer_matrix import stack_segments, sheet_source_flux
+
+# (stack, grid) key -> (freqs, flux per unit area)
+_flux_per_area = {}
+
+
+def _vector_key(v):
+    return (round(v.x, 12), round(v.y, 12), round(v.z, 12))
+
+
+def medium_key(medium):
+    """Hashable description of a Meep medium and its susceptibilities."""
+    susceptibilities = tuple(
+        (type(s).__name__, round(s.frequency, 12), round(s.gamma, 12),
+         _vector_key(s.sigma_diag), _vector_key(s.sigma_offdiag))
+        for s in medium.E_susceptibilities
+    )
+    return (_vector_key(medium.epsilon_diag), _vector_key(medium.epsilon_offdiag),
+            _vector_key(medium.D_conductivity_diag), susceptibilities)
+
+
+def layer_stack_key(geometry):
+    """Hashable description of a flat stack of laterally infinite blocks."""
+    layers = []
+    for obj in geometry:
+        if not isinstance(obj, mp.Block) or obj.size.x < mp.inf or obj.size.y < mp.inf:
+            raise ValueError("reference stack must contain only laterally infinite mp.Block layers")
+        layers.append((round(obj.center.z, 12), round(obj.size.z, 12), medium_key(obj.material)))
+    return tuple(layers)
+
+
+def _simulate_flux_per_area(geometry, z_source, z_trans, sz, dpml, resolution, fcen, df, nfreq, tol):
+    """Run the flat stack in a 1D cell; the flux through a point is per unit area."""
+    sources = [mp.Source(
+        src=mp.GaussianSource(fcen, fwidth=df),
+        component=mp.Ex,
+        center=mp.Vector3(0, 0, z_source)
+    )]
+
+    sim = mp.Simulation(
+        cell_size=mp.Vector3(0, 0, sz), geometry=geometry,
+        boundary_layers=[mp.PML(thickness=dpml)],
+        sources=sources, resolution=resolution, dimensions=1
+    )
+    trans = sim.add_flux(fcen, df, nfreq, mp.FluxRegion(center=mp.Vector3(0, 0, z_trans)))
+    stop = FluxConvergence([trans], sim, 1 / (fcen + df/2), 1 / (fcen - df/2), tol,
+                           decay=(mp.Ex, mp.Vector3(0, 0, z_trans), 50, 1e-3))
+    sim.run(until_after_sources=stop)
+    stop.report("reference: ")
+
+    return np.array(mp.get_flux_freqs(trans)), np.array(mp.get_fluxes(trans))
+
+
+def _fdtd_flux_per_area(geometry, z_source, z_trans, sz, dpml, resolution, fcen, df, nfreq, tol):
+    """1D FDTD flux per unit area, kept in memory and in the on-disk cache."""
+    key = (layer_stack_key(geometry), round(z_source, 12), round(z_trans, 12),
+           round(sz, 12), round(dpml, 12), resolution,
+           round(fcen, 12), round(df, 12), nfreq, tol)
+
+    if key not in _flux_per_area:
+        disk_key = simulation_key(mp.Vector3(0, 0, sz), resolution, geometry, [], [(fcen, df, nfreq, z_trans)],
+                                  kind='1d flux per area', z_source=z_source, dpml=dpml, flux_tol=tol)
+        result = cached_run(disk_key, lambda: dict(zip(('freqs', 'flux'), _simulate_flux_per_area(
+            geometry, z_source, z_trans, sz, dpml, resolution, fcen, df, nfreq, tol))))
+        _flux_per_area[key] = result['freqs'], result['flux']
+
+    return _flux_per_area[key]
+
+
+def _tmm_flux_per_area(geometry, z_source, z_trans, sz, dpml, resolution, fcen, df, nfreq, tol):
+    """
+    Transfer-matrix flux per unit area. The source spectrum is taken from a
+    1D run in the homogeneous source medium (one per medium and grid, shared
+    by every stack); the stack response comes from transfer_matrix.py.
+    """
+    segments = stack_segments(geometry, sz)
+    source_medium = next(m for z0, z1, m in segments if z0 <= z_source < z1)
+    incident_geometry = [mp.Block(size=mp.Vector3(mp.inf, mp.inf, mp.inf), material=source_medium)]
+    freqs, incident = _fdtd_flux_per_area(incident_geometry, z_source, z_trans, sz, dpml,
+                                          resolution, fcen, df, nfreq, tol)
+    homogeneous = sheet_source_flux([(-sz/2, sz/2, source_medium)], z_source, z_trans, freqs)
+    return freqs, incident * sheet_source_flux(segments, z_source, z_trans, freqs) / homogeneous
+
+
+def reference_flux(geometry, sx, sy, z_source, z_trans, sz, dpml, resolution, fcen, df, nfreq,
+                   tol=1e-3, method='fdtd'):
+    """
+    Flux of a normally incident plane wave through the flat stack `geometry`,
+    for an sx × sy unit cell.
+
+    With method='fdtd' the stack is simulated only the first time a given
+    (stack, source/monitor position, resolution, frequency grid) combination
+    is requested, and the result is kept in the on-disk cache for later
+    scripts (result_cache.py). The polarization does not enter: the stack
+    media are isotropic. The run stops once the flux spectrum has converged
+    to `tol` (see convergence.py). With method='tmm' the stack is solved by
+    transfer matrices instead (see transfer_matrix.py and reference_deviation).
+
+    Returns (freqs, flux) in the same form as mp.get_flux_freqs/get_fluxes
+    on a full-cell flux plane.
+    """
+    solvers = {'fdtd': _fdtd_flux_per_area, 'tmm': _tmm_flux_per_area}
+    if method not in solvers:
+        raise ValueError(f"unknown reference method {method!r}")
+    freqs, flux = solvers[method](geometry, z_source, z_trans, sz, dpml, resolution, fcen, df, nfreq, tol)
+    return freqs.copy(), flux * sx * sy
+
+
+def reference_deviation(geometry, z_source, z_trans, sz, dpml, resolution, fcen, df, nfreq, tol=1e-3):
+    """
+    Transfer-matrix against FDTD reference flux for one stack.
+
+    Returns (freqs, flux_fdtd, flux_tmm, max relative deviation), fluxes per
+    unit area.
+    """
+    args = (geometry, 1, 1, z_source, z_trans, sz, dpml, resolution, fcen, df, nfreq, tol)
+    freqs, flux_fdtd = reference_flux(*args, method='fdtd')
+    _, flux_tmm = reference_flux(*args, method='tmm')
+    deviation = np.max(np.abs(flux_tmm - flux_fdtd) / np.abs(flux_fdtd))
+    return freqs, flux_fdtd, flux_tmm, deviation
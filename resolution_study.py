@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Resolution convergence and Richardson extrapolation
+===================================================
+
+The sweeps run at 60 pts/µm ("was 80"), fig2bc at 100, and the LSP redshift
+in REPRODUCTION_REPORT.md is partly put down to "finite grid resolution"
+without a number attached. `convergence_study` runs one configuration at a
+ladder of resolutions on one sweep pool (cached runs such as simulate_disk
+keep every rung, so extending the ladder only runs the new ones) and
+fits every tracked observable (resonance wavelengths, peak |E/E0|, ...) as
+
+    Q(h) = Q_0 + C h^p,    h = 1 / resolution,
+
+with the order p scanned over `orders` and Q_0, C solved by least squares
+for each p. The continuum estimate Q_0 gets Roache's grid convergence index
+as error bar, 1.25 |Q_finest - Q_0| (3 |...| with only two rungs, where p
+is fixed to 2 -- the Yee scheme's nominal order), widened by the shift of
+Q_0 when the coarsest rung is dropped if there are four or more.
+Non-monotone ladders are reported as such, with the spread of the values
+as error.
+
+From the fit it recommends, for a target accuracy per observable,
+
+- the resolution at which the raw value is within the target,
+  (|C| / target)^(1/p), and
+- the cheapest prefix of the ladder whose extrapolated value already has
+  an error bar within the target,
+
+with run costs scaling as resolution^4 (cells^3 x timesteps).
+
+    study = convergence_study(simulate_disk, (140, True), (30, 40, 60, 80),
+                              observe=lambda v: dip_wavelengths(*v, n=2), target=2)
+
+fig3_fast.py and fig2bc_corrected.py run it through their
+`convergence_ladder` option.
+
+Author: ReproAgent
+"""
+
+import numpy as np
+
+from polariton_fit import dips
+from sweep import run_sweep
+
+orders = np.linspace(0.5, 4, 36)
+safety = 1.25          # GCI safety factor with an observed order
+safety_assumed = 3.0   # ... and with the order assumed
+
+
+def dip_wavelengths(wavelengths_nm, T, n=1):
+    """The n deepest dips of a transmission spectrum, nm in ascending order (NaN if fewer)."""
+    T = np.atleast_2d(np.asarray(T, dtype=float))
+    mask, E = dips(wavelengths_nm, T)
+    deepest = np.argsort(np.where(mask[0], T[0], np.inf))[:n]
+    wl = np.sort(np.where(mask[0, deepest], 1239.84 / E[0, deepest], np.nan))
+    return {f"dip {i + 1} (nm)": w for i, w in enumerate(wl)}
+
+
+def peak(wavelengths_nm, S, name='peak'):
+    """Wavelength (parabola-refined) and value of the maximum of a spectrum."""
+    S = np.asarray(S, dtype=float)
+    i = int(np.clip(np.argmax(S), 1, len(S) - 2))
+    denom = S[i - 1] - 2 * S[i] + S[i + 1]
+    shift = np.clip(0.5 * (S[i - 1] - S[i + 1]) / denom, -0.5, 0.5) if denom < 0 else 0
+    wl = np.interp(i + shift, np.arange(len(S)), wavelengths_nm)
+    return {f"{name} wavelength (nm)": wl, name: S.max()}
+
+
+def richardson(resolutions, values):
+    """
+    Continuum estimate of values(resolutions). Returns a dict with Q0, error,
+    order p, coefficient C (Q - Q0 = C h^p) and 'monotone'.
+    """
+    r = np.asarray(resolutions, dtype=float)
+    order = np.argsort(r)
+    r, Q = r[order], np.asarray(values, dtype=float)[order]
+    h = 1 / r
+    diffs = np.diff(Q)
+    monotone = bool(np.all(diffs > 0) or np.all(diffs < 0)) if len(Q) > 2 else True
+    if len(Q) < 2 or not np.all(np.isfinite(Q)):
+        return {'Q0': np.nan, 'error': np.nan, 'order': np.nan, 'C': np.nan, 'monotone': False}
+    if not monotone:
+        return {'Q0': Q[-1], 'error': np.ptp(Q[1:]), 'order': np.nan, 'C': np.nan, 'monotone': False}
+
+    def fit(h, Q, candidates):
+        best = None
+        for p in candidates:
+            A = np.stack([np.ones_like(h), h**p], -1)
+            coeffs, *_ = np.linalg.lstsq(A, Q, rcond=None)
+            residual = np.sum((A @ coeffs - Q)**2)
+            if best is None or residual < best[0]:
+                best = (residual, p, *coeffs)
+        return best[1:]
+
+    candidates = orders if len(Q) > 2 else [2.0]
+    p, Q0, C = fit(h, Q, candidates)
+    error = (safety if len(Q) > 2 else safety_assumed) * abs(Q[-1] - Q0)
+    if len(Q) > 3:
+        error = max(error, abs(Q0 - fit(h[1:], Q[1:], candidates)[1]))
+    return {'Q0': Q0, 'error': error, 'order': p, 'C': C, 'monotone': True}
+
+
+def recommend(resolutions, values, target):
+    """(resolution for the raw value within target, cheapest ladder rung to extrapolate from)."""
+    r = np.sort(np.asarray(resolutions, dtype=float))
+    Q = np.asarray(values, dtype=float)[np.argsort(resolutions)]
+    result = richardson(r, Q)
+    raw = (abs(result['C']) / target)**(1 / result['order']) if np.isfinite(result['C']) else np.nan
+    rung = np.nan
+    for k in range(2, len(r) + 1):
+        if richardson(r[:k], Q[:k])['error'] <= target:
+            rung = r[k - 1]
+            break
+    return raw, rung
+
+
+def convergence_study(simulate, args, resolutions, observe, target=None, processes=None):
+    """
+    Run simulate(*args, resolution) for every resolution and extrapolate
+    each observable of observe(value) -> {name: scalar}. target is an
+    accuracy per observable (scalar, or dict by name) for the
+    recommendation. Returns {name: richardson(...) plus 'values' and, with
+    a target, 'raw_resolution' and 'extrapolate_from'}.
+    """
+    resolutions = sorted(resolutions)
+    runs = run_sweep(simulate, [tuple(args) + (r,) for r in resolutions], processes)
+    failed = [run for run in runs if run.error is not None]
+    if failed:
+        raise RuntimeError(f"{len(failed)} rung(s) failed, first:\n{failed[0].error}")
+    observed = [observe(run.value) for run in runs]
+    cost = [run.elapsed for run in runs]
+
+    study = {}
+    print(f"\n  Resolution convergence of {simulate.__name__}{tuple(args)}:")
+    print("  " + " " * 24 + "".join(f"{r:>10}" for r in resolutions) + "   continuum        p")
+    for name in observed[0]:
+        values = np.array([o[name] for o in observed], dtype=float)
+        result = dict(richardson(resolutions, values), values=values)
+        order = f"{result['order']:.1f}" if result['monotone'] else "non-monotone"
+        print(f"  {name:24s}" + "".join(f"{v:10.3f}" for v in values)
+              + f"   {result['Q0']:.3f} ± {result['error']:.3f}   {order}")
+        if target is not None:
+            tol = target[name] if isinstance(target, dict) else target
+            result['raw_resolution'], result['extrapolate_from'] = recommend(resolutions, values, tol)
+        study[name] = result
+    print("  run time (s)            " + "".join(f"{t:10.1f}" for t in cost))
+
+    if target is not None:
+        raw = np.array([s['raw_resolution'] for s in study.values()])
+        rung = np.array([s['extrapolate_from'] for s in study.values()])
+        if not np.all(np.isfinite(raw)):
+            print("  No recommendation: not every observable converges monotonically on this ladder")
+            return study
+        raw = np.ceil(raw.max())
+        print(f"  Target accuracy: raw values need resolution >= {raw:.0f} "
+              f"(~{(raw / resolutions[-1])**4:.1f}x the cost of {resolutions[-1]})")
+        if np.all(np.isfinite(rung)):
+            ladder = [r for r in resolutions if r <= rung.max()]
+            print(f"  or extrapolate from {ladder} "
+                  f"(~{sum((r / raw)**4 for r in ladder):.2f}x the cost of one run at {raw:.0f})")
+        else:
+            print("  The ladder does not reach the target even with extrapolation")
+    return study
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Harminv extraction of the plasmon and polariton resonances
+==========================================================
+
+The LSP and polariton positions in the summaries come from 150-point flux
+spectra, smoothed with gaussian_filter1d and searched with find_peaks. The
+flux spectrum has to converge (the whole ring-down has to be recorded) and
+the smoothing hides ringing. Here the same unit cells are excited by the
+broadband plane wave and the field is recorded just outside the particle
+edge, where the dipolar mode is strongest: the in-plane component at the
+edge along the polarization and Ez above the edge. Harminv fits the
+ring-down after the source to a sum of damped exponentials and returns
+complex frequencies f - i decay, Q = f / (2 decay) and complex amplitudes.
+The fit needs only a short window (`ringdown`) after the source, a
+fraction of the flux-converged run for these Q ~ 5-20 modes.
+
+The bare particle's LSP is its strongest mode in the band; for the coated
+particle the strongest modes above and below the exciton are the upper and
+lower polariton. `polariton_energies` returns those as arrays over sizes,
+ready for fig3ef_exact.py and fig4_nanorods.py panel (f)
+(lsp_source = 'harminv'). Results go through the result cache.
+
+Author: ReproAgent
+"""
+
+import time
+
+import meep as mp
+import numpy as np
+
+from result_cache import simulation_key, cached_run
+from unit_cells import grid_length
+
+omega_X = 3.22e15 / (2 * np.pi * 3e14)
+E_X = 1.23984 * omega_X   # eV
+
+dpml = 0.4
+ringdown = 50       # time after the source over which the fields are fitted
+min_Q = 1.0         # below this a Harminv mode is treated as noise
+max_error = 0.1     # largest accepted relative Harminv error
+
+
+def edge_probes(geometry, polarization):
+    """(component, point) pairs just outside the particle (last object) edge."""
+    particle = geometry[-1]
+    if isinstance(particle, mp.Cylinder):
+        half, height = particle.radius, particle.height
+    else:
+        half = (particle.size.x if polarization == 'x' else particle.size.y) / 2
+        height = particle.size.z
+    c = particle.center
+    along = mp.Vector3(1, 0, 0) if polarization == 'x' else mp.Vector3(0, 1, 0)
+    component = {'x': mp.Ex, 'y': mp.Ey}[polarization]
+    return [(component, c + along * (half + 0.005)),
+            (mp.Ez, c + along * (half - 0.005) + mp.Vector3(0, 0, height / 2 + 0.005))]
+
+
+def extract_modes(unit_cell, size_nm, with_tdbc=False, polarization='x',
+                  resolution=60, wl_min=0.4, wl_max=0.8):
+    """
+    Resonances of one periodic cell (unit_cell as in unit_cells.py).
+
+    Returns a dict of arrays sorted by frequency: freq (1/µm), decay, Q,
+    amp (complex) and err, merged over the probes (select_modes).
+    """
+    cell_size, z_source, _, _, geometry = unit_cell(size_nm, with_tdbc)
+    sx, sy = grid_length(cell_size.x, resolution), grid_length(cell_size.y, resolution)
+    cell_size = mp.Vector3(sx, sy, cell_size.z)
+    fcen = (1/wl_max + 1/wl_min) / 2
+    df = 1/wl_min - 1/wl_max
+
+    pml_layers = [mp.PML(thickness=dpml, direction=mp.Z)]
+    sources = [mp.Source(src=mp.GaussianSource(fcen, fwidth=df),
+                         component={'x': mp.Ex, 'y': mp.Ey}[polarization],
+                         center=mp.Vector3(0, 0, z_source), size=mp.Vector3(sx, sy, 0))]
+    probes = edge_probes(geometry, polarization)
+
+    def run():
+        sim = mp.Simulation(cell_size=cell_size, geometry=geometry, boundary_layers=pml_layers,
+                            sources=sources, resolution=resolution, k_point=mp.Vector3(0, 0, 0))
+        harminvs = [mp.Harminv(component, point, fcen, df) for component, point in probes]
+        sim.run(mp.after_sources(*harminvs), until_after_sources=ringdown)
+        modes = [m for h in harminvs for m in h.modes]
+        return {'freq': np.array([m.freq for m in modes]),
+                'decay': np.array([m.decay for m in modes]),
+                'Q': np.array([m.Q for m in modes]),
+                'amp': np.array([m.amp for m in modes], dtype=complex),
+                'err': np.array([m.err for m in modes])}
+
+    key = simulation_key(cell_size, resolution, geometry, sources, probes,
+                         boundary_layers=pml_layers, ringdown=ringdown, kind='harminv')
+    return select_modes(cached_run(key, run), wl_min, wl_max)
+
+
+def select_modes(modes, wl_min=0.4, wl_max=0.8):
+    """
+    Drop noise and out-of-band modes from raw Harminv output and merge
+    modes found by several probes (within 1% in frequency, the largest
+    amplitude is kept). Returns the arrays sorted by frequency.
+    """
+    keep = (modes['Q'] > min_Q) & (modes['err'] < max_error) & \
+           (modes['freq'] > 1/wl_max) & (modes['freq'] < 1/wl_min)
+    order = np.argsort(-np.abs(modes['amp'][keep]))
+    merged = {k: [] for k in modes}
+    for i in np.flatnonzero(keep)[order]:
+        if any(abs(modes['freq'][i] - f) < 0.01 * f for f in merged['freq']):
+            continue
+        for k in modes:
+            merged[k].append(modes[k][i])
+    by_freq = np.argsort(merged['freq'])
+    return {k: np.array(v)[by_freq] for k, v in merged.items()}
+
+
+def strongest(modes, E_min=0.0, E_max=np.inf):
+    """Index of the largest-amplitude mode with energy in (E_min, E_max) eV, or None."""
+    E = 1.23984 * modes['freq']
+    inside = np.flatnonzero((E > E_min) & (E < E_max))
+    if len(inside) == 0:
+        return None
+    return inside[np.argmax(np.abs(modes['amp'][inside]))]
+
+
+def polariton_energies(unit_cell, sizes_nm, polarization='x', with_Q=False, **kwargs):
+    """
+    (E_LSP, E_UP, E_LP) in eV over sizes_nm: the bare LSP and the coated
+    polaritons (NaN where a branch is not found). with_Q also returns
+    their Q factors.
+    """
+    E = np.full((3, len(sizes_nm)), np.nan)
+    Q = np.full((3, len(sizes_nm)), np.nan)
+    for j, size in enumerate(sizes_nm):
+        bare = extract_modes(unit_cell, size, False, polarization, **kwargs)
+        coated = extract_modes(unit_cell, size, True, polarization, **kwargs)
+        for row, (modes, i) in enumerate([(bare, strongest(bare)),
+                                          (coated, strongest(coated, E_min=E_X)),
+                                          (coated, strongest(coated, E_max=E_X))]):
+            if i is not None:
+                E[row, j] = 1.23984 * modes['freq'][i]
+                Q[row, j] = modes['Q'][i]
+    return (*E, *Q) if with_Q else tuple(E)
+
+
+if __name__ == "__main__":
+    from unit_cells import disk_unit_cell, diameters_nm
+
+    t0 = time.time()
+    E_LSP, E_UP, E_LP, Q_LSP, Q_UP, Q_LP = polariton_energies(disk_unit_cell, diameters_nm, with_Q=True)
+    print(f"Harminv, {2 * len(diameters_nm)} disk cells: {time.time() - t0:.0f}s\n")
+    for row in zip(diameters_nm, E_LSP, Q_LSP, E_UP, Q_UP, E_LP, Q_LP):
+        print("  D = {:3d} nm: LSP {:.2f} eV (Q {:.1f}), UP {:.2f} eV (Q {:.1f}), "
+              "LP {:.2f} eV (Q {:.1f})".format(*row))
+    np.savez('resonances.npz', diameters_nm=diameters_nm, E_LSP=E_LSP, E_UP=E_UP, E_LP=E_LP,
+             Q_LSP=Q_LSP, Q_UP=Q_UP, Q_LP=Q_LP)
+    print("Saved: resonances.npz")
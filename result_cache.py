@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Persistent, content-addressed cache of simulation results
+=========================================================
+
+fig3_fast.py, fig3cd_exact.py, fig5_exact.py and fig5_proper.py simulate
+the same coated Al disks at overlapping diameters with identical materials
+and resolution. Each run is keyed by a SHA-256 of a canonical description
+of everything that determines its output -- cell size, resolution, geometry
+(shapes and material poles), sources, monitor frequencies/regions and any
+extra run settings -- and its flux/field arrays are stored on disk under
+that key. A repeated run loads the arrays instead of running FDTD.
+
+    key = simulation_key(cell_size, resolution, geometry, sources,
+                         monitors=[(fcen, df, nfreq, region)], flux_tol=flux_tol)
+    flux = cached_run(key, run)['flux']     # run() -> dict of arrays
+
+Entries live in SIM_CACHE_DIR (default ./.sim_cache), are evicted least
+recently used first once the cache exceeds SIM_CACHE_MAX_MB (default 2048),
+and carry the SCHEMA_VERSION they were written with. Bump SCHEMA_VERSION
+whenever the canonical description changes; `python result_cache.py --prune`
+then removes the stale entries (`--clear` removes everything).
+
+Pool workers, MPI groups and work-queue hosts share one cache directory.
+Entries are written once per MPI group (by its master rank), and
+evicting, touching and pruning tolerate entries that another process has
+removed in the meantime.
+
+Author: ReproAgent
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+
+import meep as mp
+import numpy as np
+
+SCHEMA_VERSION = 1
+
+CACHE_DIR = os.environ.get('SIM_CACHE_DIR', '.sim_cache')
+MAX_BYTES = int(float(os.environ.get('SIM_CACHE_MAX_MB', 2048)) * 2**20)
+
+
+def _canonical(value):
+    """JSON-serializable canonical form of numbers, Meep objects and containers."""
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(f"{float(value):.12g}")
+    if isinstance(value, complex):
+        return [_canonical(value.real), _canonical(value.imag)]
+    if isinstance(value, np.ndarray):
+        return [_canonical(v) for v in value.ravel().tolist()] + [list(value.shape)]
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items())}
+    if hasattr(value, '__dict__'):
+        # Meep objects (Vector3, Medium, susceptibilities, shapes, sources, ...)
+        fields = {k: v for k, v in vars(value).items()
+                  if not k.startswith('_') and not k.startswith('swig') and not callable(v)}
+        return {'type': type(value).__name__, **_canonical(fields)}
+    return repr(value)
+
+
+def simulation_key(cell_size, resolution, geometry, sources, monitors, **extra):
+    """SHA-256 hex digest of everything that determines a run's output."""
+    description = {
+        'schema': SCHEMA_VERSION,
+        'cell_size': cell_size,
+        'resolution': resolution,
+        'geometry': geometry,
+        'sources': sources,
+        'monitors': monitors,
+        'extra': extra,
+    }
+    payload = json.dumps(_canonical(description), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _path(key):
+    return os.path.join(CACHE_DIR, key + '.npz')
+
+
+def load(key):
+    """Arrays stored under key, or None. A hit marks the entry as recently used."""
+    path = _path(key)
+    try:
+        with np.load(path) as data:
+            if int(data['_schema']) != SCHEMA_VERSION:
+                return None
+            arrays = {k: data[k] for k in data.files if k != '_schema'}
+    except (OSError, KeyError, ValueError):
+        return None
+    try:
+        os.utime(path)
+    except FileNotFoundError:   # evicted by another process since
+        pass
+    return arrays
+
+
+def store(key, arrays):
+    """Write arrays under key (atomically) and evict old entries if over budget.
+    Under MPI only the master rank of each group writes."""
+    if not mp.am_master():
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, _schema=SCHEMA_VERSION, **arrays)
+    os.replace(tmp, _path(key))
+    evict(MAX_BYTES)
+
+
+def cached_run(key, run):
+    """Stored arrays for key, or the dict of arrays returned by run() (then stored)."""
+    arrays = load(key)
+    if arrays is not None:
+        print(f"  cache hit {key[:12]}")
+        return arrays
+    arrays = run()
+    store(key, arrays)
+    return arrays
+
+
+def _entries():
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    entries = []
+    for f in os.listdir(CACHE_DIR):
+        if f.endswith('.npz'):
+            try:
+                entries.append((os.path.join(CACHE_DIR, f), os.stat(os.path.join(CACHE_DIR, f))))
+            except FileNotFoundError:   # removed by another process
+                pass
+    return entries
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def evict(max_bytes):
+    """Delete least recently used entries until the cache fits in max_bytes."""
+    entries = sorted(_entries(), key=lambda e: e[1].st_mtime)
+    total = sum(st.st_size for _, st in entries)
+    for path, st in entries:
+        if total <= max_bytes:
+            break
+        _remove(path)
+        total -= st.st_size
+
+
+def prune():
+    """Remove entries written under a different SCHEMA_VERSION; returns the count."""
+    removed = 0
+    for path, _ in _entries():
+        try:
+            with np.load(path) as data:
+                stale = int(data['_schema']) != SCHEMA_VERSION
+        except (OSError, KeyError, ValueError):
+            stale = True
+        if stale:
+            _remove(path)
+            removed += 1
+    return removed
+
+
+def clear():
+    for path, _ in _entries():
+        _remove(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or clean the simulation result cache")
+    parser.add_argument('--prune', action='store_true', help="remove entries from older schema versions")
+    parser.add_argument('--clear', action='store_true', help="remove all entries")
+    args = parser.parse_args()
+
+    if args.clear:
+        clear()
+    elif args.prune:
+        print(f"Removed {prune()} stale entries")
+    entries = _entries()
+    size = sum(st.st_size for _, st in entries)
+    print(f"{CACHE_DIR}: {len(entries)} entries, {size / 2**20:.1f} MB "
+          f"(limit {MAX_BYTES / 2**20:.0f} MB, schema {SCHEMA_VERSION})")
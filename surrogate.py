@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Lineshape-tracking surrogate of T(D, λ) maps
+============================================
+
+Between 5-9 simulated diameters, pcolormesh(..., shading='gouraud')
+interpolates T linearly at fixed wavelength, so a dip that moves smears
+into two half-deep dips. Here each sampled spectrum is reduced to its
+lineshape parameters (lineshape_fit.py: baseline and Fano terms, sorted by
+energy, so the LP and UP stay separate terms across the anti-crossing), and
+every parameter is interpolated over D by a Gaussian process
+
+    k(D, D') = s^2 exp(-(D - D')^2 / (2 l^2)) + noise,
+
+with s^2 the parameter's variance and l chosen by marginal likelihood
+(log widths, so they stay positive). Rendering a map evaluates the
+lineshape model at the interpolated parameters: dips move and change
+width continuously. The GP variance of the parameters, pushed through the
+lineshape Jacobian, gives a per-point standard deviation of T;
+`next_sizes` returns the candidate sizes where it is largest, and
+adaptive_sweep refines the intervals whose midpoints are least certain.
+A 1 nm-step map renders in milliseconds.
+
+    surrogate = MapSurrogate(diameters_nm, wavelengths_nm, coated_T)
+    T, T_std = surrogate.predict(np.arange(80, 201))
+
+`dense_maps` does this for all maps of a figure (the `surrogate_maps`
+option of fig3_fast, fig3cd_exact, fig4_nanorods and fig4_exact) and
+reports the unsimulated sizes the maps are least certain about.
+
+Author: ReproAgent
+"""
+
+import time
+
+import numpy as np
+
+from lineshape_fit import fit_map, model
+
+length_scales = np.geomspace(10, 400, 40)   # nm, searched by marginal likelihood
+noise = 1e-4                                # relative to each parameter's variance
+
+
+def _gp_fit(x, y):
+    """Length scale, Cholesky factor and weights of a GP through (x, y) (standardized y)."""
+    best = None
+    for ell in length_scales:
+        K = np.exp(-(x[:, None] - x[None, :])**2 / (2 * ell**2)) + noise * np.eye(len(x))
+        L = np.linalg.cholesky(K)
+        alpha = np.linalg.solve(L.T, np.linalg.solve(L, y))
+        log_likelihood = -0.5 * y @ alpha - np.sum(np.log(np.diag(L)))
+        if best is None or log_likelihood > best[0]:
+            best = (log_likelihood, ell, L, alpha)
+    return best[1:]
+
+
+class MapSurrogate:
+    """GP interpolation of the lineshape parameters of a sampled T(size, λ) map."""
+
+    def __init__(self, sizes_nm, wavelengths_nm, T, n_terms=2, fano=True):
+        self.sizes = np.asarray(sizes_nm, dtype=float)
+        self.wavelengths = np.asarray(wavelengths_nm, dtype=float)
+        self.E = 1239.84 / self.wavelengths
+        fit = fit_map(self.wavelengths, T, n_terms, fano)
+        self.rms = fit['rms']
+        # parameter columns in lineshape_fit order, widths as logarithms
+        terms = np.stack([fit['amplitude'], fit['energy'], np.log(fit['width']), fit['q']], -1)
+        params = np.concatenate([fit['baseline'], terms.reshape(len(T), -1)], axis=1)
+        good = np.all(np.isfinite(params), axis=1)
+        self.x, params = self.sizes[good], params[good]
+        self.mean, self.scale = params.mean(axis=0), params.std(axis=0) + 1e-12
+        self.gps = [_gp_fit(self.x, (p - m) / s) for p, m, s in zip(params.T, self.mean, self.scale)]
+
+    def parameters(self, sizes_nm):
+        """GP mean and standard deviation of the parameters at sizes_nm, (sizes, n_par) each."""
+        x = np.asarray(sizes_nm, dtype=float)
+        means, stds = [], []
+        for (ell, L, alpha), m, s in zip(self.gps, self.mean, self.scale):
+            k = np.exp(-(x[:, None] - self.x[None, :])**2 / (2 * ell**2))
+            v = np.linalg.solve(L, k.T)
+            means.append(m + s * (k @ alpha))
+            stds.append(s * np.sqrt(np.clip(1 + noise - np.sum(v**2, axis=0), 0, None)))
+        return np.array(means).T, np.array(stds).T
+
+    def predict(self, sizes_nm):
+        """Surrogate T and its standard deviation, each (sizes, wavelengths)."""
+        p, p_std = self.parameters(sizes_nm)
+        p[:, 4::4] = np.exp(p[:, 4::4])
+        p_std[:, 4::4] *= p[:, 4::4]     # d width = width d log(width)
+        T, J = model(p, self.E)
+        T_std = np.sqrt(np.sum((J * p_std[:, None, :])**2, axis=-1) + np.median(self.rms)**2)
+        return T, T_std
+
+    def uncertainty(self, sizes_nm):
+        """Predicted standard deviation of T at sizes_nm, averaged over wavelength."""
+        return self.predict(sizes_nm)[1].mean(axis=1)
+
+    def next_sizes(self, candidates_nm, n=1):
+        """The n candidate sizes with the largest mean predicted uncertainty."""
+        candidates = np.asarray(candidates_nm)
+        return candidates[np.argsort(-self.uncertainty(candidates))[:n]]
+
+
+def dense_maps(sizes_nm, wavelengths_nm, maps, n_terms, n_next=3):
+    """
+    1 nm-step surrogates of several (sizes, wavelengths) maps sampled at the
+    same sizes, with n_terms lineshape terms each (1 for a bare LSP, 2 for
+    the polariton branches). Returns (fine sizes, fine maps, the n_next
+    unsimulated sizes where the least certain map is least certain).
+    """
+    sizes = np.asarray(sizes_nm)
+    fine = np.arange(sizes.min(), sizes.max() + 1)
+    candidates = np.setdiff1d(fine, sizes)
+    dense, uncertainty = [], np.zeros(len(candidates))
+    for T, n in zip(maps, n_terms):
+        surrogate = MapSurrogate(sizes, wavelengths_nm, T, n)
+        dense.append(surrogate.predict(fine)[0])
+        uncertainty = np.maximum(uncertainty, surrogate.uncertainty(candidates))
+    return fine, dense, candidates[np.argsort(-uncertainty)[:n_next]]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Render 1 nm surrogate maps from a saved sweep")
+    parser.add_argument('path', nargs='?', default='fig3cd_fast_data.npz')
+    args = parser.parse_args()
+
+    with np.load(args.path) as data:
+        sizes, wl = data['diameters_nm'], data['wavelengths_nm']
+        maps = {'bare': (data['bare_transmission'], 1), 'coated': (data['coated_transmission'], 2)}
+    fine = np.arange(sizes.min(), sizes.max() + 1)
+    out = {'diameters_nm': fine, 'wavelengths_nm': wl}
+    for name, (T, n_terms) in maps.items():
+        surrogate = MapSurrogate(sizes, wl, T, n_terms)
+        t0 = time.time()
+        out[f'{name}_transmission'], out[f'{name}_std'] = surrogate.predict(fine)
+        print(f"{name}: {len(fine)} x {len(wl)} map in {(time.time() - t0) * 1000:.1f} ms, "
+              f"next sizes to simulate {surrogate.next_sizes(fine, 3)}")
+    np.savez(args.path.replace('.npz', '_surrogate.npz'), **out)
+    print(f"Saved: {args.path.replace('.npz', '_surrogate.npz')}")
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Process-pool executor for parameter sweeps
+==========================================
+
+The diameter/length sweeps run many small, independent 3D cells. `run_sweep`
+fans the calls out to a pool of workers forked from the calling script, so
+each worker starts with meep, the material definitions and the simulate
+function already imported. Results come back in sweep order; a failure or
+timeout is recorded for its point and the rest of the sweep carries on.
+Each worker sits in its own single-process executor, so a worker that
+dies outright (a segfault, the out-of-memory killer on a large coated
+cell) only takes down its own point: that point is recorded as failed and
+the worker is replaced.
+
+The pool size defaults to the number of cores and can be set with the
+SWEEP_PROCESSES environment variable (1 runs the sweep in-process).
+
+Run times differ a lot (the cell grows with the period, coated cells carry
+Lorentzian polarization arrays, Purcell runs keep six DFT planes). Given a
+cost estimate per point, the pool gets the expensive points first and
+cheap ones in packs (longest-processing-time order), and the sweep ends
+with the achieved against the ideal utilization of the pool.
+
+Under mpirun (mp.count_processors() > 1) forking is off the table and the
+sweep runs on MPI sub-groups instead: MPI_COMM_WORLD is split with
+mp.divide_parallel_processes into SWEEP_GROUPS groups (default one per
+rank, at most one per point), each group runs its share of the points with
+Meep's chunks spread over the group's ranks (longest-first onto the least
+loaded group when costs are given, round-robin otherwise), and the results
+are gathered on every rank with mp.merge_subgroup_data. Scripts write
+their plots and files only where `is_master()`. A per-point timeout is
+not available there: SIGALRM fires on each rank separately and would
+leave the rest of a group waiting in a collective.
+
+    mpirun -np 21 python fig4_nanorods.py                 # 21 single-rank groups
+    SWEEP_GROUPS=7 mpirun -np 28 python fig4_nanorods.py  # 7 groups of 4
+
+With checkpoint=<directory>, every successful point is pickled there as it
+finishes (one file per point, written atomically). A rerun of a sweep that
+died part-way loads those points and runs only the rest (under MPI the
+master rank reads them and shares them, so all ranks agree on which points
+are left). A point's file is keyed by the function, its arguments and
+`settings`, the module-level parameters the function reads (resolution,
+nfreq, flux_tol, ...): a rerun after the script's settings were edited
+starts those points afresh. Scripts remove the directory
+(`clear_checkpoint`) once their output is saved.
+
+Author: ReproAgent
+"""
+
+import collections
+import hashlib
+import importlib
+import multiprocessing
+import os
+import pickle
+import shutil
+import signal
+import tempfile
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+SweepResult = namedtuple('SweepResult', ['args', 'value', 'error', 'elapsed'])
+
+
+class SweepTimeout(Exception):
+    """Raised inside a worker when a sweep point exceeds its time limit."""
+
+
+# Set in each worker by _init_worker
+_func = None
+_timeout = None
+
+
+def _raise_timeout(signum, frame):
+    raise SweepTimeout(f"sweep point exceeded {_timeout:.0f} s")
+
+
+def _init_worker(func, timeout, warm_imports, quiet):
+    global _func, _timeout
+    _func = func
+    _timeout = timeout
+    for name in warm_imports:
+        importlib.import_module(name)
+    if quiet:
+        import meep as mp
+        mp.verbosity(0)
+    signal.signal(signal.SIGALRM, _raise_timeout)
+
+
+def _run_point(args):
+    t0 = time.time()
+    if _timeout:
+        signal.setitimer(signal.ITIMER_REAL, _timeout)
+    try:
+        value, error = _func(*args), None
+    except Exception:
+        value, error = None, traceback.format_exc()
+    finally:
+        if _timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return SweepResult(args, value, error, time.time() - t0)
+
+
+def _run_task(task):
+    """A packed task: (index, args) pairs run one after another in this worker."""
+    return [(i, _run_point(args)) for i, args in task]
+
+
+def _pool_outcomes(tasks, processes, init_args):
+    """
+    Run tasks on `processes` forked workers, yielding each task's (index,
+    SweepResult) list as it finishes. A worker that dies breaks only its
+    own executor: a packed task is retried point by point, a single point
+    is recorded as failed, and the worker is replaced.
+    """
+    ctx = multiprocessing.get_context('fork')
+
+    def worker():
+        return ProcessPoolExecutor(1, mp_context=ctx, initializer=_init_worker, initargs=init_args)
+
+    queue = collections.deque(tasks)
+    idle = [worker() for _ in range(processes)]
+    running = {}    # future -> (executor, task, start time)
+    try:
+        while queue or running:
+            while queue and idle:
+                executor, task = idle.pop(), queue.popleft()
+                running[executor.submit(_run_task, task)] = (executor, task, time.time())
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                executor, task, t0 = running.pop(future)
+                try:
+                    outcome = future.result()
+                except BrokenProcessPool:
+                    executor.shutdown(wait=False)
+                    executor = worker()
+                    if len(task) > 1:
+                        queue.extendleft(reversed([[point] for point in task]))
+                        outcome = []
+                    else:
+                        i, args = task[0]
+                        outcome = [(i, SweepResult(args, None, "worker process died (killed by a signal, "
+                                                   "e.g. a segfault or the out-of-memory killer)\n",
+                                                   time.time() - t0))]
+                idle.append(executor)
+                yield outcome
+    finally:
+        for executor, _, _ in running.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        for executor in idle:
+            executor.shutdown()
+
+
+def schedule(costs, processes, pack=True):
+    """
+    Tasks (lists of point indices) in dispatch order: longest first, with
+    points cheaper than a quarter of the per-worker share packed together
+    into tasks of about that size, so that tiny cells do not leave the
+    pool idle between dispatches.
+    """
+    costs = np.asarray(costs, dtype=float)
+    order = [int(i) for i in np.argsort(-costs, kind='stable')]
+    quantum = costs.sum() / (4 * processes)
+    tasks, packs = [], []
+    for i in order:
+        if not pack or costs[i] >= quantum:
+            tasks.append([i])
+            continue
+        # first-fit decreasing into packs of at most one quantum
+        for p in packs:
+            if sum(costs[j] for j in p) + costs[i] <= quantum:
+                p.append(i)
+                break
+        else:
+            packs.append([i])
+    tasks += packs
+    return sorted(tasks, key=lambda t: -sum(costs[j] for j in t))
+
+
+def utilization(results, processes, wall):
+    """(achieved, ideal) busy fraction of the pool: sum of run times over processes x wall,
+    and over the shortest possible makespan (work spread evenly, bounded by the longest run)."""
+    busy = sum(r.elapsed for r in results)
+    longest = max((r.elapsed for r in results), default=0)
+    ideal_wall = max(busy / processes, longest)
+    return busy / (processes * wall) if wall > 0 else 1.0, busy / (processes * ideal_wall) if ideal_wall > 0 else 1.0
+
+
+def _mpi_ranks():
+    import meep as mp
+    return mp.count_processors()
+
+
+def mpi_groups():
+    """Number of MPI sub-groups: SWEEP_GROUPS if set, else one per rank (1 outside mpirun)."""
+    ranks = _mpi_ranks()
+    return 1 if ranks == 1 else max(1, min(int(os.environ.get('SWEEP_GROUPS', ranks)), ranks))
+
+
+def is_master():
+    """True on the one rank that writes plots and files (always true without MPI)."""
+    import meep as mp
+    return mp.am_really_master()
+
+
+def _merge_objects(objects):
+    """Gather one picklable object per MPI sub-group onto every rank, in group order."""
+    import meep as mp
+    payload = np.frombuffer(pickle.dumps(objects), dtype=np.uint8)
+    # merge_subgroup_data sums doubles across groups: exchange sizes first,
+    # then the zero-padded byte strings (bytes are exact as doubles)
+    sizes = mp.merge_subgroup_data(np.array([len(payload)], dtype=float))[0].astype(int)
+    padded = np.zeros(sizes.max())
+    padded[:len(payload)] = payload
+    merged = mp.merge_subgroup_data(padded)
+    return [pickle.loads(merged[:n, g].astype(np.uint8).tobytes()) for g, n in enumerate(sizes)]
+
+
+def _share_from_master(obj):
+    """obj as passed on the master rank, on every rank (each rank in its own group for the exchange)."""
+    import meep as mp
+    master = is_master()
+    mp.divide_parallel_processes(mp.count_processors())
+    try:
+        shared = _merge_objects(obj if master else None)
+    finally:
+        mp.end_divide_parallel()
+    return next(o for o in shared if o is not None)
+
+
+def _run_sweep_mpi(func, points, groups, timeout, costs, checkpoint=None, settings=None):
+    """run_sweep on MPI sub-groups: every rank returns all results in sweep order."""
+    import meep as mp
+    groups = min(groups, len(points))
+    if costs is not None:
+        load, owner = np.zeros(groups), [0] * len(points)
+        for i in np.argsort(-np.asarray(costs, dtype=float), kind='stable'):
+            owner[i] = int(np.argmin(load))
+            load[owner[i]] += costs[i]
+    else:
+        owner = [i % groups for i in range(len(points))]
+
+    t_start = time.time()
+    group = mp.divide_parallel_processes(groups) if groups > 1 else 0
+    _init_worker(func, timeout, (), quiet=False)
+    mine = []
+    for i, args in enumerate(points):
+        if owner[i] != group:
+            continue
+        result = _run_point(args)
+        mine.append((i, result))
+        if checkpoint is not None and result.error is None and mp.am_master():
+            _save_point(checkpoint, func, result, settings)
+        if mp.am_master():
+            status = "done" if result.error is None else "FAILED: " + result.error.strip().splitlines()[-1]
+            print(f"  [group {group}: {len(mine)}/{owner.count(group)}] {func.__name__}{args}... "
+                  f"{status} ({result.elapsed:.1f}s)", flush=True)
+    if groups > 1:
+        gathered = _merge_objects(mine)
+        mp.end_divide_parallel()
+    else:
+        gathered = [mine]
+
+    results = [None] * len(points)
+    for outcome in gathered:
+        for i, result in outcome:
+            results[i] = result
+    if is_master():
+        achieved, ideal = utilization(results, groups, time.time() - t_start)
+        print(f"  {len(points)} points on {groups} MPI group(s) of ~{mp.count_processors() // groups} "
+              f"rank(s): utilization {achieved:.0%} (ideal {ideal:.0%} for these run times)")
+    return results
+
+
+def _checkpoint_file(directory, func, args, settings=None):
+    name = f"{func.__module__}.{func.__qualname__}{args!r}{sorted((settings or {}).items())!r}"
+    return os.path.join(directory, hashlib.sha256(name.encode()).hexdigest()[:24] + '.pkl')
+
+
+def _done_points(directory, func, points, settings=None):
+    """{index: SweepResult} of the points already stored in directory."""
+    def scan():
+        return {i: r for i, r in enumerate(_load_point(directory, func, p, settings) for p in points)
+                if r is not None}
+    return scan() if _mpi_ranks() == 1 else _share_from_master(scan() if is_master() else None)
+
+
+def _load_point(directory, func, args, settings=None):
+    try:
+        with open(_checkpoint_file(directory, func, args, settings), 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def _save_point(directory, func, result, settings=None):
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(result, f)
+    os.replace(tmp, _checkpoint_file(directory, func, result.args, settings))
+
+
+def clear_checkpoint(directory):
+    """Remove a sweep's point checkpoints (call once its results are saved)."""
+    if is_master():
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def default_processes():
+    """Pool size: SWEEP_PROCESSES if set, otherwise the number of cores."""
+    return int(os.environ.get('SWEEP_PROCESSES', os.cpu_count() or 1))
+
+
+def run_sweep(func, points, processes=None, timeout=None,
+              warm_imports=('meep', 'meep.materials'), quiet=True, equivalent=None, cost=None,
+              checkpoint=None, settings=None):
+    """
+    Evaluate func(*point) for every point of a sweep on a pool of forked workers.
+
+    points     : iterable of argument tuples (bare values are wrapped as 1-tuples)
+    timeout    : per-point limit in seconds, or None (not under MPI)
+    equivalent : optional equivalent(*point) -> point that gives the same
+                 result (e.g. the x run of a C4-symmetric cell for its y run);
+                 equivalent points are simulated once
+    cost       : optional cost(*point) -> estimated cost (any unit, e.g.
+                 planner.job_cost); points then run longest first, cheap
+                 points packed together (`schedule`), and the pool's
+                 achieved and ideal utilization are reported
+    checkpoint : optional directory; finished points are stored there as
+                 they complete and skipped when the sweep is rerun
+    settings   : dict of the module-level parameters func depends on
+                 (resolution, nfreq, ...); part of each point's checkpoint
+                 key, so points stored under other settings are not reused
+
+    Under mpirun the points run on MPI sub-groups (`mpi_groups`) rather
+    than a pool, and every rank gets the full result list.
+
+    Returns a list of SweepResult(args, value, error, elapsed) in sweep order;
+    `error` holds the traceback of a failed or timed-out point, otherwise None.
+    """
+    points = [p if isinstance(p, tuple) else (p,) for p in points]
+    if timeout is not None and _mpi_ranks() > 1:
+        raise ValueError("run_sweep: timeout is not supported under MPI (SIGALRM fires per rank, "
+                         "so a group would hang in a collective)")
+    if equivalent is not None:
+        canonical = [tuple(equivalent(*p)) for p in points]
+        unique = list(dict.fromkeys(canonical))
+        skipped = len(points) - len(unique)
+        if skipped:
+            print(f"  Skipping {skipped} point(s) equivalent to another point of the sweep")
+        by_point = dict(zip(unique, run_sweep(func, unique, processes, timeout, warm_imports, quiet,
+                                              cost=cost, checkpoint=checkpoint, settings=settings)))
+        return [by_point[c]._replace(args=p) for p, c in zip(points, canonical)]
+
+    if checkpoint is not None:
+        done = _done_points(checkpoint, func, points, settings)
+        if done:
+            print(f"  Resuming sweep: {len(done)}/{len(points)} points already done in {checkpoint}")
+            rest = [p for i, p in enumerate(points) if i not in done]
+            fresh = iter(run_sweep(func, rest, processes, timeout, warm_imports, quiet,
+                                   cost=cost, checkpoint=checkpoint, settings=settings) if rest else [])
+            return [done[i] if i in done else next(fresh) for i in range(len(points))]
+
+    if _mpi_ranks() > 1:
+        return _run_sweep_mpi(func, points, mpi_groups(), timeout,
+                              [cost(*p) for p in points] if cost is not None else None, checkpoint, settings)
+
+    if processes is None:
+        processes = default_processes()
+    processes = max(1, min(processes, len(points)))
+
+    costs = [cost(*p) for p in points] if cost is not None else None
+    tasks = schedule(costs, processes) if cost is not None else [[i] for i in range(len(points))]
+    tasks = [[(i, points[i]) for i in task] for task in tasks]
+
+    t_start = time.time()
+    if processes == 1:
+        _init_worker(func, timeout, (), quiet=False)
+        outcomes = map(_run_task, tasks)
+    else:
+        outcomes = _pool_outcomes(tasks, processes, (func, timeout, warm_imports, quiet))
+
+    results = [None] * len(points)
+    done = 0
+    for outcome in outcomes:
+        for i, result in outcome:
+            done += 1
+            status = "done" if result.error is None else "FAILED: " + result.error.strip().splitlines()[-1]
+            print(f"  [{done}/{len(points)}] {func.__name__}{result.args}... "
+                  f"{status} ({result.elapsed:.1f}s)", flush=True)
+            results[i] = result
+            if checkpoint is not None and result.error is None:
+                _save_point(checkpoint, func, result, settings)
+
+    if cost is not None:
+        achieved, ideal = utilization(results, processes, time.time() - t_start)
+        elapsed = np.array([r.elapsed for r in results])
+        fit = np.corrcoef(np.log(np.maximum(costs, 1e-30)), np.log(np.maximum(elapsed, 1e-3)))[0, 1] \
+            if len(points) > 2 else np.nan
+        print(f"  Pool utilization {achieved:.0%} (ideal {ideal:.0%} for these run times) in "
+              f"{len(tasks)} tasks on {processes} processes; cost model vs run time: r = {fit:.2f}")
+    return results
+
+
+def sweep_spectra(results):
+    """
+    Collect (wavelengths, spectrum) sweep results into a wavelength axis and
+    an (n_points, ...) array of spectra; failed points are filled with NaN.
+    """
+    good = [r.value for r in results if r.error is None]
+    if not good:
+        raise RuntimeError("every point of the sweep failed")
+    wavelengths, template = good[0]
+    spectra = np.array([r.value[1] if r.error is None else np.full(np.shape(template), np.nan)
+                        for r in results])
+    return wavelengths, spectra
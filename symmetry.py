@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Mirror-symmetry detection for normal-incidence unit cells
+=========================================================
+
+The disk and ellipsoid unit cells are centred on the cell origin, and every
+source is an Ex or Ey plane wave (or a dipole on a mirror plane). Meep can
+then simulate a quarter of the cell, provided it is told the parity of the
+fields under each mirror:
+
+    Ex source: Mirror(X, phase=-1), Mirror(Y, phase=+1)
+    Ey source: Mirror(X, phase=+1), Mirror(Y, phase=-1)
+
+`mirror_symmetries` checks the geometry, sources, boundary layers and Bloch
+vector plane by plane and returns the mirrors that hold. `is_c4_symmetric`
+recognises cells (e.g. disks in square arrays) whose x- and y-polarized
+responses are identical, so one of the two runs can be skipped.
+
+Author: ReproAgent
+"""
+
+import meep as mp
+
+TOL = 1e-9
+
+_AXES = {mp.X: 'x', mp.Y: 'y'}
+
+# Field component -> (direction, is magnetic)
+_COMPONENTS = {
+    mp.Ex: (mp.X, False), mp.Ey: (mp.Y, False), mp.Ez: (mp.Z, False),
+    mp.Hx: (mp.X, True), mp.Hy: (mp.Y, True), mp.Hz: (mp.Z, True),
+}
+
+
+def _is_zero(v):
+    return abs(v.x) < TOL and abs(v.y) < TOL and abs(v.z) < TOL
+
+
+def _axis_aligned(*vectors):
+    return all(sum(abs(c) > TOL for c in (v.x, v.y, v.z)) == 1 for v in vectors)
+
+
+def _medium_is_diagonal(medium):
+    """Diagonal media map onto themselves under any mirror or 90° rotation about z."""
+    if not isinstance(medium, mp.Medium):
+        return False
+    return _is_zero(medium.epsilon_offdiag) and all(
+        _is_zero(s.sigma_offdiag) for s in medium.E_susceptibilities)
+
+
+def _medium_is_isotropic_xy(medium):
+    if not _medium_is_diagonal(medium):
+        return False
+    return abs(medium.epsilon_diag.x - medium.epsilon_diag.y) < TOL and all(
+        abs(s.sigma_diag.x - s.sigma_diag.y) < TOL for s in medium.E_susceptibilities)
+
+
+def _object_mirror_symmetric(obj, axis):
+    """True if obj maps onto itself under axis -> -axis."""
+    if not _medium_is_diagonal(obj.material):
+        return False
+    offset = abs(getattr(obj.center, axis))
+    if isinstance(obj, mp.Block):   # includes mp.Ellipsoid
+        if not _axis_aligned(obj.e1, obj.e2, obj.e3):
+            return False
+        return offset < TOL or getattr(obj.size, axis) >= mp.inf
+    if isinstance(obj, mp.Cylinder):   # includes mp.Cone
+        if not _axis_aligned(obj.axis) or offset >= TOL:
+            return False
+        # a cone along the mirror normal is turned end over end by the mirror
+        along_normal = abs(getattr(obj.axis, axis)) > TOL
+        return not (along_normal and isinstance(obj, mp.Cone) and abs(obj.radius2 - obj.radius) > TOL)
+    if isinstance(obj, mp.Sphere):
+        return offset < TOL
+    return False
+
+
+def _source_parity(source, direction, axis):
+    """Parity (+1/-1) of the source under the mirror, or None if it breaks it."""
+    if source.amp_func is not None or source.component not in _COMPONENTS:
+        return None
+    if abs(getattr(source.center, axis)) > TOL:
+        return None
+    comp_dir, magnetic = _COMPONENTS[source.component]
+    along = comp_dir == direction
+    # E is a vector, H a pseudovector
+    return (-1 if along else 1) * (-1 if magnetic else 1)
+
+
+def _boundaries_symmetric(boundary_layers, direction):
+    for layer in boundary_layers:
+        if layer.side != mp.ALL and layer.direction in (direction, mp.ALL):
+            return False
+    return True
+
+
+def mirror_symmetries(geometry, sources, boundary_layers=(), k_point=None):
+    """
+    Mirror symmetries (mp.Mirror list) of a cell centred on the origin.
+
+    A plane x=0 (or y=0) is used only if every geometric object and source
+    maps onto itself, all sources share one parity, the boundary layers are
+    two-sided and the Bloch vector has no component along the normal.
+    """
+    symmetries = []
+    for direction, axis in _AXES.items():
+        if k_point is not None and abs(getattr(k_point, axis)) > TOL:
+            continue
+        if not _boundaries_symmetric(boundary_layers, direction):
+            continue
+        if not all(_object_mirror_symmetric(obj, axis) for obj in geometry):
+            continue
+        parities = {_source_parity(src, direction, axis) for src in sources}
+        if len(parities) != 1 or None in parities:
+            continue
+        symmetries.append(mp.Mirror(direction, phase=parities.pop()))
+    return symmetries
+
+
+def _object_c4_symmetric(obj):
+    """True if obj maps onto itself under a 90° rotation about the z axis."""
+    if not _medium_is_isotropic_xy(obj.material):
+        return False
+    centred = abs(obj.center.x) < TOL and abs(obj.center.y) < TOL
+    if isinstance(obj, mp.Block):   # includes mp.Ellipsoid
+        if not _axis_aligned(obj.e1, obj.e2, obj.e3):
+            return False
+        if obj.size.x >= mp.inf and obj.size.y >= mp.inf:
+            return True
+        return centred and abs(obj.size.x - obj.size.y) < TOL
+    if isinstance(obj, mp.Cylinder):
+        return centred and abs(obj.axis.x) < TOL and abs(obj.axis.y) < TOL
+    if isinstance(obj, mp.Sphere):
+        return centred
+    return False
+
+
+def is_c4_symmetric(cell_size, geometry):
+    """True if the (square) unit cell is invariant under a 90° rotation about z."""
+    return abs(cell_size.x - cell_size.y) < TOL and all(_object_c4_symmetric(obj) for obj in geometry)
+
+
+def equivalent_polarization(cell_size, geometry, polarization):
+    """
+    Polarization that has to be simulated to obtain `polarization`: a C4 cell
+    responds to y exactly as it does to x, so its y run maps onto the x run.
+    """
+    if polarization == 'y' and is_c4_symmetric(cell_size, geometry):
+        return 'x'
+    return polarization
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Run telemetry for cost estimation
+=================================
+
+Every FDTD run that stops through FluxConvergence.report() appends one JSON
+line to RUN_TELEMETRY (default ./run_telemetry.jsonl):
+
+    {"voxels": ..., "dispersive_voxels": ..., "symmetry": 4, "resolution": 60,
+     "timesteps": ..., "meep_time": ..., "seconds": ..., "label": ...,
+     "dimensions": 3, "plane_wave": true}
+
+voxels counts the whole grid and dispersive_voxels the grid points whose
+material has susceptibilities (Al, ITO, TDBC), rastered with the same
+last-object-wins rule as Meep; symmetry is the reduction factor of the
+mirror planes in use. dimensions is 1, 2, 3 or "cylindrical", and
+plane_wave says whether every source spans the whole lateral cell, so
+the 1D flat-stack references, cylindrical and Purcell (dipole) runs can
+be told apart from the 3D transmission runs. `records` reads these lines
+and, for runs from before the telemetry existed, Meep's own console logs
+(fig4_log.txt, plane-wave transmission runs): cell size, resolution,
+"s/step" reports and "(N timesteps)" lines give seconds per step without
+the dispersive count. timesteps counts the steps timed by `seconds`, i.e.
+only those run since a checkpoint resume (checkpoint.py); meep_time is
+the whole run's. planner.py calibrates its cost model on
+`transmission_records`.
+
+Author: ReproAgent
+"""
+
+import glob
+import json
+import os
+import re
+
+import numpy as np
+import meep as mp
+
+from unit_cells import inside
+
+TELEMETRY = os.environ.get('RUN_TELEMETRY', 'run_telemetry.jsonl')
+
+
+def _axis(length, resolution):
+    """Voxel centres along one cell axis (a single point for a collapsed axis)."""
+    n = max(1, int(np.floor(length * resolution + 0.5)))
+    return (np.arange(n) + 0.5) / resolution - length / 2 if length > 0 else np.zeros(1)
+
+
+def dispersive_voxels(cell_size, geometry, resolution, default_material=mp.Medium(), poles=False):
+    """
+    Grid points whose material (last object containing them wins) is
+    dispersive; with poles=True each counts once per susceptibility, i.e.
+    the number of polarization-array entries Meep updates.
+    """
+    x, y, z = (_axis(getattr(cell_size, a), resolution) for a in 'xyz')
+    X, Y = np.meshgrid(x, y, indexing='ij')
+    n_poles = lambda medium: len(medium.E_susceptibilities) + len(medium.H_susceptibilities)
+    weight = n_poles if poles else (lambda medium: min(1, n_poles(medium)))
+    count = 0
+    for zi in z:
+        plane = np.full(X.shape, weight(default_material))
+        for obj in geometry:
+            plane = np.where(inside(obj, X, Y, zi), weight(obj.material), plane)
+        count += int(plane.sum())
+    return count
+
+
+def _plane_wave(sim):
+    """Whether every source covers the whole cell in x and y."""
+    cell = sim.cell_size
+    return all(s.size.x >= cell.x - 1e-9 and s.size.y >= cell.y - 1e-9 for s in sim.sources)
+
+
+def run_record(sim, seconds, label='', first_step=0):
+    """
+    Telemetry of a finished Simulation that took `seconds` of wall time to
+    run from timestep first_step (non-zero for a run resumed from a
+    checkpoint, whose earlier steps were timed by another session).
+    """
+    cell = sim.cell_size
+    record = {
+        'voxels': int(np.prod([max(1, int(np.floor(getattr(cell, a) * sim.resolution + 0.5)))
+                               for a in 'xyz'])),
+        'dispersive_voxels': None,
+        'symmetry': 2 ** len(sim.symmetries),
+        'resolution': sim.resolution,
+        'timesteps': int(sim.timestep()) - first_step,
+        'meep_time': float(sim.meep_time()),
+        'seconds': float(seconds),
+        'label': label,
+        'dimensions': 'cylindrical' if sim.dimensions == mp.CYLINDRICAL else sim.dimensions,
+        'plane_wave': _plane_wave(sim),
+    }
+    if sim.dimensions != mp.CYLINDRICAL:
+        record['dispersive_voxels'] = dispersive_voxels(cell, sim.geometry, sim.resolution,
+                                                        sim.default_material)
+    return record
+
+
+def log_run(sim, seconds, label='', first_step=0):
+    """Append the run's telemetry to TELEMETRY (never fails the run; one line per MPI group)."""
+    if not mp.am_master():
+        return
+    try:
+        line = json.dumps(run_record(sim, seconds, label, first_step))
+        with open(TELEMETRY, 'a') as f:
+            f.write(line + '\n')
+    except (OSError, ValueError, AttributeError) as error:
+        print(f"  telemetry not recorded: {error}")
+
+
+_CELL = re.compile(r"Computational cell is ([\d.e+-]+) x ([\d.e+-]+) x ([\d.e+-]+) with resolution (\d+)")
+_STEP = re.compile(r"([\d.e+-]+) s/step")
+_DONE = re.compile(r"finished at t = ([\d.e+-]+) \((\d+) timesteps\)")
+
+
+def parse_meep_log(path):
+    """Records (without dispersive counts) from a Meep console log."""
+    found, cell, per_step = [], None, []
+    with open(path, errors='replace') as f:
+        for line in f:
+            m = _CELL.search(line)
+            if m:
+                size, resolution = [float(v) for v in m.groups()[:3]], int(m.group(4))
+                cell = (int(np.prod([max(1, int(np.floor(s * resolution + 0.5))) for s in size])),
+                        resolution, sum(s > 0 for s in size))
+                per_step = []
+                continue
+            m = _STEP.search(line)
+            if m and cell is not None:
+                per_step.append(float(m.group(1)))
+                continue
+            m = _DONE.search(line)
+            if m and cell is not None and per_step:
+                steps = int(m.group(2))
+                found.append({'voxels': cell[0], 'dispersive_voxels': None, 'symmetry': 1,
+                              'resolution': cell[1], 'timesteps': steps,
+                              'meep_time': float(m.group(1)),
+                              'seconds': float(np.median(per_step)) * steps, 'label': path,
+                              'dimensions': cell[2], 'plane_wave': True})
+                per_step = []
+    return found
+
+
+def records(paths=None):
+    """All telemetry records: TELEMETRY plus every *_log.txt Meep log (or the given paths)."""
+    paths = paths if paths is not None else [TELEMETRY] + sorted(glob.glob('*_log.txt'))
+    found = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        if path.endswith('.jsonl'):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        found.append(json.loads(line))
+                    except json.JSONDecodeError:   # blank, or cut short by a killed run
+                        continue
+        else:
+            found += parse_meep_log(path)
+    return found
+
+
+def transmission_records(found=None):
+    """The 3D plane-wave runs among `found` (default: all records); older records lack the tags."""
+    found = records() if found is None else found
+    return [r for r in found if r.get('dimensions') == 3 and r.get('plane_wave')]
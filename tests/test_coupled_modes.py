@@ -0,0 +1,43 @@
+import numpy as np
+
+from coupled_modes import coupled_modes, diagonalize, two_modes
+
+
+def closed_form(E_1, E_2, g, gamma_1, gamma_2):
+    """Eigenvalues E -/+ i Gamma/2 of [[E_1 - i gamma_1/2, g], [g, E_2 - i gamma_2/2]]."""
+    a, b = E_1 - 0.5j * gamma_1, E_2 - 0.5j * gamma_2
+    root = np.sqrt(((a - b) / 2)**2 + g**2)
+    return (a + b) / 2 - root, (a + b) / 2 + root
+
+
+def test_two_modes_match_closed_form():
+    E_LSP = np.linspace(1.6, 2.6, 41)
+    E_UP, E_LP, fractions = two_modes(E_LSP, 2.1, 0.2)
+    lower, upper = closed_form(E_LSP, 2.1, 0.2, 0.0, 0.0)
+    np.testing.assert_allclose(E_LP, lower.real, atol=1e-12)
+    np.testing.assert_allclose(E_UP, upper.real, atol=1e-12)
+    np.testing.assert_allclose(fractions.sum(-1), 1)
+    # equal mixing at zero detuning
+    np.testing.assert_allclose(fractions[20], 0.5, atol=1e-12)
+
+
+def test_lossy_modes_match_closed_form():
+    E_LSP, gamma_LSP, gamma_X = np.linspace(1.6, 2.6, 41), 0.3, 0.05
+    E, linewidths, _ = coupled_modes([E_LSP, 2.1], [gamma_LSP, gamma_X], {(0, 1): 0.2})
+    roots = np.sort_complex(np.stack(closed_form(E_LSP, 2.1, 0.2, gamma_LSP, gamma_X), -1))
+    np.testing.assert_allclose(E, roots.real, atol=1e-12)
+    np.testing.assert_allclose(linewidths, -2 * roots.imag, atol=1e-12)
+
+
+def test_closed_form_path_matches_eig():
+    rng = np.random.default_rng(0)
+    H = rng.normal(size=(200, 2, 2)) + 1j * rng.normal(size=(200, 2, 2))
+    H = np.concatenate([H, np.array([np.eye(2), np.diag([2.0, 1.0])], dtype=complex)])
+    E, linewidths, fractions = diagonalize(H)
+    values, vectors = np.linalg.eig(H)
+    order = np.argsort(values.real, axis=-1)
+    values = np.take_along_axis(values, order, -1)
+    weights = np.abs(np.swapaxes(np.take_along_axis(vectors, order[..., None, :], -1), -1, -2))**2
+    np.testing.assert_allclose(E, values.real, atol=1e-12)
+    np.testing.assert_allclose(linewidths, -2 * values.imag, atol=1e-12)
+    np.testing.assert_allclose(fractions, weights / weights.sum(-1, keepdims=True), atol=1e-12)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+import lineshape_fit
+
+
+@pytest.mark.parametrize('fano', [False, True])
+def test_lineshape_fit_recovers_lines(fano):
+    wavelengths_nm = np.linspace(400, 800, 300)
+    E = 1239.84 / wavelengths_nm
+    # two rows: (baseline b0, b1), then (A, E0, Gamma, q) per term
+    q = (0.4, -0.3) if fano else (0.0, 0.0)
+    truth = np.array([[0.95, 0.02, 0.35, 1.95, 0.12, q[0], 0.25, 2.45, 0.08, q[1]],
+                      [0.90, -0.01, 0.30, 1.85, 0.10, q[1], 0.30, 2.30, 0.15, q[0]]])
+    T = lineshape_fit.model(truth, E, jacobian=False)
+    result = lineshape_fit.fit_map(wavelengths_nm, T, n_terms=2, fano=fano)
+    np.testing.assert_allclose(result['energy'], truth[:, [3, 7]], atol=1e-4)
+    np.testing.assert_allclose(result['width'], truth[:, [4, 8]], atol=1e-4)
+    np.testing.assert_allclose(result['amplitude'], truth[:, [2, 6]], atol=1e-4)
+    np.testing.assert_allclose(result['q'], truth[:, [5, 9]], atol=1e-3)
+    assert np.all(result['rms'] < 1e-6)
+
+
+def test_fit_npz_skips_object_arrays(tmp_path):
+    wavelengths_nm = np.linspace(400, 800, 200)
+    truth = np.array([[0.95, 0.0, 0.35, 2.0, 0.1, 0.0]])
+    T = lineshape_fit.model(truth, 1239.84 / wavelengths_nm, jacobian=False)
+    path = tmp_path / 'maps.npz'
+    np.savez(path, wavelengths_nm=wavelengths_nm, T=T, results=np.array([{'D': 140}], dtype=object))
+    fits = lineshape_fit.fit_npz(path, n_terms=1, fano=False)
+    assert list(fits) == ['T']
+    np.testing.assert_allclose(fits['T']['energy'], [[2.0]], atol=1e-4)
+
+
+def test_fit_npz_transposes_wavelength_first_maps(tmp_path):
+    # fig3cd_exact and fig4_exact save their maps as (wavelengths, sizes)
+    wavelengths_nm = np.linspace(400, 800, 150)
+    truth = np.array([[0.95, 0.0, 0.35, E0, 0.1, 0.0] for E0 in np.linspace(1.8, 2.6, 7)])
+    T = lineshape_fit.model(truth, 1239.84 / wavelengths_nm, jacobian=False)
+    path = tmp_path / 'maps.npz'
+    np.savez(path, wavelengths=wavelengths_nm, T_coated_x=T.T, lengths_nm=np.arange(7))
+    fits = lineshape_fit.fit_npz(path, n_terms=1, fano=False)
+    assert list(fits) == ['T_coated_x']
+    np.testing.assert_allclose(fits['T_coated_x']['energy'][:, 0], truth[:, 3], atol=1e-4)
@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip('meep')
+
+from planner import calibrate
+from telemetry import records
+
+
+def record(voxels, dispersive, seconds, meep_time, dimensions=3, plane_wave=True):
+    return {'voxels': voxels, 'dispersive_voxels': dispersive, 'symmetry': 4, 'timesteps': 100,
+            'meep_time': meep_time, 'seconds': seconds, 'dimensions': dimensions, 'plane_wave': plane_wave}
+
+
+def test_calibrate_uses_only_plane_wave_3d_runs():
+    transmission = [record(4e6, 4e5, 11, 300), record(8e6, 1.2e6, 23, 320)]
+    others = [record(240, 100, 0.5, 40, dimensions=1),             # flat-stack reference
+              record(2e5, 1e5, 30, 900, dimensions='cylindrical'),
+              record(4e6, 4e5, 90, 30, plane_wave=False),           # Purcell dipole run
+              {'voxels': 1e6, 'dispersive_voxels': None, 'symmetry': 1, 'timesteps': 10,
+               'meep_time': 5, 'seconds': 1}]                        # untagged, from before the tags
+    model = calibrate(transmission + others)
+    assert model['records'] == 2
+    assert model['meep_time'] == pytest.approx(310)
+    assert model['a'] == pytest.approx(1e-7) and model['b'] == pytest.approx(1e-7)
+
+
+def test_records_skip_a_line_cut_short(tmp_path):
+    path = tmp_path / 'run_telemetry.jsonl'
+    path.write_text('{"seconds": 1.0, "timesteps": 10}\n\n{"seconds": 2.0, "time')   # killed mid-write
+    assert records([str(path)]) == [{'seconds': 1.0, 'timesteps': 10}]
@@ -0,0 +1,21 @@
+import numpy as np
+
+import polariton_fit
+
+
+def test_polariton_fit_recovers_parameters():
+    truth = np.array([2.10, 0.20, 0.93])
+    E_LSP = np.linspace(1.7, 2.8, 12)
+    E_UP, E_LP, _, _ = polariton_fit._model(truth[None, :], E_LSP[None, :])
+    best, ci = polariton_fit.fit(E_LSP, E_UP[0], E_LP[0], n_boot=20)
+    np.testing.assert_allclose(best, truth, atol=1e-6)
+    assert np.all(ci[:, 0] <= best + 1e-6) and np.all(best - 1e-6 <= ci[:, 1])
+
+
+def test_polariton_fit_skips_missing_lsp():
+    truth = np.array([2.10, 0.20, 0.93])
+    E_LSP = np.linspace(1.7, 2.8, 12)
+    E_UP, E_LP, _, _ = polariton_fit._model(truth[None, :], E_LSP[None, :])
+    E_LSP[3] = np.nan
+    best, _ = polariton_fit.fit(E_LSP, E_UP[0], E_LP[0], n_boot=5)
+    np.testing.assert_allclose(best, truth, atol=1e-6)
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+mp = pytest.importorskip('meep')
+
+import rcwa
+from transfer_matrix import sheet_source_flux, stack_segments
+from unit_cells import (TDBC, disk_unit_cell, glass, stack_reference, sz, tdbc_layer,
+                        z_glass_top, z_source)
+
+wavelengths = np.array([0.45, 0.55, 0.59, 0.62, 0.75])
+
+
+def half_space_stack(tdbc):
+    """Glass down to the cell edge (no interface in the PML), ITO and optionally a TDBC film."""
+    layers = [mp.Block(size=mp.Vector3(mp.inf, mp.inf, z_glass_top + sz/2),
+                       center=mp.Vector3(0, 0, (z_glass_top - sz/2) / 2), material=glass),
+              stack_reference()[1]]
+    return layers + [tdbc_layer(TDBC)] if tdbc else layers
+
+
+def test_flat_stack_matches_transfer_matrix():
+    cell_size = mp.Vector3(0.3, 0.3, sz)
+    z_trans = z_glass_top + 0.2
+    freqs = 1 / wavelengths
+    T_rcwa, T_tmm = [], []
+    for tdbc in (False, True):
+        geometry = half_space_stack(tdbc)
+        T_rcwa.append(rcwa.transmission(cell_size, geometry, z_source, wavelengths))
+        T_tmm.append(sheet_source_flux(stack_segments(geometry, sz), z_source, z_trans, freqs))
+    np.testing.assert_allclose(T_rcwa[1] / T_rcwa[0], T_tmm[1] / T_tmm[0], rtol=1e-6)
+    assert np.all(T_rcwa[1] / T_rcwa[0] < 1)   # the film absorbs at the exciton
+
+
+def test_disk_is_polarization_independent():
+    cell_size, z_src, _, _, geometry = disk_unit_cell(140, with_tdbc=True)
+    Tx = rcwa.transmission(cell_size, geometry, z_src, wavelengths[:3], 'x')
+    Ty = rcwa.transmission(cell_size, geometry, z_src, wavelengths[:3], 'y')
+    np.testing.assert_allclose(Tx, Ty, rtol=1e-8)
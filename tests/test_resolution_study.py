@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+from resolution_study import richardson
+
+
+@pytest.mark.parametrize('p', [1.0, 2.0])
+def test_richardson_recovers_continuum_limit(p):
+    resolutions = np.array([30, 40, 60, 80])
+    h = 1 / resolutions
+    result = richardson(resolutions, 0.615 + 12.0 * h**p)
+    assert result['monotone']
+    assert result['order'] == pytest.approx(p)
+    assert result['Q0'] == pytest.approx(0.615, abs=1e-9)
+    assert result['C'] == pytest.approx(12.0, rel=1e-6)
+
+
+def test_richardson_flags_non_monotone_ladder():
+    result = richardson([30, 40, 60], [0.60, 0.62, 0.61])
+    assert not result['monotone']
+    assert np.isnan(result['order'])
@@ -0,0 +1,78 @@
+import os
+import signal
+
+import numpy as np
+import pytest
+
+import sweep
+from sweep import run_sweep, schedule
+
+
+def square_or_die(x):
+    if x == 3:
+        os.kill(os.getpid(), signal.SIGKILL)
+    return x * x
+
+
+def test_schedule_packs_small_points():
+    costs = [100, 1, 2, 1, 60, 3, 1]
+    tasks = schedule(costs, processes=2)
+    assert sorted(i for task in tasks for i in task) == list(range(len(costs)))
+    # the two large points run alone, the small ones share tasks of at most one quantum
+    assert [0] in tasks and [4] in tasks
+    quantum = sum(costs) / (4 * 2)
+    for task in tasks:
+        if len(task) > 1:
+            assert sum(costs[i] for i in task) <= quantum
+    # most expensive first
+    totals = [sum(costs[i] for i in task) for task in tasks]
+    assert totals == sorted(totals, reverse=True)
+
+
+def test_schedule_without_packing():
+    costs = np.array([5.0, 1.0, 3.0])
+    assert schedule(costs, processes=4, pack=False) == [[0], [2], [1]]
+
+
+def test_timeout_is_rejected_under_mpi(monkeypatch):
+    monkeypatch.setattr(sweep, '_mpi_ranks', lambda: 4)
+    with pytest.raises(ValueError, match="MPI"):
+        run_sweep(abs, [1, 2], timeout=60)
+
+
+@pytest.mark.parametrize('cost', [None, lambda x: float(x)])
+def test_killed_worker_fails_only_its_point(cost):
+    pytest.importorskip('meep')    # run_sweep asks Meep for the MPI rank count
+    # with a cost, the points are packed and the broken pack is retried point by point
+    results = run_sweep(square_or_die, [1, 2, 3, 4, 5], processes=2, warm_imports=(), quiet=False, cost=cost)
+    assert [r.value for r in results] == [1, 4, None, 16, 25]
+    assert "worker process died" in results[2].error
+    assert all(r.error is None for i, r in enumerate(results) if i != 2)
+
+
+
+calls = []
+failing = set()
+
+
+def square_logged(x):
+    calls.append(x)
+    if x in failing:
+        raise RuntimeError("crash")
+    return x * x
+
+
+def test_checkpoint_resumes_only_missing_points(tmp_path):
+    pytest.importorskip('meep')
+    failing.add(3)
+    first = run_sweep(square_logged, [1, 2, 3], processes=1, checkpoint=tmp_path, settings={'resolution': 40})
+    assert first[2].error is not None
+    # the rerun (with the crash fixed) runs only the point that did not finish
+    failing.clear()
+    calls.clear()
+    rerun = run_sweep(square_logged, [1, 2, 3], processes=1, checkpoint=tmp_path, settings={'resolution': 40})
+    assert [r.value for r in rerun] == [1, 4, 9] and calls == [3]
+    # points stored under other settings are not reused
+    calls.clear()
+    run_sweep(square_logged, [1], processes=1, checkpoint=tmp_path, settings={'resolution': 60})
+    assert calls == [1]
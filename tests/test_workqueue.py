@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip('meep')
+
+import result_cache
+import workqueue
+
+SPEC = {'kind': 'fake', 'size_nm': 100.0}
+
+
+@pytest.fixture
+def broker(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setitem(workqueue.JOBS, 'fake', (lambda spec: {}, lambda spec: spec['size_nm']))
+    # a negative lease has run out as soon as it is granted
+    return workqueue.Broker(str(tmp_path / 'queue.sqlite'), lease=-1.0, max_attempts=2)
+
+
+def test_expired_lease_is_claimed_again(broker):
+    key, = broker.submit([SPEC])
+    assert broker.claim('a') == (key, SPEC)
+    assert broker.claim('b') == (key, SPEC)
+    # a's lease went to b: its heartbeats and results no longer count
+    assert not broker.heartbeat(key, 'a')
+    broker.complete(key, 'a', 1.0)
+    assert broker.jobs([key])[key][0] == 'running'
+    broker.complete(key, 'b', 1.0)
+    assert broker.jobs([key])[key][:2] == ('done', 1.0)
+
+
+def test_failed_job_retries_until_max_attempts(broker):
+    key, = broker.submit([SPEC])
+    broker.claim('a')
+    broker.fail(key, 'a', 'boom 1')
+    assert broker.jobs([key])[key] == ('pending', None, 'boom 1')
+    broker.claim('b')
+    broker.fail(key, 'b', 'boom 2')
+    assert broker.jobs([key])[key][0] == 'failed'
+    assert broker.claim('c') is None
+    assert broker.retry_failed() == 1
+    assert broker.claim('c') == (key, SPEC)
+
+
+def test_most_expensive_job_first(broker):
+    cheap, costly = broker.submit([SPEC, dict(SPEC, size_nm=200.0)])
+    assert broker.claim('a')[0] == costly
+    assert broker.submit([SPEC]) == [cheap]   # already queued
+    assert broker.counts() == {'pending': 2}   # counts requeues the expired lease
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Transfer-matrix solution of the flat glass/ITO(/TDBC) stacks
+============================================================
+
+At normal incidence the reference stacks are 1D problems with a closed-form
+solution. This module evaluates the Meep media directly from their
+susceptibility parameters,
+
+    eps(f) = (1 + i sigma_D / 2 pi f) [eps_inf
+             + sum_Lorentz sigma f_n^2 / (f_n^2 - f^2 - i f gamma_n)
+             - sum_Drude   sigma f_n^2 / (f^2 + i f gamma_n)]
+
+(Meep's e^{-i omega t} convention, frequencies in 1/um), and solves for the
+field radiated by the planar Ex source sitting inside the stack with 2x2
+characteristic matrices, vectorized over frequency. Thousands of
+frequencies take a few milliseconds.
+
+`stack_segments` turns a Meep geometry of laterally infinite blocks into
+z-segments exactly as Meep resolves overlaps (later objects win, gaps are
+vacuum, the outermost segments continue into the PML). `sheet_source_flux`
+returns the upward flux per unit area through z_trans for a unit sheet
+current at z_source.
+
+reference_flux(..., method='tmm') uses this in place of the FDTD stack run;
+running this file prints the deviation from FDTD for the stacks used by
+fig3_fast.py, fig5_exact.py and fig5_proper.py.
+
+Author: ReproAgent
+"""
+
+import meep as mp
+import numpy as np
+
+
+def medium_epsilon(medium, freqs):
+    """Complex permittivity (x component) of a Meep medium at `freqs` (1/um)."""
+    f = np.asarray(freqs, dtype=float)
+    eps = np.full(f.shape, medium.epsilon_diag.x, dtype=complex)
+    for s in medium.E_susceptibilities:
+        if isinstance(s, mp.DrudeSusceptibility):
+            eps -= s.sigma_diag.x * s.frequency**2 / (f**2 + 1j * f * s.gamma)
+        elif isinstance(s, mp.LorentzianSusceptibility):
+            eps += s.sigma_diag.x * s.frequency**2 / (s.frequency**2 - f**2 - 1j * f * s.gamma)
+        else:
+            raise ValueError(f"unsupported susceptibility {type(s).__name__}")
+    return eps * (1 + 1j * medium.D_conductivity_diag.x / (2 * np.pi * f))
+
+
+def _index(eps):
+    n = np.sqrt(eps)
+    return np.where(n.imag < 0, -n, n)
+
+
+def stack_segments(geometry, sz, default_material=mp.Medium()):
+    """
+    [(z0, z1, medium)] covering the cell from bottom to top, for a geometry
+    of laterally infinite blocks. The first and last segments are the
+    half-spaces that run into the PML.
+    """
+    edges = {-sz / 2, sz / 2}
+    for obj in geometry:
+        if not isinstance(obj, mp.Block) or obj.size.x < mp.inf or obj.size.y < mp.inf:
+            raise ValueError("stack must contain only laterally infinite mp.Block layers")
+        for z in (obj.center.z - obj.size.z / 2, obj.center.z + obj.size.z / 2):
+            if -sz / 2 < z < sz / 2:
+                edges.add(z)
+    edges = sorted(edges)
+
+    segments = []
+    for z0, z1 in zip(edges[:-1], edges[1:]):
+        z_mid = (z0 + z1) / 2
+        medium = default_material
+        for obj in geometry:
+            if abs(z_mid - obj.center.z) < obj.size.z / 2:
+                medium = obj.material
+        if segments and segments[-1][2] is medium:
+            segments[-1] = (segments[-1][0], z1, medium)
+        else:
+            segments.append((z0, z1, medium))
+    return segments
+
+
+def _transfer(segments, eps, z_from, z_to, freqs):
+    """
+    (nf, 2, 2) matrices mapping (Ex, Hy) at z_from to z_to. Within a segment
+    of index n, [[cos kd, i sin kd / n], [i n sin kd, cos kd]] with k = 2 pi f n.
+    """
+    M = np.broadcast_to(np.eye(2, dtype=complex), (len(freqs), 2, 2)).copy()
+    lo, hi = min(z_from, z_to), max(z_from, z_to)
+    for (z0, z1, _), e in zip(segments, eps):
+        d = min(z1, hi) - max(z0, lo)
+        if d <= 0:
+            continue
+        n = _index(e)
+        kd = 2 * np.pi * freqs * n * d
+        layer = np.empty_like(M)
+        layer[:, 0, 0] = layer[:, 1, 1] = np.cos(kd)
+        layer[:, 0, 1] = 1j * np.sin(kd) / n
+        layer[:, 1, 0] = 1j * n * np.sin(kd)
+        M = layer @ M
+    if z_to < z_from:
+        # unimodular: the inverse swaps the diagonal and negates the off-diagonal
+        M = np.stack([np.stack([M[:, 1, 1], -M[:, 0, 1]], -1),
+                      np.stack([-M[:, 1, 0], M[:, 0, 0]], -1)], -2)
+    return M
+
+
+def sheet_source_flux(segments, z_source, z_trans, freqs):
+    """
+    Upward flux per unit area through z_trans (Re E* H, Meep's convention)
+    radiated by a unit Ex sheet current at z_source.
+
+    Only outgoing waves exist in the bottom and top half-spaces, E is
+    continuous across the sheet and Hy jumps by the current.
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    eps = [medium_epsilon(medium, freqs) for _, _, medium in segments]
+    z_bot, z_top = segments[0][1], segments[-1][0]
+    n_bot, n_top = _index(eps[0]), _index(eps[-1])
+
+    down = np.stack([np.ones_like(n_bot), -n_bot], -1)   # at z_bot, amplitude a
+    up = np.stack([np.ones_like(n_top), n_top], -1)      # at z_top, amplitude c
+
+    below = np.einsum('fij,fj->fi', _transfer(segments, eps, z_bot, z_source, freqs), down)
+    above = np.einsum('fij,fj->fi', _transfer(segments, eps, z_top, z_source, freqs), up)
+
+    # c * above - a * below = (0, -1)
+    A = np.stack([above, -below], -1)
+    c, _ = np.moveaxis(np.linalg.solve(A, np.array([0, -1], dtype=complex)[None, :, None])[..., 0], -1, 0)
+
+    E, H = np.moveaxis(np.einsum('fij,fj->fi', _transfer(segments, eps, z_top, z_trans, freqs),
+                                 c[:, None] * up), -1, 0)
+    return np.real(np.conj(E) * H)
+
+
+if __name__ == "__main__":
+    import time
+    from reference_flux import reference_deviation
+    from unit_cells import TDBC, TDBC_emission, disk_unit_cell, dpml, stack_reference, sz, tdbc_layer
+
+    resolution = 60
+    _, z_source, z_trans, geometry_ref, _ = disk_unit_cell(140)   # every disk cell measures at this plane
+
+    def band(wl_min, wl_max):
+        return (1/wl_min + 1/wl_max) / 2, 1/wl_min - 1/wl_max
+
+    cases = [
+        ("fig3_fast glass/ITO", geometry_ref, band(0.4, 0.8), 150),
+        ("fig5_exact glass/ITO/TDBC", stack_reference() + [tdbc_layer(TDBC_emission)], band(0.45, 0.70), 100),
+        ("fig5_proper glass/ITO/TDBC", stack_reference() + [tdbc_layer(TDBC_emission)], band(0.45, 0.72), 100),
+    ]
+
+    freqs = np.linspace(1/0.8, 1/0.4, 5000)
+    t0 = time.time()
+    sheet_source_flux(stack_segments(stack_reference() + [tdbc_layer(TDBC)], sz), z_source, z_trans, freqs)
+    print(f"TMM, {len(freqs)} frequencies: {(time.time() - t0) * 1000:.1f} ms")
+
+    for label, geometry, (fcen, df), nfreq in cases:
+        _, _, _, deviation = reference_deviation(geometry, z_source, z_trans, sz, dpml,
+                                                 resolution, fcen, df, nfreq)
+        print(f"{label}: max deviation TMM vs FDTD {deviation:.2%}")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Materials and unit cells of the disk and rod arrays
+===================================================
+
+The fig3 disk and fig4 nanorod arrays (and the fig5 emission sample) sit
+on the same glass/ITO stack, optionally under a conformal TDBC coating.
+Materials, dimensions and the unit-cell geometry are defined here once,
+so that the scripts, the RCWA solver, the planner's cost model and the
+work queue all simulate and price the same structure.
+
+    cell_size, z_source, z_trans, geometry_ref, geometry = \\
+        disk_unit_cell(140, with_tdbc=True, resolution=60)
+
+The reference geometry is the bare glass/ITO stack. With `resolution`,
+the lateral period is snapped to the grid (`grid_length`), so the flux
+plane covers exactly the area Meep integrates over. `tdbc` swaps in a
+TDBC medium of another oscillator strength (`tdbc_medium(f)`); fig5's
+emission sample is TDBC_emission (f = 0.15).
+
+Author: ReproAgent
+"""
+
+import meep as mp
+import numpy as np
+from meep.materials import Al   # Rakic
+
+# Palik Al
+Al_Palik = mp.Medium(
+    epsilon=1.0,
+    E_susceptibilities=[
+        mp.DrudeSusceptibility(frequency=12.10, gamma=0.081, sigma=1.0),
+        mp.LorentzianSusceptibility(frequency=1.21, gamma=0.40, sigma=2.0)
+    ]
+)
+
+# Materials
+glass = mp.Medium(epsilon=1.51**2)
+omega_p_ITO = 1.78e15 / (2 * np.pi * 3e14)
+gamma_ITO = 1.5e14 / (2 * np.pi * 3e14)
+ITO = mp.Medium(epsilon=3.9, E_susceptibilities=[
+    mp.DrudeSusceptibility(frequency=omega_p_ITO, gamma=gamma_ITO, sigma=1.0)
+])
+
+omega_X = 3.22e15 / (2 * np.pi * 3e14)
+gamma_X = 1.0e14 / (2 * np.pi * 3e14)
+f_TDBC = 0.45
+
+
+def tdbc_medium(f):
+    """TDBC J-aggregate with exciton oscillator strength f."""
+    return mp.Medium(epsilon=2.56, E_susceptibilities=[
+        mp.LorentzianSusceptibility(frequency=omega_X, gamma=gamma_X, sigma=f)
+    ])
+
+
+TDBC = tdbc_medium(f_TDBC)
+f_TDBC_emission = 0.15    # fig5 emission sample: 0.25 eV instead of 0.4 eV Rabi splitting
+TDBC_emission = tdbc_medium(f_TDBC_emission)
+
+# Geometry (fig3 disks, fig4 rods)
+diameters_nm = np.array([80, 100, 120, 140, 160, 180, 200])
+lengths_nm = np.array([75, 95, 120, 140, 160, 180, 205])
+h_disk = 0.040
+h_rod = 0.040
+W = 0.040
+h_ITO = 0.030
+h_TDBC = 0.020
+gap = 0.180
+Gamma_x = 0.200
+Gamma_y = 0.150
+
+sz = 2.0
+dpml = 0.4
+
+# planes of the layer stack
+z_bottom = -sz/2 + dpml
+z_glass_top = z_bottom + 0.5
+z_ITO_top = z_glass_top + h_ITO
+z_source = z_glass_top - 0.15
+
+
+def grid_length(length, resolution):
+    """Round a cell length to a whole number of pixels, as Meep does."""
+    return np.floor(length * resolution + 0.5) / resolution
+
+
+def stack_reference():
+    """Glass substrate and ITO film: the reference geometry of every unit cell."""
+    return [
+        mp.Block(size=mp.Vector3(mp.inf, mp.inf, z_glass_top - z_bottom),
+                 center=mp.Vector3(0, 0, (z_glass_top + z_bottom)/2), material=glass),
+        mp.Block(size=mp.Vector3(mp.inf, mp.inf, h_ITO),
+                 center=mp.Vector3(0, 0, z_glass_top + h_ITO/2), material=ITO)
+    ]
+
+
+def tdbc_layer(tdbc=TDBC):
+    """Flat TDBC film on the ITO."""
+    return mp.Block(size=mp.Vector3(mp.inf, mp.inf, h_TDBC),
+                    center=mp.Vector3(0, 0, z_ITO_top + h_TDBC/2), material=tdbc)
+
+
+def _cell(sx, sy, resolution):
+    if resolution is not None:
+        sx, sy = grid_length(sx, resolution), grid_length(sy, resolution)
+    return mp.Vector3(sx, sy, sz)
+
+
+def disk_unit_cell(D_nm, with_tdbc=False, tdbc=TDBC, resolution=None):
+    """(cell_size, z_source, z_trans, geometry_ref, geometry) of one fig3 disk cell."""
+    D = D_nm / 1000
+    z_trans = z_ITO_top + h_disk + h_TDBC + 0.15
+    cell_size = _cell(D + gap, D + gap, resolution)
+
+    geometry_ref = stack_reference()
+    geometry = geometry_ref.copy()
+    if with_tdbc:
+        geometry.append(tdbc_layer(tdbc))
+        geometry.append(mp.Cylinder(radius=D/2 + h_TDBC, height=h_disk + h_TDBC,
+                                    center=mp.Vector3(0, 0, z_ITO_top + (h_disk + h_TDBC)/2), material=tdbc))
+    geometry.append(mp.Cylinder(radius=D/2, height=h_disk,
+                                center=mp.Vector3(0, 0, z_ITO_top + h_disk/2), material=Al))
+    return cell_size, z_source, z_trans, geometry_ref, geometry
+
+
+def rod_unit_cell(L_nm, with_tdbc=False, tdbc=TDBC, resolution=None):
+    """(cell_size, z_source, z_trans, geometry_ref, geometry) of one fig4 nanorod cell."""
+    L = L_nm / 1000
+    z_trans = z_ITO_top + h_rod + h_TDBC + 0.15
+    cell_size = _cell(L + Gamma_x, W + Gamma_y, resolution)
+
+    geometry_ref = stack_reference()
+    geometry = geometry_ref.copy()
+    if with_tdbc:
+        geometry.append(tdbc_layer(tdbc))
+        geometry.append(mp.Ellipsoid(size=mp.Vector3(L + 2*h_TDBC, W + 2*h_TDBC, h_rod + h_TDBC),
+                                     center=mp.Vector3(0, 0, z_ITO_top + (h_rod + h_TDBC)/2), material=tdbc))
+    geometry.append(mp.Ellipsoid(size=mp.Vector3(L, W, h_rod),
+                                 center=mp.Vector3(0, 0, z_ITO_top + h_rod/2), material=Al_Palik))
+    return cell_size, z_source, z_trans, geometry_ref, geometry
+
+
+def inside(obj, x, y, z):
+    """Boolean raster of points (x, y) at height z inside obj."""
+    dx, dy, dz = x - obj.center.x, y - obj.center.y, z - obj.center.z
+    if isinstance(obj, mp.Ellipsoid):
+        return (dx / (obj.size.x/2))**2 + (dy / (obj.size.y/2))**2 + (dz / (obj.size.z/2))**2 <= 1
+    if isinstance(obj, mp.Block):
+        if not all(abs(abs(getattr(e, a)) - 1) < 1e-9 for e, a in zip((obj.e1, obj.e2, obj.e3), 'xyz')):
+            raise ValueError("only axis-aligned blocks are supported")
+        return (abs(dx) <= obj.size.x/2) & (abs(dy) <= obj.size.y/2) & (abs(dz) <= obj.size.z/2)
+    if isinstance(obj, mp.Cylinder):
+        if abs(obj.axis.x) > 1e-9 or abs(obj.axis.y) > 1e-9:
+            raise ValueError("only cylinders along z are supported")
+        return (dx**2 + dy**2 <= obj.radius**2) & (abs(dz) <= obj.height/2)
+    return dx**2 + dy**2 + dz**2 <= obj.radius**2
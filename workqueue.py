@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Multi-node sweep work queue
+===========================
+
+run_sweep and its MPI groups stay on one allocation. The large studies
+are cross-products (diameter x TDBC oscillator strength x polarization x
+resolution) that want any number of hosts. Here a broker hands out
+serialized job specs, one JSON object per simulation:
+
+    {"kind": "transmission", "unit_cell": "disk", "size_nm": 140,
+     "f_tdbc": 0.45, "polarization": "x", "resolution": 60,
+     "wl_min": 0.4, "wl_max": 0.8, "nfreq": 150, "flux_tol": 0.001}
+
+(f_tdbc = 0 is the bare cell). Workers on any host claim a job, run it
+with the function registered for its kind in JOBS, and store the result
+in the shared result store (result_cache.py, under the job's key) before
+marking the job done. The simulation itself also goes through the
+cache, so specs that repeat a run of the scripts cost nothing.
+
+The broker is an SQLite file (WORK_QUEUE, default ./work_queue.sqlite).
+Put it and SIM_CACHE_DIR on a filesystem every worker sees; SQLite needs
+working POSIX locks there, which some NFS mounts lack. For those mounts,
+run the broker file on one host's local disk and the workers on that
+host. A job is claimed under a lease of LEASE seconds. A heartbeat thread
+renews the lease while the job runs. If a worker dies, its lease runs out
+and the job goes back to pending. So does a job that raised, until it
+has been tried MAX_ATTEMPTS times; after that it is marked failed with
+its traceback. Pending jobs are served most expensive first
+(planner.job_cost), so long runs do not start last.
+
+    python workqueue.py submit --unit-cell disk --sizes 80 100 120 140 160 180 200 \\
+        --f-tdbc 0 0.3 0.45 0.6 --polarizations x y --resolutions 40 60
+    python workqueue.py work --processes 8      # on every host
+    python workqueue.py status
+
+From a script, `queue_sweep(specs)` submits, waits and returns
+SweepResults, so sweep_spectra applies as for run_sweep.
+
+Author: ReproAgent
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+
+import rcwa
+from planner import unit_cell_cost
+from result_cache import load, store
+from sweep import SweepResult, default_processes
+from unit_cells import disk_unit_cell, f_TDBC, rod_unit_cell, tdbc_medium
+
+WORK_QUEUE = os.environ.get('WORK_QUEUE', 'work_queue.sqlite')
+LEASE = 300.0          # s a claim stays valid without a heartbeat
+MAX_ATTEMPTS = 3       # tries per job before it is marked failed
+POLL = 10.0            # s between looks at an empty queue
+
+UNIT_CELLS = {'disk': disk_unit_cell, 'rod': rod_unit_cell}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    key TEXT PRIMARY KEY,
+    spec TEXT NOT NULL,
+    cost REAL NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    elapsed REAL,
+    error TEXT
+)
+"""
+
+
+def job_key(spec):
+    """Key of a job spec in the broker and the result store."""
+    payload = json.dumps(spec, sort_keys=True, separators=(',', ':'))
+    return 'job-' + hashlib.sha256(payload.encode()).hexdigest()
+
+
+# -- jobs ------------------------------------------------------------------------
+
+def _unit_cell(name, f_tdbc):
+    """Unit cell with the TDBC Lorentzian at oscillator strength f_tdbc."""
+    if f_tdbc == f_TDBC:
+        return UNIT_CELLS[name]
+    return functools.partial(UNIT_CELLS[name], tdbc=tdbc_medium(f_tdbc))
+
+
+def transmission_job(spec):
+    """Normalized transmission of a unit cell, as rcwa.meep_transmission runs it."""
+    wl, T = rcwa.meep_transmission(
+        _unit_cell(spec['unit_cell'], spec['f_tdbc']), spec['size_nm'], spec['f_tdbc'] > 0,
+        spec['polarization'], spec['resolution'], spec['wl_min'], spec['wl_max'],
+        spec['nfreq'], spec['flux_tol'])
+    return {'wavelengths': wl, 'T': T}
+
+
+def transmission_cost(spec):
+    cost = unit_cell_cost(_unit_cell(spec['unit_cell'], spec['f_tdbc']), spec['resolution'],
+                          spec['nfreq'], symmetry=1)
+    return cost(spec['size_nm'], spec['f_tdbc'] > 0)
+
+
+# kind -> (run(spec) -> dict of arrays, cost(spec) -> planner cost units)
+JOBS = {'transmission': (transmission_job, transmission_cost)}
+
+
+def transmission_specs(unit_cell, sizes_nm, f_tdbc=(0, f_TDBC), polarizations=('x',),
+                       resolutions=(60,), wl_min=0.4, wl_max=0.8, nfreq=150, flux_tol=1e-3):
+    """Job specs of the full cross-product."""
+    return [{'kind': 'transmission', 'unit_cell': unit_cell, 'size_nm': float(size),
+             'f_tdbc': float(f), 'polarization': pol, 'resolution': int(resolution),
+             'wl_min': wl_min, 'wl_max': wl_max, 'nfreq': int(nfreq), 'flux_tol': flux_tol}
+            for size in sizes_nm for f in f_tdbc for pol in polarizations for resolution in resolutions]
+
+
+# -- broker ----------------------------------------------------------------------
+
+class Broker:
+    """SQLite-backed job table with leases, heartbeats and retries."""
+
+    def __init__(self, path=WORK_QUEUE, lease=LEASE, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute(_SCHEMA)
+
+    def _transaction(self):
+        self.db.execute('BEGIN IMMEDIATE')
+
+    def submit(self, specs):
+        """Queue specs not queued or stored yet; returns their keys in order."""
+        keys = [job_key(spec) for spec in specs]
+        new = []
+        for key, spec in zip(keys, specs):
+            if self.db.execute('SELECT 1 FROM jobs WHERE key = ?', (key,)).fetchone():
+                continue
+            done = load(key) is not None
+            cost = 0.0 if done else float(JOBS[spec['kind']][1](spec))
+            new.append((key, json.dumps(spec), cost, 'done' if done else 'pending'))
+        self._transaction()
+        self.db.executemany('INSERT OR IGNORE INTO jobs (key, spec, cost, state) VALUES (?, ?, ?, ?)', new)
+        self.db.execute('COMMIT')
+        return keys
+
+    def _expire(self, now):
+        """Jobs whose lease ran out go back to pending (or fail after max_attempts)."""
+        self.db.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                        "error = 'lease expired on ' || worker, worker = NULL "
+                        "WHERE state = 'running' AND lease_until < ?", (self.max_attempts, now))
+
+    def claim(self, worker):
+        """(key, spec) of the most expensive pending job, now leased to worker, or None."""
+        now = time.time()
+        self._transaction()
+        try:
+            self._expire(now)
+            row = self.db.execute("SELECT key, spec FROM jobs WHERE state = 'pending' "
+                                  "ORDER BY cost DESC LIMIT 1").fetchone()
+            if row is not None:
+                self.db.execute("UPDATE jobs SET state = 'running', worker = ?, attempts = attempts + 1, "
+                                "lease_until = ? WHERE key = ?", (worker, now + self.lease, row[0]))
+        finally:
+            self.db.execute('COMMIT')
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def heartbeat(self, key, worker):
+        """Renew worker's lease on key; False if the lease was lost."""
+        cursor = self.db.execute("UPDATE jobs SET lease_until = ? WHERE key = ? AND worker = ? "
+                                 "AND state = 'running'", (time.time() + self.lease, key, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, key, worker, elapsed):
+        self.db.execute("UPDATE jobs SET state = 'done', elapsed = ?, error = NULL WHERE key = ? AND worker = ?",
+                        (elapsed, key, worker))
+
+    def fail(self, key, worker, error):
+        """Record a failed attempt: pending again, or failed after max_attempts."""
+        self.db.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                        "worker = NULL, error = ? WHERE key = ? AND worker = ?",
+                        (self.max_attempts, error, key, worker))
+
+    def counts(self):
+        """{state: number of jobs}, with leases that ran out requeued first."""
+        self._transaction()
+        self._expire(time.time())
+        self.db.execute('COMMIT')
+        return dict(self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+
+    def jobs(self, keys):
+        """{key: (state, elapsed, error)} of the given keys."""
+        rows = self.db.execute('SELECT key, state, elapsed, error FROM jobs').fetchall()
+        wanted = set(keys)
+        return {row[0]: row[1:] for row in rows if row[0] in wanted}
+
+    def retry_failed(self):
+        """Give failed jobs a fresh set of attempts; returns the count."""
+        return self.db.execute("UPDATE jobs SET state = 'pending', attempts = 0 WHERE state = 'failed'").rowcount
+
+
+# -- workers ---------------------------------------------------------------------
+
+def _heartbeats(path, key, worker, interval, stop):
+    broker = Broker(path)
+    while not stop.wait(interval):
+        if not broker.heartbeat(key, worker):
+            print(f"  {worker}: lease on {key[:16]} lost", flush=True)
+            return
+
+
+def work(path=WORK_QUEUE, poll=POLL):
+    """Run jobs from the broker until none are pending or running."""
+    broker = Broker(path)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    while True:
+        claimed = broker.claim(worker)
+        if claimed is None:
+            counts = broker.counts()
+            if not counts.get('pending') and not counts.get('running'):
+                return
+            time.sleep(poll)
+            continue
+        key, spec = claimed
+        stop = threading.Event()
+        beat = threading.Thread(target=_heartbeats, args=(path, key, worker, broker.lease / 4, stop),
+                                daemon=True)
+        beat.start()
+        t0 = time.time()
+        try:
+            store(key, JOBS[spec['kind']][0](spec))
+        except Exception:
+            broker.fail(key, worker, traceback.format_exc())
+            print(f"  {worker}: {spec} FAILED", flush=True)
+        else:
+            broker.complete(key, worker, time.time() - t0)
+            print(f"  {worker}: {spec} done ({time.time() - t0:.1f}s)", flush=True)
+        finally:
+            stop.set()
+            beat.join()
+
+
+def queue_sweep(specs, path=WORK_QUEUE, poll=30.0):
+    """
+    Submit specs, wait for the workers, and return SweepResult(spec, (wavelengths, T),
+    error, elapsed) in spec order.
+    """
+    broker = Broker(path)
+    keys = broker.submit(specs)
+    while True:
+        states = broker.jobs(keys)
+        if all(states[k][0] in ('done', 'failed') for k in keys):
+            break
+        counts = broker.counts()
+        print(f"  work queue: {counts.get('done', 0)} done, {counts.get('running', 0)} running, "
+              f"{counts.get('pending', 0)} pending, {counts.get('failed', 0)} failed", flush=True)
+        time.sleep(poll)
+
+    results = []
+    for spec, key in zip(specs, keys):
+        state, elapsed, error = states[key]
+        arrays = load(key) if state == 'done' else None
+        if arrays is None:
+            results.append(SweepResult(spec, None, error or 'result missing from the store', elapsed or 0.0))
+        else:
+            results.append(SweepResult(spec, (arrays['wavelengths'], arrays['T']), None, elapsed or 0.0))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-node sweep work queue")
+    parser.add_argument('--queue', default=WORK_QUEUE, help="broker file (default $WORK_QUEUE)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    submit = commands.add_parser('submit', help="queue a transmission cross-product")
+    submit.add_argument('--unit-cell', choices=sorted(UNIT_CELLS), default='disk')
+    submit.add_argument('--sizes', type=float, nargs='+', required=True)
+    submit.add_argument('--f-tdbc', type=float, nargs='+', default=[0, f_TDBC])
+    submit.add_argument('--polarizations', nargs='+', choices=('x', 'y'), default=['x'])
+    submit.add_argument('--resolutions', type=int, nargs='+', default=[60])
+    submit.add_argument('--nfreq', type=int, default=150)
+    worker = commands.add_parser('work', help="run jobs until the queue is empty")
+    worker.add_argument('--processes', type=int, default=default_processes())
+    status = commands.add_parser('status', help="job counts and failures")
+    status.add_argument('--retry-failed', action='store_true')
+    args = parser.parse_args()
+
+    if args.command == 'submit':
+        specs = transmission_specs(args.unit_cell, args.sizes, args.f_tdbc, args.polarizations,
+                                   args.resolutions, nfreq=args.nfreq)
+        Broker(args.queue).submit(specs)
+        print(f"Submitted {len(specs)} jobs to {args.queue}")
+    elif args.command == 'work':
+        workers = [multiprocessing.get_context('fork').Process(target=work, args=(args.queue,))
+                   for _ in range(args.processes)]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join()
+    else:
+        broker = Broker(args.queue)
+        if args.retry_failed:
+            print(f"Requeued {broker.retry_failed()} failed jobs")
+        for state, n in sorted(broker.counts().items()):
+            print(f"{state:8s} {n}")
+        for (error,) in broker.db.execute("SELECT error FROM jobs WHERE state = 'failed' LIMIT 3"):
+            print("\n" + error.strip().splitlines()[-1])